@@ -0,0 +1,97 @@
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, pyqtSignal
+
+import data_operations
+
+# Worker threads for database calls; a few are enough to overlap UI queries with ingest
+DB_WORKERS = 4
+
+
+class _ResultRelay(QObject):
+    # Emitted from a worker thread, delivered on the thread the relay lives on (the Qt thread)
+    finished = pyqtSignal(object, object, object)  # future, callback, errback
+
+
+class AsyncDataOperations:
+    """Runs data_operations calls on a DB worker pool.
+
+    Every call returns a concurrent.futures.Future right away. When a
+    callback is given it is called with the result on the Qt event loop
+    thread (errback with the exception), so slots can touch widgets
+    directly. Create it on the GUI thread.
+
+    Long maintenance jobs go through submit_background() instead, one at
+    a time on their own thread, so they never hold up UI queries. File
+    work that needs no connection, like converting imports, goes through
+    submit_files() on another thread of its own.
+    """
+    def __init__(self, max_workers=DB_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db-worker')
+        self._background = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-background')
+        self._files = ThreadPoolExecutor(max_workers=1, thread_name_prefix='file-work')
+        self._relay = _ResultRelay()
+        self._relay.finished.connect(self._deliver)
+
+    def submit(self, fn, *args, callback=None, errback=None, **kwargs):
+        return self._submit(self._executor, fn, args, kwargs, callback, errback)
+
+    def submit_background(self, fn, *args, callback=None, errback=None, **kwargs):
+        return self._submit(self._background, fn, args, kwargs, callback, errback)
+
+    def submit_files(self, fn, *args, callback=None, errback=None, **kwargs):
+        return self._submit(self._files, fn, args, kwargs, callback, errback)
+
+    def _submit(self, executor, fn, args, kwargs, callback, errback):
+        future = executor.submit(fn, *args, **kwargs)
+        if callback is not None or errback is not None:
+            future.add_done_callback(lambda f: self._relay.finished.emit(f, callback, errback))
+        return future
+
+    def _deliver(self, future, callback, errback):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            if errback is not None:
+                errback(error)
+            else:
+                print(f"Database call failed: {error}")
+        elif callback is not None:
+            callback(future.result())
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+        self._background.shutdown(wait=wait, cancel_futures=not wait)
+        self._files.shutdown(wait=wait, cancel_futures=not wait)
+
+    # Facade over data_operations, same arguments plus callback/errback
+
+    def insert_song(self, *args, callback=None, errback=None, **kwargs):
+        return self.submit(data_operations.insert_song, *args, callback=callback, errback=errback, **kwargs)
+
+    def insert_songs(self, records, callback=None, errback=None, **kwargs):
+        return self.submit(data_operations.insert_songs, records, callback=callback, errback=errback, **kwargs)
+
+    def retrieve_song(self, conditions=None, callback=None, errback=None, **kwargs):
+        # Streaming is pointless across threads, results always arrive as a list
+        kwargs.pop('stream', None)
+        return self.submit(data_operations.retrieve_song, conditions, callback=callback, errback=errback, **kwargs)
+
+    def get_all_song(self, callback=None, errback=None, **kwargs):
+        kwargs.pop('stream', None)
+        return self.submit(data_operations.get_all_song, callback=callback, errback=errback, **kwargs)
+
+    def search_songs(self, query, callback=None, errback=None, **kwargs):
+        return self.submit(data_operations.search_songs, query, callback=callback, errback=errback, **kwargs)
+
+    def get_cover(self, cover_id, callback=None, errback=None):
+        return self.submit(data_operations.get_cover, cover_id, callback=callback, errback=errback)
+
+    def update_song(self, id, callback=None, errback=None, **kwargs):
+        return self.submit(data_operations.update_song, id, callback=callback, errback=errback, **kwargs)
+
+    def delete_music(self, id, callback=None, errback=None):
+        return self.submit(data_operations.delete_music, id, callback=callback, errback=errback)
+
+    def delete_songs(self, ids, callback=None, errback=None):
+        return self.submit(data_operations.delete_songs, ids, callback=callback, errback=errback)
@@ -0,0 +1,624 @@
+import subprocess
+import threading
+import time
+
+from db_connection import LatencyHistogram
+from metadata_cache import metadata_cache
+from pcm_cache import FFMPEG, PCMAudio, pcm_cache
+
+# The engine mixes in numpy; without it MusicPlayer stays on pygame.mixer.music
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# The pygame sink is optional too, the null sink needs neither pygame nor a sound card
+try:
+    import pygame
+except ImportError:
+    pygame = None
+
+ENGINE_SAMPLE_RATE = 44100
+ENGINE_CHANNELS = 2
+# Frames rendered and handed to the sink at a time, about 46 ms at 44.1 kHz
+BLOCK_FRAMES = 2048
+# Audio rendered ahead of the sink; a seek throws this much away and renders again
+RING_SECONDS = 0.5
+
+# Crossfade curves: t in [0, 1] -> (gain of the outgoing track, gain of the incoming one)
+CROSSFADE_CURVES = {
+    'linear': lambda t: (1.0 - t, t),
+    'equal_power': lambda t: (np.cos(t * np.pi / 2), np.sin(t * np.pi / 2)),
+    'smooth': lambda t: (1.0 - t * t * (3 - 2 * t), t * t * (3 - 2 * t)),
+}
+
+
+def available():
+    return np is not None
+
+
+class PCMSource:
+    """A track read from decoded audio mapped by the PCM cache."""
+    def __init__(self, audio, channels, gain=1.0, key=None):
+        self.audio = audio
+        self.channels = channels
+        self.gain = gain
+        self.key = key
+        self.sample_rate = audio.sample_rate
+        self.total_frames = audio.frames
+        self._frames = audio.array()
+        self._position = 0
+
+    @property
+    def position(self):
+        return self._position / self.sample_rate
+
+    @property
+    def remaining(self):
+        return self.total_frames - self._position
+
+    def read(self, frames):
+        block = self._frames[self._position:self._position + frames]
+        self._position += len(block)
+        block = block.astype(np.float32) * (1 / 32768)
+        if block.shape[1] != self.channels:
+            block = np.repeat(block[:, :1], self.channels, axis=1)  # mono to stereo
+        return block
+
+    def fill(self, frames):
+        pass  # mapped, nothing to read ahead
+
+    def ready(self, frames):
+        return True
+
+    def seek(self, seconds):
+        self._position = min(max(int(seconds * self.sample_rate), 0), self.total_frames)
+
+    def close(self):
+        del self._frames
+        self.audio.close()
+
+
+class FFmpegSource:
+    """A track decoded on the fly by an ffmpeg process, for files not in the PCM cache.
+
+    Only the render thread talks to ffmpeg: fill() starts the process and
+    reads ahead, outside the engine lock, and read() hands out what fill()
+    buffered without blocking. seek() just records where to start again.
+    """
+    def __init__(self, path, sample_rate, channels, gain=1.0, key=None, start=0.0):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.gain = gain
+        self.key = key
+        # Only an estimate from the metadata, set on the first fill(); the crossfade starts
+        # from it and the stream ends when ffmpeg does
+        self.total_frames = None
+        self._lock = threading.Lock()  # buffer and seek state, never held while reading the pipe
+        self._buffer = bytearray()
+        self._process = None
+        self._ended = False
+        self._generation = 0           # bumped by every seek, a read in flight for an older one is dropped
+        self.seek(start)
+
+    @property
+    def position(self):
+        return self._position / self.sample_rate
+
+    @property
+    def remaining(self):
+        return max(self.total_frames - self._position, 0) if self.total_frames is not None else None
+
+    def seek(self, seconds):
+        with self._lock:
+            self._start = max(seconds, 0.0)
+            self._position = int(self._start * self.sample_rate)
+            self._buffer.clear()
+            self._ended = False
+            self._generation += 1
+
+    def ready(self, frames):
+        # read(frames) can be served without waiting on ffmpeg
+        with self._lock:
+            return self._start is None and (self._ended or len(self._buffer) >= frames * 2 * self.channels)
+
+    def fill(self, frames):
+        # Read until frames are buffered or the stream ends; blocks on ffmpeg
+        with self._lock:
+            start, self._start = self._start, None
+            generation = self._generation
+        if start is not None:
+            self._finish()
+            if self.total_frames is None:
+                duration = metadata_cache.duration(self.path)
+                self.total_frames = int(duration * self.sample_rate) if duration else None
+            self._process = subprocess.Popen(
+                [FFMPEG, '-nostdin', '-v', 'error', '-ss', f"{start:.3f}", '-i', self.path,
+                 '-f', 's16le', '-acodec', 'pcm_s16le', '-ar', str(self.sample_rate), '-ac', str(self.channels), '-'],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        frame_bytes = 2 * self.channels
+        while True:
+            with self._lock:
+                need = frames * frame_bytes - len(self._buffer)
+                if generation != self._generation or need <= 0 or self._ended:
+                    return
+            data = self._process.stdout.read(need) if self._process is not None else b''
+            with self._lock:
+                if generation != self._generation:
+                    return  # seeked meanwhile, the next fill() starts over
+                if not data:
+                    self._ended = True
+                    return
+                self._buffer += data
+
+    def read(self, frames):
+        frame_bytes = 2 * self.channels
+        with self._lock:
+            size = min(frames * frame_bytes, len(self._buffer))
+            size -= size % frame_bytes
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            self._position += size // frame_bytes
+        samples = np.frombuffer(data, dtype='<i2')
+        return samples.reshape(-1, self.channels).astype(np.float32) * (1 / 32768)
+
+    def _finish(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.stdout.close()
+            self._process.wait()
+            self._process = None
+
+    def close(self):
+        self._finish()
+
+
+def open_source(path, sample_rate, channels, gain=1.0, key=None, start=0.0):
+    """A source for path at the engine's format: mapped PCM when cached, ffmpeg otherwise."""
+    cached = pcm_cache.cached_path(path)
+    if cached is not None:
+        try:
+            audio = PCMAudio(cached)
+        except (OSError, ValueError) as e:
+            print(f"Error opening decoded audio for {path}: {e}")
+        else:
+            if audio.sample_rate == sample_rate and audio.channels in (1, channels):
+                source = PCMSource(audio, channels, gain, key)
+                source.seek(start)
+                return source
+            audio.close()
+            path = cached  # ffmpeg resamples the decoded copy, cheaper than decoding again
+    return FFmpegSource(path, sample_rate, channels, gain, key, start)
+
+
+class RingBuffer:
+    """Fixed-size float32 frame ring between the render thread and the sink.
+
+    Events written with a block fire when the sink reads past the frame
+    they were written at, so listeners hear about a track change when its
+    audio reaches the sink rather than when it was rendered.
+    """
+    def __init__(self, frames, channels):
+        self._data = np.zeros((frames, channels), dtype=np.float32)
+        self._lock = threading.Lock()
+        self._events = []  # (absolute frame, event, key, generation)
+        self.written = 0   # frames written since creation
+        self.read_frames = 0
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    @property
+    def space(self):
+        with self._lock:
+            return self.capacity - (self.written - self.read_frames)
+
+    def write(self, block, events=()):
+        with self._lock:
+            start = self.written
+            for offset, *event in events:
+                self._events.append((start + offset, *event))
+            index = start % self.capacity
+            first = min(len(block), self.capacity - index)
+            self._data[index:index + first] = block[:first]
+            self._data[:len(block) - first] = block[first:]
+            self.written += len(block)
+
+    def read(self, frames):
+        # (block of up to frames frames, events that are due), the block is a copy
+        with self._lock:
+            frames = min(frames, self.written - self.read_frames)
+            index = self.read_frames % self.capacity
+            first = min(frames, self.capacity - index)
+            block = np.concatenate((self._data[index:index + first], self._data[:frames - first]))
+            self.read_frames += frames
+            due = [event for event in self._events if event[0] <= self.read_frames]
+            if due:
+                self._events = self._events[len(due):]
+        return block, due
+
+    def clear(self):
+        # Drop everything not read yet, frame counters keep counting
+        with self._lock:
+            self.written = self.read_frames
+            self._events = []
+
+
+class NullSink:
+    """Discards audio, paced like a sound card or as fast as the engine renders.
+
+    For tests and benchmarks on machines without audio output; frames
+    counts what was consumed.
+    """
+    def __init__(self, sample_rate=ENGINE_SAMPLE_RATE, channels=ENGINE_CHANNELS, realtime=True):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.realtime = realtime
+        self.latency_frames = 0
+        self.frames = 0
+        self._pull = None
+        self._running = False
+        self._paused = False
+        self._thread = None
+
+    def start(self, pull):
+        self._pull = pull
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='null-sink', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        block_seconds = BLOCK_FRAMES / self.sample_rate
+        next_due = time.monotonic()
+        while self._running:
+            block = None if self._paused else self._pull(BLOCK_FRAMES)
+            if block is not None:
+                self.frames += len(block)
+            if self.realtime or block is None:
+                next_due += block_seconds
+                delay = next_due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_due = time.monotonic()
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+
+
+class PygameSink:
+    """Plays blocks through a reserved pygame mixer channel.
+
+    Keeps one block playing and one queued on the channel, so the sound
+    card never waits on Python for longer than a block.
+    """
+    def __init__(self):
+        if pygame is None:
+            raise RuntimeError("The pygame sink needs pygame")
+        if not pygame.mixer.get_init():
+            pygame.mixer.init(frequency=ENGINE_SAMPLE_RATE, size=-16, channels=ENGINE_CHANNELS)
+        self.sample_rate, size, self.channels = pygame.mixer.get_init()
+        if size != -16:
+            raise RuntimeError(f"The pygame sink needs a 16-bit mixer, not {size}")
+        pygame.mixer.set_reserved(1)
+        self._channel = pygame.mixer.Channel(0)
+        self.latency_frames = BLOCK_FRAMES * 3 // 2  # half the playing block plus the queued one
+        self._pull = None
+        self._running = False
+        self._thread = None
+
+    def start(self, pull):
+        self._pull = pull
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='pygame-sink', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        poll = BLOCK_FRAMES / self.sample_rate / 4
+        while self._running:
+            if self._channel.get_queue() is None:
+                block = self._pull(BLOCK_FRAMES)
+                if block is not None and len(block):
+                    samples = np.clip(block * 32767, -32768, 32767).astype('<i2')
+                    sound = pygame.mixer.Sound(buffer=samples.tobytes())
+                    if self._channel.get_busy():
+                        self._channel.queue(sound)
+                    else:
+                        self._channel.play(sound)
+            time.sleep(poll)
+
+    def pause(self):
+        self._channel.pause()
+
+    def resume(self):
+        self._channel.unpause()
+
+    def flush(self):
+        # Stop what the channel already holds, e.g. after a seek
+        self._channel.stop()
+
+    def close(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+        self._channel.stop()
+
+
+class AudioEngine:
+    """Streams tracks to a sink, with gapless handoff and crossfades.
+
+    A render thread pulls decoded PCM from the current source (and the
+    queued one while crossfading), mixes them with their track gains and
+    the crossfade curve, and writes the result into a ring buffer the
+    sink reads from. Volume is applied as the sink reads, so it changes
+    immediately. Listeners added with add_listener are called with
+    ('start', key) when a queued track becomes audible, ('end', key) when
+    a track finishes and ('idle', None) when nothing is left to play,
+    plus the generation the event belongs to. They run on the sink's
+    thread, when the audio reaches the sink; an event whose generation
+    is older than the engine's came before the last play() or stop().
+    """
+    def __init__(self, sink=None, crossfade=0.0, curve='equal_power'):
+        if np is None:
+            raise RuntimeError("The audio engine needs numpy")
+        self.sink = sink if sink is not None else PygameSink()
+        self.sample_rate = self.sink.sample_rate
+        self.channels = self.sink.channels
+        self.volume = 1.0
+        self.render_times = LatencyHistogram()
+        self.underruns = 0
+        self.generation = 0  # bumped by play() and stop()
+        self._listeners = []
+        self._lock = threading.RLock()
+        self._wake = threading.Event()  # set whenever there may be something to render
+        self._ring = RingBuffer(int(RING_SECONDS * self.sample_rate) // BLOCK_FRAMES * BLOCK_FRAMES or BLOCK_FRAMES,
+                                self.channels)
+        self._current = None
+        self._incoming = None       # the track being faded in, while crossfading
+        self._next = None           # the queued track, after the incoming one when fading
+        self._retired = []          # sources dropped by the caller's thread, closed by the render thread
+        self._fade_position = None  # frames into the crossfade, None when not fading
+        self._fade_frames = 0
+        self._anchor = (0, 0.0)     # (ring frame, track seconds) the position counts from
+        self._paused = False
+        self._closed = False
+        self.set_crossfade(crossfade, curve)
+        self._thread = threading.Thread(target=self._render_loop, name='audio-engine', daemon=True)
+        self._thread.start()
+        self.sink.start(self._pull)
+
+    def add_listener(self, listener):
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def set_crossfade(self, seconds, curve=None):
+        if curve is not None:
+            if curve not in CROSSFADE_CURVES:
+                raise ValueError(f"Unknown crossfade curve: {curve!r}")
+            self.curve = curve
+        self.crossfade = max(seconds, 0.0)
+
+    def set_volume(self, volume):
+        self.volume = max(volume, 0.0)
+
+    @property
+    def paused(self):
+        return self._paused
+
+    @property
+    def playing(self):
+        # Something is loaded, whether or not it is paused
+        return self._current is not None
+
+    @property
+    def position(self):
+        # Seconds into the audible track, as far as the sink has got
+        frame, seconds = self._anchor
+        return seconds + max(self._ring.read_frames - frame, 0) / self.sample_rate
+
+    def play(self, path, gain=1.0, key=None, start=0.0):
+        source = open_source(path, self.sample_rate, self.channels, gain, key, start)
+        with self._lock:
+            self._drop_sources()
+            self._current = source
+            self.generation += 1
+            self._restart(start)
+            self._paused = False
+            self.sink.resume()
+        self._wake.set()
+
+    def queue(self, path, gain=1.0, key=None):
+        """Play path after the current track, crossfading if one is set. None clears the queue.
+
+        While crossfading, path plays after the track being faded in.
+        """
+        source = open_source(path, self.sample_rate, self.channels, gain, key) if path else None
+        with self._lock:
+            if self._next is not None:
+                self._retired.append(self._next)
+            self._next = source
+        self._wake.set()
+
+    def set_gain(self, gain, key=None):
+        # Change a loaded track's gain, e.g. once its loudness has been measured
+        with self._lock:
+            for source in (self._current, self._incoming, self._next):
+                if source is not None and source.key == key:
+                    source.gain = gain
+
+    def pause(self):
+        with self._lock:
+            self._paused = True
+            self.sink.pause()
+
+    def resume(self):
+        with self._lock:
+            self._paused = False
+            self.sink.resume()
+        self._wake.set()
+
+    def seek(self, seconds):
+        with self._lock:
+            if self._current is None:
+                return
+            if self._incoming is not None:
+                # Seeking mid-crossfade stays on the incoming track, the outgoing one is done
+                self._retired.append(self._current)
+                self._current, self._incoming = self._incoming, None
+            self._fade_position = None
+            self._current.seek(seconds)
+            self._restart(self._current.position)
+        self._wake.set()
+
+    def stop(self):
+        with self._lock:
+            self._drop_sources()
+            self.generation += 1
+            self._restart(0.0)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._drop_sources()
+        self._wake.set()
+        self.sink.close()
+        self._thread.join(timeout=1)
+
+    def _drop_sources(self):
+        self._retired.extend(source for source in (self._current, self._incoming, self._next) if source is not None)
+        self._current = self._incoming = self._next = None
+        self._fade_position = None
+
+    def _restart(self, seconds):
+        # Throw away what was rendered and count the position from here
+        self._ring.clear()
+        self.sink.flush()
+        self._anchor = (self._ring.read_frames + self.sink.latency_frames, seconds)
+
+    def _pull(self, frames):
+        # Called by the sink: the next block with volume applied, None while paused or idle
+        if self._paused:
+            return None
+        block, events = self._ring.read(frames)
+        if len(block) < frames and self._current is not None:
+            self.underruns += 1
+        self._wake.set()  # never the lock here, rendering may hold it while ffmpeg catches up
+        for frame, event, key, generation in events:
+            if event == 'start':
+                self._anchor = (frame + self.sink.latency_frames, 0.0)
+            for listener in list(self._listeners):
+                try:
+                    listener(event, key, generation)
+                except Exception as e:
+                    print(f"Audio engine listener failed: {e}")
+        if not len(block):
+            return None
+        if self.volume != 1.0:
+            block *= self.volume
+        return block
+
+    def _render_loop(self):
+        while True:
+            self._wake.clear()
+            with self._lock:
+                retired, self._retired = self._retired, []
+                if self._closed:
+                    break
+                ready = not self._paused and self._current is not None and self._ring.space >= BLOCK_FRAMES
+                sources = [source for source in (self._current, self._incoming, self._next) if source is not None]
+            for source in retired:
+                source.close()
+            if not ready:
+                self._wake.wait(0.1)
+                continue
+            # Decoding happens out here, so play, seek and pause never wait on ffmpeg
+            for source in sources:
+                source.fill(BLOCK_FRAMES)
+            with self._lock:
+                # Sources swapped in meanwhile have nothing buffered yet, they are filled next time round
+                if (self._paused or self._current is None or self._ring.space < BLOCK_FRAMES
+                        or not all(source.ready(BLOCK_FRAMES)
+                                   for source in (self._current, self._incoming, self._next)
+                                   if source is not None)):
+                    continue
+                started = time.perf_counter()
+                block, events = self._render(BLOCK_FRAMES)
+                self._ring.write(block, [(*event, self.generation) for event in events])
+                self.render_times.record(time.perf_counter() - started)
+        for source in retired + [self._current, self._incoming, self._next]:
+            if source is not None:
+                source.close()
+
+    def _render(self, frames):
+        out = np.zeros((frames, self.channels), dtype=np.float32)
+        events = []
+        filled = 0
+        while filled < frames and self._current is not None:
+            current = self._current
+            crossfade_frames = int(self.crossfade * self.sample_rate)
+            if (self._fade_position is None and self._next is not None and crossfade_frames
+                    and current.remaining is not None and current.remaining <= crossfade_frames):
+                # Close enough to the end: the queued track starts now and the two are mixed,
+                # leaving the queue free for the track after it
+                self._incoming, self._next = self._next, None
+                self._fade_position = 0
+                self._fade_frames = max(current.remaining, 1)
+                events.append((filled, 'start', self._incoming.key))
+
+            if self._fade_position is not None:
+                incoming = self._incoming
+                count = min(frames - filled, self._fade_frames - self._fade_position)
+                outgoing_block = current.read(count)
+                t = (self._fade_position + np.arange(count, dtype=np.float32)) / self._fade_frames
+                fade_out, fade_in = CROSSFADE_CURVES[self.curve](t)
+                region = out[filled:filled + count]
+                region[:len(outgoing_block)] += outgoing_block * (current.gain * np.asarray(fade_out)[:len(outgoing_block), None])
+                if incoming is not None:
+                    incoming_block = incoming.read(count)
+                    region[:len(incoming_block)] += incoming_block * (incoming.gain * np.asarray(fade_in)[:len(incoming_block), None])
+                self._fade_position += count
+                filled += count
+                if incoming is not None and len(incoming_block) < count:
+                    # The incoming track was shorter than the fade, the queued one takes its place
+                    events.append((filled, 'end', incoming.key))
+                    self._retired.append(incoming)
+                    self._incoming, self._next = self._next, None
+                    if self._incoming is not None:
+                        events.append((filled, 'start', self._incoming.key))
+                if self._fade_position >= self._fade_frames or len(outgoing_block) < count:
+                    events.append((filled, 'end', current.key))
+                    self._retired.append(current)
+                    self._current, self._incoming = self._incoming, None
+                    self._fade_position = None
+                    if self._current is None:
+                        events.append((filled, 'idle', None))
+                continue
+
+            block = current.read(frames - filled)
+            out[filled:filled + len(block)] = block * current.gain
+            filled += len(block)
+            if filled < frames:
+                # The track ended inside this block: hand straight over to the queued one, no gap
+                events.append((filled, 'end', current.key))
+                self._retired.append(current)
+                self._current, self._next = self._next, None
+                events.append((filled, 'start', self._current.key) if self._current is not None
+                              else (filled, 'idle', None))
+        return out[:filled] if self._current is None else out, events
@@ -0,0 +1,249 @@
+import os
+import struct
+from collections import namedtuple
+
+# mutagen understands more containers (Ogg, Opus, WMA...), used only when it is installed
+try:
+    import mutagen
+except ImportError:
+    mutagen = None
+
+# Stream properties read from a file's headers; fields that cannot be read are None.
+# bitrate is in bits per second.
+AudioInfo = namedtuple('AudioInfo', 'duration sample_rate channels codec bitrate')
+
+# How far into an MP3 (after the ID3 tag) to look for the first frame
+MP3_SYNC_SEARCH = 64 * 1024
+
+def probe(path):
+    """Return an AudioInfo for path by reading only its container headers.
+
+    Understands WAV, FLAC, MP3 (Xing/Info, VBRI or constant bitrate) and
+    MP4/M4A. Returns None if the file cannot be read or the format is not
+    recognised.
+    """
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            head = f.read(12)
+            if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+                info = _probe_wav(f, size)
+            elif head[4:8] == b'ftyp':
+                info = _probe_mp4(f, size)
+            else:
+                start = _id3v2_size(f)
+                f.seek(start)
+                if f.read(4) == b'fLaC':
+                    info = _probe_flac(f)
+                else:
+                    info = _probe_mp3(f, size, start)
+    except (OSError, struct.error, ValueError) as e:
+        print(f"Error probing {path}: {e}")
+        info = None
+    if info is None and mutagen is not None:
+        info = _probe_mutagen(path)
+    return info
+
+def probe_duration(path):
+    info = probe(path)
+    return info.duration if info else None
+
+def _probe_mutagen(path):
+    try:
+        audio = mutagen.File(path)
+    except Exception as e:
+        print(f"Error probing {path} with mutagen: {e}")
+        return None
+    if audio is None or audio.info is None:
+        return None
+    info = audio.info
+    return AudioInfo(getattr(info, 'length', None), getattr(info, 'sample_rate', None),
+                     getattr(info, 'channels', None), type(audio).__name__.lower(),
+                     getattr(info, 'bitrate', None))
+
+def _id3v2_size(f):
+    # Size of a leading ID3v2 tag, 0 if there is none
+    f.seek(0)
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b'ID3':
+        return 0
+    size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+def _probe_wav(f, size):
+    f.seek(12)
+    fmt = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', f.read(16))
+            f.seek(chunk_size - 16 + (chunk_size & 1), os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if fmt is None:
+                return None
+            audio_format, channels, sample_rate, byte_rate, _, bits = fmt
+            # Streamed WAVs may leave the size at 0 or 0xFFFFFFFF, trust the file size then
+            data_size = min(chunk_size, size - f.tell()) if chunk_size else size - f.tell()
+            codec = 'pcm' if audio_format in (1, 0xFFFE) else 'float' if audio_format == 3 else f'wav-{audio_format}'
+            duration = data_size / byte_rate if byte_rate else None
+            return AudioInfo(duration, sample_rate, channels, codec, byte_rate * 8)
+        else:
+            f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+def _probe_flac(f):
+    # STREAMINFO is always the first metadata block, right after "fLaC"
+    block_header = f.read(4)
+    if len(block_header) < 4 or block_header[0] & 0x7F != 0:
+        return None
+    streaminfo = f.read(34)
+    if len(streaminfo) < 34:
+        return None
+    packed = int.from_bytes(streaminfo[10:18], 'big')
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    bits = ((packed >> 36) & 0x1F) + 1
+    total_samples = packed & 0xFFFFFFFFF
+    if not sample_rate:
+        return None
+    duration = total_samples / sample_rate if total_samples else None
+    return AudioInfo(duration, sample_rate, channels, 'flac', sample_rate * channels * bits)
+
+# kbps by [MPEG-1?][layer index 1..3][bitrate index]
+_MP3_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Hz by MPEG version bits
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+def _parse_mp3_header(header):
+    # (bitrate kbps, sample rate, samples per frame, channels, mpeg1) or None
+    if header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x3
+    layer = 4 - ((header[1] >> 1) & 0x3)
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = _MP3_BITRATES[(mpeg1, layer)][bitrate_index]
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    samples = 384 if layer == 1 else 1152 if (layer == 2 or mpeg1) else 576
+    channels = 1 if (header[3] >> 6) == 3 else 2
+    return bitrate, sample_rate, samples, channels, mpeg1
+
+def _mp3_frame_length(header, parsed):
+    bitrate, sample_rate, samples, _, _ = parsed
+    padding = (header[2] >> 1) & 0x1
+    if samples == 384:
+        return (12 * bitrate * 1000 // sample_rate + padding) * 4
+    return samples // 8 * bitrate * 1000 // sample_rate + padding
+
+def _mp3_frames_follow(data, offset, parsed, at_end, count=2):
+    for _ in range(count):
+        offset += _mp3_frame_length(data[offset:offset + 4], parsed)
+        if offset + 4 > len(data):
+            return at_end  # the file ends here, nothing more to check
+        if not (parsed := _parse_mp3_header(data[offset:offset + 4])):
+            return False
+    return True
+
+def _probe_mp3(f, size, start):
+    f.seek(start)
+    data = f.read(MP3_SYNC_SEARCH)
+    at_end = start + len(data) >= size
+    for offset in range(len(data) - 4):
+        if data[offset] == 0xFF and (parsed := _parse_mp3_header(data[offset:offset + 4])):
+            # Real frames come in a chain, random bytes that look like a header do not
+            if _mp3_frames_follow(data, offset, parsed, at_end):
+                break
+    else:
+        return None
+    bitrate, sample_rate, samples, channels, mpeg1 = parsed
+    frame = data[offset:offset + 200]
+
+    # Xing/Info header sits after the side information of the first frame
+    side_info = (32 if channels == 2 else 17) if mpeg1 else (17 if channels == 2 else 9)
+    xing = frame[4 + side_info:4 + side_info + 12]
+    frames = None
+    if xing[:4] in (b'Xing', b'Info') and len(xing) == 12:
+        flags = struct.unpack('>I', xing[4:8])[0]
+        if flags & 0x1:
+            frames = struct.unpack('>I', xing[8:12])[0]
+    elif frame[36:40] == b'VBRI' and len(frame) >= 54:
+        frames = struct.unpack('>I', frame[50:54])[0]
+
+    audio_bytes = size - start - offset
+    f.seek(max(size - 128, 0))
+    if f.read(3) == b'TAG':  # ID3v1 trailer
+        audio_bytes -= 128
+
+    if frames:
+        duration = frames * samples / sample_rate
+        return AudioInfo(duration, sample_rate, channels, 'mp3', int(audio_bytes * 8 / duration) if duration else None)
+    # No VBR header, assume constant bitrate
+    return AudioInfo(audio_bytes * 8 / (bitrate * 1000), sample_rate, channels, 'mp3', bitrate * 1000)
+
+# Atoms that only contain other atoms, on the path from moov to the sample description
+_MP4_CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+def _mp4_atoms(f, start, end):
+    # Yield (type, payload offset, payload size) for the atoms between start and end
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header:
+            return
+        yield kind, position + header, size - header
+        position += size
+
+def _probe_mp4(f, size):
+    info = {'codec': 'mp4'}
+
+    def walk(start, end):
+        for kind, offset, length in _mp4_atoms(f, start, end):
+            if kind in _MP4_CONTAINERS:
+                walk(offset, offset + length)
+            elif kind == b'mvhd':
+                f.seek(offset)
+                version = f.read(4)[0]
+                if version == 1:
+                    f.seek(16, os.SEEK_CUR)
+                    timescale, duration = struct.unpack('>IQ', f.read(12))
+                else:
+                    f.seek(8, os.SEEK_CUR)
+                    timescale, duration = struct.unpack('>II', f.read(8))
+                if timescale:
+                    info['duration'] = duration / timescale
+            elif kind == b'stsd' and 'sample_rate' not in info:
+                f.seek(offset + 8)  # version/flags and entry count
+                entry_size, codec = struct.unpack('>I4s', f.read(8))
+                entry = f.read(28)
+                if len(entry) == 28 and codec in (b'mp4a', b'alac', b'ac-3', b'ec-3', b'Opus', b'fLaC'):
+                    info['codec'] = 'aac' if codec == b'mp4a' else codec.decode('latin-1').strip().lower()
+                    info['channels'] = struct.unpack('>H', entry[16:18])[0]
+                    info['sample_rate'] = struct.unpack('>I', entry[24:28])[0] >> 16
+
+    # Only atom headers are read, mdat is skipped over however large it is
+    walk(0, size)
+    duration = info.get('duration')
+    if duration is None:
+        return None
+    return AudioInfo(duration, info.get('sample_rate'), info.get('channels'), info['codec'],
+                     int(size * 8 / duration) if duration else None)
@@ -0,0 +1,68 @@
+"""Plays generated tracks through the audio engine and a null sink, then prints
+render times and underruns. Needs numpy, not a sound card:
+
+    python3 benchmark_audio_engine.py --tracks 4 --seconds 10 --crossfade 3
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from audio_engine import ENGINE_CHANNELS, ENGINE_SAMPLE_RATE, AudioEngine, NullSink
+from pcm_cache import _wav_header
+
+
+def write_noise(path, seconds, rng):
+    samples = rng.uniform(-0.3, 0.3, (int(seconds * ENGINE_SAMPLE_RATE), ENGINE_CHANNELS))
+    data = (samples * 32767).astype('<i2').tobytes()
+    with open(path, 'wb') as f:
+        f.write(_wav_header(ENGINE_SAMPLE_RATE, ENGINE_CHANNELS, len(data)) + data)
+
+
+def run(tracks, seconds, crossfade, realtime):
+    directory = tempfile.mkdtemp()
+    rng = np.random.default_rng(0)
+    paths = []
+    for index in range(tracks):
+        paths.append(os.path.join(directory, f'{index}.wav'))
+        write_noise(paths[-1], seconds, rng)
+
+    done = threading.Event()
+    sink = NullSink(realtime=realtime)
+    engine = AudioEngine(sink, crossfade=crossfade)
+
+    def on_event(event, key, generation):
+        # Queue the following track as each one starts, like MusicPlayer does
+        if event == 'start':
+            engine.queue(paths[key + 1] if key + 1 < tracks else None, key=key + 1)
+        elif event == 'idle':
+            done.set()
+
+    engine.add_listener(on_event)
+    started = time.perf_counter()
+    engine.play(paths[0], key=0)
+    engine.queue(paths[1] if tracks > 1 else None, key=1)
+    done.wait()
+    elapsed = time.perf_counter() - started
+    engine.close()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    audio_seconds = sink.frames / ENGINE_SAMPLE_RATE
+    print(f"Played {audio_seconds:.1f} s of audio in {elapsed:.1f} s ({audio_seconds / elapsed:.1f}x real time)")
+    print(f"Render times per block: {engine.render_times.snapshot()}")
+    print(f"Underruns: {engine.underruns}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tracks', type=int, default=3)
+    parser.add_argument('--seconds', type=float, default=5.0, help="length of each track")
+    parser.add_argument('--crossfade', type=float, default=2.0)
+    parser.add_argument('--fast', action='store_true',
+                        help="render as fast as possible instead of at playback speed; underruns are expected then")
+    args = parser.parse_args()
+    run(args.tracks, args.seconds, args.crossfade, not args.fast)
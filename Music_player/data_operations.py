@@ -1,16 +1,286 @@
-from db_connection import get_db_connection
-import mysql.connector
-from mysql.connector import conversion
-from mysql.connector.conversion import MySQLConverter
+from db_connection import get_db_connection, DatabaseError
+from file_hash import hash_file, hash_files, submit_hashes
 import io 
 import os
 from PIL import Image
 import matplotlib.pyplot as plt
 import json
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Bounded name -> id cache for the artists, genres and albums tables
+class IdCache:
+    """Ids put during a transaction are only seen by the thread that put them
+    until publish_id_caches() after its commit; a rollback drops them, so no
+    other thread can pick up an id that was never committed.
+    """
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _pending(self):
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = self._local.pending = {}
+        return pending
+
+    def get(self, key):
+        if (id := self._pending().get(key)) is not None:
+            return id
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, id):
+        self._pending()[key] = id
+
+    def publish(self):
+        # Returns whether the transaction resolved any ids, i.e. may have inserted rows
+        pending = self._pending()
+        if not pending:
+            return False
+        with self._lock:
+            for key, id in pending.items():
+                self._entries[key] = id
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        pending.clear()
+        return True
+
+    def discard_pending(self):
+        self._pending().clear()
+
+    def discard_ids(self, ids):
+        # Drop every name that maps to one of the given (deleted) ids
+        ids = set(ids)
+        pending = self._pending()
+        for key in [k for k, v in pending.items() if v in ids]:
+            del pending[key]
+        with self._lock:
+            for key in [k for k, v in self._entries.items() if v in ids]:
+                del self._entries[key]
+
+    def discard_where(self, predicate):
+        pending = self._pending()
+        for key in [k for k in pending if predicate(k)]:
+            del pending[key]
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                del self._entries[key]
+
+    def clear(self):
+        self.discard_pending()
+        with self._lock:
+            self._entries.clear()
+
+artist_ids = IdCache()
+genre_ids = IdCache()
+album_ids = IdCache()  # keyed on (title, artist_id)
+cover_ids = IdCache()  # keyed on the cover's sha256 hex digest
+
+_ID_CACHE_TABLES = (('artists', artist_ids), ('genres', genre_ids), ('albums', album_ids), ('covers', cover_ids))
+
+def publish_id_caches():
+    # Called after commit: ids resolved inside the transaction now exist for every thread.
+    # Returns the tables those ids came from, the only ones an insert can have added rows to
+    return [table for table, cache in _ID_CACHE_TABLES if cache.publish()]
+
+def invalidate_id_caches():
+    # Called on rollback: ids resolved inside the transaction may no longer exist
+    artist_ids.clear()
+    genre_ids.clear()
+    album_ids.clear()
+    cover_ids.clear()
+
+def _get_name_id(cursor, table, cache, name):
+    if (id := cache.get(name)) is not None:
+        return id
+    cursor.execute(f"INSERT IGNORE INTO {table} (name) VALUES (%s)", (name,))
+    cursor.execute(f"SELECT id FROM {table} WHERE name = %s", (name,))
+    result = cursor.fetchall()  # Consume all results
+    if not result:
+        return None
+    cache.put(name, result[0][0])
+    return result[0][0]
+
+def get_artist_id(cursor, name):
+    return _get_name_id(cursor, 'artists', artist_ids, name)
+
+def get_genre_id(cursor, name):
+    return _get_name_id(cursor, 'genres', genre_ids, name)
+
+def get_album_id(cursor, title, artist_id, release_year=None, album_type=None, total_tracks=None):
+    key = (title, artist_id)
+    if (id := album_ids.get(key)) is not None:
+        return id
+    cursor.execute("""
+        INSERT IGNORE INTO albums (title, artist_id, release_year, album_type, total_tracks) 
+        VALUES (%s, %s, %s, %s, %s)
+    """, (title, artist_id, release_year, album_type, total_tracks))
+    cursor.execute("SELECT id FROM albums WHERE title = %s AND artist_id = %s", (title, artist_id))
+    result = cursor.fetchall()  # Consume all results
+    if not result:
+        return None
+    album_ids.put(key, result[0][0])
+    return result[0][0]
+
+# Callbacks run after songs are committed, as listener(event, songs): event is 'insert' or
+# 'update' with a list of song dicts (SNAPSHOT_COLUMNS keys), or 'delete' with a list of ids.
+# They run on the thread that did the write.
+_song_listeners = []
+
+SNAPSHOT_COLUMNS = ('id', 'file_path', 'title', 'artist', 'album', 'genre',
+                    'artist_id', 'album_id', 'genre_id', 'duration',
+                    'track_gain', 'track_peak', 'album_gain', 'album_peak')
+
+def add_song_listener(listener):
+    if listener not in _song_listeners:
+        _song_listeners.append(listener)
+
+def remove_song_listener(listener):
+    if listener in _song_listeners:
+        _song_listeners.remove(listener)
+
+def _notify_song_listeners(event, songs):
+    if not songs:
+        return
+    for listener in list(_song_listeners):
+        try:
+            listener(event, songs)
+        except Exception as e:
+            print(f"Song listener {listener} failed on {event}: {e}")
+
+def _song_snapshots(cursor, ids):
+    if not ids:
+        return []
+    query, values = build_song_query(SNAPSHOT_COLUMNS, ids=ids)
+    cursor.execute(query, values)
+    return [dict(zip(SNAPSHOT_COLUMNS, row)) for row in cursor.fetchall()]
+
+# The song_search table is an FTS5 table on SQLite (keyed by rowid) and a FULLTEXT indexed
+# table on MySQL (keyed by song_id); both are written in the same transaction as the song.
+def _index_for_search(cursor, songs):
+    if not songs:
+        return
+    _unindex_for_search(cursor, [song['id'] for song in songs])
+    key = 'rowid' if cursor.dialect.name == 'sqlite' else 'song_id'
+    cursor.executemany(
+        f"INSERT INTO song_search ({key}, title, artist, album, genre) VALUES (%s, %s, %s, %s, %s)",
+        [(song['id'], song['title'], song['artist'], song['album'], song['genre']) for song in songs])
+
+def _unindex_for_search(cursor, ids):
+    if not ids:
+        return
+    key = 'rowid' if cursor.dialect.name == 'sqlite' else 'song_id'
+    cursor.execute(f"DELETE FROM song_search WHERE {key} IN ({_placeholders(len(ids))})", tuple(ids))
+
+def _search_expression(query, dialect):
+    # Every word must match, as a prefix so results show up while typing
+    from search import tokenize
+    words = list(tokenize(query))
+    if dialect.name == 'sqlite':
+        return " ".join(f'"{word}"*' for word in words)
+    return " ".join(f"+{word}*" for word in words)
+
+def search_songs(query, limit=50):
+    """Full-text search across title, artist, album and genre in the database.
+
+    Returns (id, title, artist, album, genre) rows, best match first.
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                expression = _search_expression(query, conn.dialect)
+                if not expression:
+                    return []
+                if conn.dialect.name == 'sqlite':
+                    cursor.execute("""
+                        SELECT rowid, title, artist, album, genre FROM song_search
+                        WHERE song_search MATCH %s ORDER BY bm25(song_search, 3.0, 2.0, 1.5, 1.0) LIMIT %s
+                    """, (expression, limit))
+                else:
+                    cursor.execute("""
+                        SELECT song_id, title, artist, album, genre FROM song_search
+                        WHERE MATCH (title, artist, album, genre) AGAINST (%s IN BOOLEAN MODE)
+                        ORDER BY MATCH (title, artist, album, genre) AGAINST (%s IN BOOLEAN MODE) DESC
+                        LIMIT %s
+                    """, (expression, expression, limit))
+                return cursor.fetchall()
+    except DatabaseError as e:
+        print(f"Error searching songs: {e}")
+        return []
+
+# Album covers live once in the covers table, keyed by content hash, and songs reference them by id
+def read_cover_bytes(cover):
+    # Covers arrive as raw bytes or as a path to a thumbnail file (older rows stored the path itself)
+    if cover is None:
+        return None
+    if isinstance(cover, (bytes, bytearray, memoryview)):
+        cover = bytes(cover)
+        try:
+            # Image data is never valid UTF-8 (PNG and JPEG open with non-UTF-8 bytes), a path is
+            cover = cover.decode('utf-8')
+        except UnicodeDecodeError:
+            return cover
+    try:
+        with open(cover, 'rb') as f:
+            return f.read()
+    except OSError as e:
+        print(f"Error reading album cover {cover}: {e}")
+        return None
+
+def cover_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def store_covers(cursor, covers):
+    # Store a list of cover bytes, returning one cover id (or None) per entry
+    hashes = [cover_hash(data) if data else None for data in covers]
+    missing = {}
+    for hash, data in zip(hashes, covers):
+        if hash and cover_ids.get(hash) is None:
+            missing[hash] = data
+    if missing:
+        keys = sorted(missing)
+        cursor.executemany("INSERT IGNORE INTO covers (hash, data) VALUES (%s, %s)",
+                           [(hash, missing[hash]) for hash in keys])
+        cursor.execute(f"SELECT id, hash FROM covers WHERE hash IN ({_placeholders(len(keys))})", tuple(keys))
+        for id, hash in cursor.fetchall():
+            cover_ids.put(hash, id)
+    return [cover_ids.get(hash) if hash else None for hash in hashes]
+
+def store_cover(cursor, cover):
+    return store_covers(cursor, [read_cover_bytes(cover)])[0]
+
+def _resolve_cover_hashes(cursor, hashes):
+    # hash -> id for covers that are already stored; unknown hashes are left out
+    resolved = {}
+    missing = []
+    for hash in hashes:
+        if (id := cover_ids.get(hash)) is not None:
+            resolved[hash] = id
+        else:
+            missing.append(hash)
+    for chunk in _chunked(sorted(missing), DELETE_BATCH_SIZE):
+        cursor.execute(f"SELECT id, hash FROM covers WHERE hash IN ({_placeholders(len(chunk))})", tuple(chunk))
+        for id, hash in cursor.fetchall():
+            cover_ids.put(hash, id)
+            resolved[hash] = id
+    return resolved
 
 # Inserting the data into the table
 def insert_song(file_path, json_file_path, title, artist_name, album_title, genre_name, album_cover=None, 
-                track_number=None, release_year=None, album_type=None, duration=None, total_tracks=None):
+                track_number=None, release_year=None, album_type=None, duration=None, total_tracks=None,
+                content_hash=None):
+    # Hash before taking a connection, it is the slow part for big files
+    content_hash = content_hash or hash_file(file_path)
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
@@ -18,48 +288,36 @@ def insert_song(file_path, json_file_path, title, artist_name, album_title, genr
                 conn.start_transaction()
                 
                 try:
-                    # Check if song already exists
-                    cursor.execute("SELECT id FROM songs WHERE file_path = %s OR title = %s", 
-                                (file_path, title))
+                    # Same path or same audio content means the song is already there
+                    cursor.execute("SELECT id FROM songs WHERE file_path = %s OR content_hash = %s", 
+                                (file_path, content_hash))
                     if cursor.fetchall():  # Consume all results
                         print(f"Song '{title}' already exists in database")
                         return True
 
-                    # Insert or get artist
-                    cursor.execute("INSERT IGNORE INTO artists (name) VALUES (%s)", (artist_name,))
-                    conn.commit()  # Commit after INSERT
-                    cursor.execute("SELECT id FROM artists WHERE name = %s", (artist_name,))
-                    artist_result = cursor.fetchall()  # Consume all results
-                    artist_id = artist_result[0][0] if artist_result else 1
-
-                    # Insert or get genre
-                    cursor.execute("INSERT IGNORE INTO genres (name) VALUES (%s)", (genre_name,))
-                    conn.commit()  # Commit after INSERT
-                    cursor.execute("SELECT id FROM genres WHERE name = %s", (genre_name,))
-                    genre_result = cursor.fetchall()  # Consume all results
-                    genre_id = genre_result[0][0] if genre_result else 1
-
-                    # Insert or get album
-                    cursor.execute("""
-                        INSERT IGNORE INTO albums (title, artist_id, release_year, album_type, total_tracks) 
-                        VALUES (%s, %s, %s, %s, %s)
-                    """, (album_title or "Unknown", artist_id, release_year, album_type, total_tracks))
-                    conn.commit()  # Commit after INSERT
-                    cursor.execute("SELECT id FROM albums WHERE title = %s AND artist_id = %s", 
-                                (album_title or "Unknown", artist_id))
-                    album_result = cursor.fetchall()  # Consume all results
-                    if not album_result:
+                    # Insert or get artist, genre and album (cached after the first lookup)
+                    artist_id = get_artist_id(cursor, artist_name) or 1
+                    genre_id = get_genre_id(cursor, genre_name) or 1
+                    album_id = get_album_id(cursor, album_title or "Unknown", artist_id,
+                                            release_year, album_type, total_tracks)
+                    if album_id is None:
                         raise Exception("Failed to get album ID")
-                    album_id = album_result[0][0]
+
+                    # Store the cover once per distinct image
+                    cover_id = store_cover(cursor, album_cover)
 
                     # Insert music
                     cursor.execute("""
                         INSERT INTO songs (file_path, title, artist_id, album_id, genre_id, 
-                                        album_cover, track_number, duration)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                                        cover_id, track_number, duration, content_hash)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
                     """, (file_path, title, artist_id, album_id, genre_id, 
-                          album_cover, track_number, duration))
+                          cover_id, track_number, duration, content_hash))
+                    snapshots = _song_snapshots(cursor, [cursor.lastrowid])
+                    _index_for_search(cursor, snapshots)
                     conn.commit()  # Final commit
+                    _bump_generations('songs', *publish_id_caches())
+                    _notify_song_listeners('insert', snapshots)
                     
                     print(f"Successfully inserted song: {title}")
                     return True
@@ -67,49 +325,688 @@ def insert_song(file_path, json_file_path, title, artist_name, album_title, genr
                 except Exception as e:
                     # Rollback transaction on error
                     conn.rollback()
+                    invalidate_id_caches()
                     print(f"Transaction failed, rolling back: {e}")
                     return False
                     
-    except mysql.connector.Error as e:
+    except DatabaseError as e:
         print(f"Error inserting songs data: {e}")
-        if e.errno == 1205:  # Lock wait timeout error
+        if getattr(e, 'errno', None) == 1205:  # MySQL lock wait timeout error
             print("Lock timeout occurred, please try again")
         return False
     except Exception as e:
         print(f"Unexpected error: {e}")
         return False
 
-def retrieve_song(conditions=None):
+# Number of records resolved and committed per transaction by insert_songs
+INSERT_BATCH_SIZE = 500
+
+def _chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _placeholders(count):
+    return ", ".join(["%s"] * count)
+
+def _normalize_record(record):
+    # Fill in the same defaults insert_song applies to its positional arguments
+    return {
+        'file_path': record.get('file_path'),
+        'title': record.get('title'),
+        'artist': record.get('artist') or "",
+        'album': record.get('album') or "Unknown",
+        'genre': record.get('genre') or "",
+        'album_cover': record.get('album_cover'),
+        'track_number': record.get('track_number'),
+        'release_year': record.get('release_year'),
+        'album_type': record.get('album_type'),
+        'duration': record.get('duration'),
+        'total_tracks': record.get('total_tracks'),
+        'content_hash': record.get('content_hash'),
+        # Reference to a cover already in the covers table, used by library imports
+        'cover_hash': record.get('cover_hash'),
+        'play_count': record.get('play_count') or 0,
+        'last_played': record.get('last_played'),
+    }
+
+def _resolve_names(cursor, table, cache, names):
+    # Resolve a set of artist/genre names to ids; only names missing from the cache hit the database
+    resolved = {}
+    missing = []
+    for name in names:
+        if (id := cache.get(name)) is not None:
+            resolved[name] = id
+        else:
+            missing.append(name)
+    if not missing:
+        return resolved
+
+    missing.sort()
+    cursor.executemany(f"INSERT IGNORE INTO {table} (name) VALUES (%s)", [(name,) for name in missing])
+    cursor.execute(f"SELECT id, name FROM {table} WHERE name IN ({_placeholders(len(missing))})", tuple(missing))
+    for id, name in cursor.fetchall():
+        cache.put(name, id)
+        resolved[name] = id
+    return resolved
+
+def _resolve_albums(cursor, albums):
+    # albums maps (title, artist_id) -> (release_year, album_type, total_tracks)
+    resolved = {}
+    missing = []
+    for key in albums:
+        if (id := album_ids.get(key)) is not None:
+            resolved[key] = id
+        else:
+            missing.append(key)
+    if not missing:
+        return resolved
+
+    missing.sort()
+    cursor.executemany("""
+        INSERT IGNORE INTO albums (title, artist_id, release_year, album_type, total_tracks)
+        VALUES (%s, %s, %s, %s, %s)
+    """, [key + albums[key] for key in missing])
+
+    titles = sorted({title for title, _ in missing})
+    artists = sorted({artist_id for _, artist_id in missing})
+    cursor.execute(f"""
+        SELECT id, title, artist_id FROM albums
+        WHERE title IN ({_placeholders(len(titles))}) AND artist_id IN ({_placeholders(len(artists))})
+    """, tuple(titles) + tuple(artists))
+    for id, title, artist_id in cursor.fetchall():
+        if (title, artist_id) in albums:
+            album_ids.put((title, artist_id), id)
+            resolved[(title, artist_id)] = id
+    return resolved
+
+def _insert_song_chunk(cursor, records):
+    # Returns one outcome per record ('inserted', 'duplicate' or 'invalid') and the inserted songs' snapshots
+    outcomes = [None] * len(records)
+
+    # A record is a duplicate if its path or its audio content is already in the library
+    paths = [r['file_path'] for r in records if r['file_path']]
+    hashes = [r['content_hash'] for r in records if r['content_hash']]
+    existing_paths, existing_hashes = set(), set()
+    if paths or hashes:
+        clauses, values = [], []
+        if paths:
+            clauses.append(f"file_path IN ({_placeholders(len(paths))})")
+            values.extend(paths)
+        if hashes:
+            clauses.append(f"content_hash IN ({_placeholders(len(hashes))})")
+            values.extend(hashes)
+        cursor.execute(f"SELECT file_path, content_hash FROM songs WHERE {' OR '.join(clauses)}", tuple(values))
+        for file_path, content_hash in cursor.fetchall():
+            existing_paths.add(file_path)
+            if content_hash:  # legacy rows have none
+                existing_hashes.add(content_hash)
+
+    pending = []
+    for index, record in enumerate(records):
+        if not record['file_path'] or not record['title']:
+            outcomes[index] = 'invalid'
+        elif record['file_path'] in existing_paths or (record['content_hash']
+                                                       and record['content_hash'] in existing_hashes):
+            outcomes[index] = 'duplicate'
+        else:
+            # Also catches duplicates within the same batch
+            existing_paths.add(record['file_path'])
+            if record['content_hash']:
+                existing_hashes.add(record['content_hash'])
+            pending.append(index)
+
+    if not pending:
+        return outcomes, []
+
+    artists = _resolve_names(cursor, 'artists', artist_ids, {records[i]['artist'] for i in pending})
+    genres = _resolve_names(cursor, 'genres', genre_ids, {records[i]['genre'] for i in pending})
+
+    albums = {}
+    for i in pending:
+        record = records[i]
+        key = (record['album'], artists.get(record['artist'], 1))
+        albums.setdefault(key, (record['release_year'], record['album_type'], record['total_tracks']))
+    albums = _resolve_albums(cursor, albums)
+
+    # Tracks of the same album usually share one thumbnail, so this stores it once
+    covers = store_covers(cursor, [read_cover_bytes(records[i]['album_cover']) for i in pending])
+    referenced = _resolve_cover_hashes(cursor, {records[i]['cover_hash'] for i in pending
+                                               if records[i]['cover_hash']})
+    covers = [cover_id if cover_id is not None else referenced.get(records[i]['cover_hash'])
+              for cover_id, i in zip(covers, pending)]
+
+    rows = []
+    for cover_id, i in zip(covers, pending):
+        record = records[i]
+        artist_id = artists.get(record['artist'], 1)
+        album_id = albums.get((record['album'], artist_id))
+        if album_id is None:
+            raise Exception(f"Failed to get album ID for '{record['album']}'")
+        rows.append((record['file_path'], record['title'], artist_id, album_id,
+                     genres.get(record['genre'], 1), cover_id,
+                     record['track_number'], record['duration'], record['content_hash'],
+                     record['play_count'], record['last_played']))
+    cursor.executemany("""
+        INSERT INTO songs (file_path, title, artist_id, album_id, genre_id,
+                        cover_id, track_number, duration, content_hash, play_count, last_played)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, rows)
+
+    for i in pending:
+        outcomes[i] = 'inserted'
+
+    inserted_paths = [records[i]['file_path'] for i in pending]
+    cursor.execute(f"SELECT id FROM songs WHERE file_path IN ({_placeholders(len(inserted_paths))})",
+                   tuple(inserted_paths))
+    snapshots = _song_snapshots(cursor, [id for (id,) in cursor.fetchall()])
+    _index_for_search(cursor, snapshots)
+    return outcomes, snapshots
+
+# Inserting many songs at once, committing once per chunk of INSERT_BATCH_SIZE records
+def insert_songs(records, batch_size=INSERT_BATCH_SIZE):
+    """Insert a list of song dicts (same keys as insert_song's arguments).
+
+    Returns a list with one outcome per record: 'inserted', 'duplicate',
+    'invalid' (missing file_path or title) or 'failed' (its chunk was rolled back).
+    """
+    records = [_normalize_record(record) for record in records]
+    # Hash every file on the hashing pool up front; later chunks hash while earlier ones are inserted
+    hashes = submit_hashes([None if r['content_hash'] else r['file_path'] for r in records])
+    outcomes = []
     try:
-        with get_db_connection() as db_connection:
-            with db_connection.cursor() as cursor:
-                query = """
-                SELECT m.id, m.file_path, m.title, a.name as artist, al.title as album, g.name as genre, m.album_cover, 
-                m.track_number, al.release_year, al.album_type, m.duration, al.total_tracks
-                FROM songs m
-                JOIN artists a ON m.artist_id = a.id
-                JOIN albums al ON m.album_id = al.id
-                JOIN genres g ON m.genre_id = g.id
-                """
-                values = []
-                
-                if conditions:
-                    where_clauses = []
-                    for k, v in conditions.items():
-                        table_prefix = 'm'
-                        if k in ['artist', 'name']:
-                            table_prefix = 'a'
-                        elif k in ['album', 'release_year', 'album_type']:
-                            table_prefix = 'al'
-                        elif k == 'genre':
-                            table_prefix = 'g'
-                        where_clauses.append(f"{table_prefix}.{conversion.MySQLConverter().escape(k)} = %s")
-                        values.append(v)
-                    query += " WHERE " + " AND ".join(where_clauses)
-
-                cursor.execute(query, tuple(values))
-                return cursor.fetchall()
-    except mysql.connector.Error as e:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                for offset, chunk in zip(range(0, len(records), batch_size), _chunked(records, batch_size)):
+                    for record, future in zip(chunk, hashes[offset:offset + batch_size]):
+                        if future is not None:
+                            record['content_hash'] = future.result()
+                    conn.start_transaction()
+                    try:
+                        chunk_outcomes, snapshots = _insert_song_chunk(cursor, chunk)
+                        conn.commit()
+                        _bump_generations('songs', *publish_id_caches())
+                        _notify_song_listeners('insert', snapshots)
+                    except Exception as e:
+                        conn.rollback()
+                        invalidate_id_caches()
+                        print(f"Batch insert failed, rolling back {len(chunk)} songs: {e}")
+                        chunk_outcomes = ['failed'] * len(chunk)
+                    outcomes.extend(chunk_outcomes)
+    except DatabaseError as e:
+        print(f"Error inserting songs data: {e}")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+
+    # Anything we never reached (e.g. no connection) counts as failed
+    outcomes.extend(['failed'] * (len(records) - len(outcomes)))
+    print(f"Batch insert finished: {outcomes.count('inserted')} inserted, "
+          f"{outcomes.count('duplicate')} duplicates, {outcomes.count('failed')} failed")
+    return outcomes
+
+# Songs hashed and updated per transaction by backfill_content_hashes
+HASH_BACKFILL_BATCH_SIZE = 200
+
+# Set on close, the backfills below stop after their current batch
+_stop_backfills = threading.Event()
+
+def stop_backfills():
+    _stop_backfills.set()
+    import loudness
+    loudness.stop_analysis()
+
+def backfill_content_hashes(batch_size=HASH_BACKFILL_BATCH_SIZE):
+    # Hash songs stored before content hashes existed; files that cannot be read stay NULL
+    last_id = 0
+    hashed = 0
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                while True:
+                    cursor.execute("""
+                        SELECT id, file_path FROM songs
+                        WHERE content_hash IS NULL AND id > %s
+                        ORDER BY id LIMIT %s
+                    """, (last_id, batch_size))
+                    rows = cursor.fetchall()
+                    conn.commit()  # don't hold a snapshot open while hashing
+                    if not rows or _stop_backfills.is_set():
+                        break
+                    last_id = rows[-1][0]
+                    hashes = hash_files([path for _, path in rows])
+                    updates = [(hash, id) for (id, _), hash in zip(rows, hashes) if hash]
+                    if updates:
+                        conn.start_transaction()
+                        cursor.executemany("UPDATE songs SET content_hash = %s WHERE id = %s", updates)
+                        conn.commit()
+                        hashed += len(updates)
+    except DatabaseError as e:
+        print(f"Error backfilling content hashes: {e}")
+    if hashed:
+        _bump_generations('songs')
+        print(f"Hashed {hashed} songs for duplicate detection")
+    return hashed
+
+# Songs probed and updated per transaction by backfill_durations
+DURATION_BACKFILL_BATCH_SIZE = 200
+
+def backfill_durations(batch_size=DURATION_BACKFILL_BATCH_SIZE):
+    # Fill songs.duration from the files' headers wherever it is missing
+    from metadata_cache import metadata_cache
+
+    last_id = 0
+    updated = 0
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                while True:
+                    cursor.execute("""
+                        SELECT id, file_path FROM songs
+                        WHERE (duration IS NULL OR duration <= 0) AND id > %s
+                        ORDER BY id LIMIT %s
+                    """, (last_id, batch_size))
+                    rows = cursor.fetchall()
+                    conn.commit()
+                    if not rows or _stop_backfills.is_set():
+                        break
+                    last_id = rows[-1][0]
+                    durations = [(metadata_cache.duration(path), id) for id, path in rows]
+                    durations = [(duration, id) for duration, id in durations if duration]
+                    if not durations:
+                        continue
+                    conn.start_transaction()
+                    try:
+                        cursor.executemany("UPDATE songs SET duration = %s WHERE id = %s", durations)
+                        snapshots = _song_snapshots(cursor, [id for _, id in durations])
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    updated += len(durations)
+                    _bump_generations('songs')
+                    _notify_song_listeners('update', snapshots)
+    except DatabaseError as e:
+        print(f"Error backfilling song durations: {e}")
+    if updated:
+        print(f"Read the duration of {updated} songs from their files")
+    return updated
+
+# Songs measured per transaction by backfill_loudness
+LOUDNESS_BATCH_SIZE = 20
+# Albums whose gain is recomputed per transaction
+ALBUM_GAIN_BATCH_SIZE = 100
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+def _loudness_candidates(batch_size):
+    # (id, file_path, album_id, signature) of songs never measured or whose file changed since
+    last_id = 0
+    while True:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT id, file_path, album_id, loudness_signature FROM songs
+                    WHERE id > %s ORDER BY id LIMIT %s
+                """, (last_id, batch_size))
+                rows = cursor.fetchall()
+                conn.commit()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        for id, path, album_id, measured in rows:
+            signature = _file_signature(path)
+            if signature is not None and signature != measured:
+                yield id, path, album_id, signature
+
+def backfill_loudness(batch_size=LOUDNESS_BATCH_SIZE, workers=None):
+    """Measure the loudness of songs that have no value yet or whose file changed.
+
+    Files are decoded and measured in a process pool (loudness.analyze_files)
+    and results are committed every batch_size songs, so a run that is
+    stopped picks up where it left off. Album gains are recomputed for
+    every album that had a track measured. Returns the number of songs
+    measured.
+    """
+    import loudness
+    if not loudness.available():
+        print("Loudness analysis needs numpy, skipping it")
+        return 0
+
+    songs = {}  # id -> (album_id, signature) of songs being measured
+    def items():
+        for id, path, album_id, signature in _loudness_candidates(STREAM_BATCH_SIZE):
+            if _stop_backfills.is_set():
+                return
+            songs[id] = (album_id, signature)
+            yield id, path
+
+    measured = 0
+    albums = set()
+    results = []
+    try:
+        for id, result in loudness.analyze_files(items(), workers or loudness.LOUDNESS_WORKERS):
+            album_id, signature = songs.pop(id)
+            if result is None:
+                continue  # not decodable now, tried again next run
+            results.append((result.loudness, loudness.track_gain(result.loudness), result.true_peak, signature, id))
+            albums.add(album_id)
+            if len(results) >= batch_size:
+                measured += _store_loudness(results)
+                results = []
+        measured += _store_loudness(results)
+        _update_album_gains(albums, loudness.album_loudness)
+    except DatabaseError as e:
+        print(f"Error storing loudness analysis: {e}")
+    if measured:
+        print(f"Measured the loudness of {measured} songs")
+    return measured
+
+def _store_loudness(results):
+    if not results:
+        return 0
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            conn.start_transaction()
+            try:
+                cursor.executemany("""
+                    UPDATE songs SET loudness = %s, track_gain = %s, track_peak = %s, loudness_signature = %s
+                    WHERE id = %s
+                """, results)
+                snapshots = _song_snapshots(cursor, [row[-1] for row in results])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    _bump_generations('songs')
+    _notify_song_listeners('update', snapshots)
+    return len(results)
+
+def _update_album_gains(album_ids, album_loudness):
+    # Album gain from the measured tracks of each album, the peak is the loudest track's
+    from loudness import track_gain
+    for chunk in _chunked([id for id in album_ids if id is not None], ALBUM_GAIN_BATCH_SIZE):
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT id, album_id, loudness, duration, track_peak FROM songs
+                    WHERE album_id IN ({_placeholders(len(chunk))})
+                """, tuple(chunk))
+                tracks = {}
+                song_ids = []
+                for id, album_id, loudness, duration, peak in cursor.fetchall():
+                    tracks.setdefault(album_id, []).append((loudness, duration, peak))
+                    song_ids.append(id)
+                conn.commit()  # end the read, start_transaction() fails inside one on MySQL
+                updates = []
+                for album_id, album_tracks in tracks.items():
+                    peaks = [peak for _, _, peak in album_tracks if peak is not None]
+                    gain = track_gain(album_loudness((loudness, duration) for loudness, duration, _ in album_tracks))
+                    updates.append((gain, max(peaks) if peaks else None, album_id))
+                conn.start_transaction()
+                try:
+                    cursor.executemany("UPDATE albums SET album_gain = %s, album_peak = %s WHERE id = %s", updates)
+                    snapshots = [snapshot for ids in _chunked(song_ids, DELETE_BATCH_SIZE)
+                                 for snapshot in _song_snapshots(cursor, ids)]
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        _bump_generations('albums')
+        _notify_song_listeners('update', snapshots)
+
+# Columns retrieve_song and get_all_song can select, filter and order on, with their SQL expression
+SONG_COLUMNS = {
+    'id': 'm.id',
+    'file_path': 'm.file_path',
+    'title': 'm.title',
+    'artist': 'a.name',
+    'album': 'al.title',
+    'genre': 'g.name',
+    'cover_id': 'm.cover_id',
+    'track_number': 'm.track_number',
+    'release_year': 'al.release_year',
+    'album_type': 'al.album_type',
+    'duration': 'm.duration',
+    'total_tracks': 'al.total_tracks',
+    'artist_id': 'm.artist_id',
+    'album_id': 'm.album_id',
+    'genre_id': 'm.genre_id',
+    'content_hash': 'm.content_hash',
+    'cover_hash': 'c.hash',
+    'play_count': 'm.play_count',
+    'last_played': 'm.last_played',
+    'loudness': 'm.loudness',
+    'track_gain': 'm.track_gain',
+    'track_peak': 'm.track_peak',
+    'album_gain': 'al.album_gain',
+    'album_peak': 'al.album_peak',
+    'name': 'a.name',  # older callers filter artists by 'name'
+}
+
+# Row layout returned by retrieve_song when no projection is given
+DEFAULT_SONG_COLUMNS = ('id', 'file_path', 'title', 'artist', 'album', 'genre', 'cover_id',
+                        'track_number', 'release_year', 'album_type', 'duration', 'total_tracks')
+
+# Row layout of the songs table, returned by get_all_song when no projection is given
+SONGS_TABLE_COLUMNS = ('id', 'file_path', 'title', 'artist_id', 'album_id', 'genre_id', 'cover_id',
+                       'track_number', 'duration')
+
+_SONG_JOINS = {
+    'a': "JOIN artists a ON m.artist_id = a.id",
+    'al': "JOIN albums al ON m.album_id = al.id",
+    'g': "JOIN genres g ON m.genre_id = g.id",
+    'c': "LEFT JOIN covers c ON m.cover_id = c.id",
+}
+
+STREAM_BATCH_SIZE = 500
+
+def _song_column(name):
+    if name not in SONG_COLUMNS:
+        raise ValueError(f"Unknown song column: {name!r}")
+    return SONG_COLUMNS[name]
+
+def build_song_query(columns, conditions=None, order_by=None, after_id=None, limit=None, ids=None):
+    """Build a SELECT over songs joined only to the tables the query touches.
+
+    order_by is a column name or a list of them, prefixed with '-' for
+    descending order. after_id pages through the result in id order
+    (keyset pagination), so it cannot be combined with another ordering.
+    ids restricts the result to the given song ids.
+    """
+    expressions = [_song_column(column) for column in columns]
+    where_clauses = []
+    values = []
+    for k, v in (conditions or {}).items():
+        where_clauses.append(f"{_song_column(k)} = %s")
+        values.append(v)
+    if ids is not None:
+        ids = list(ids)
+        where_clauses.append(f"m.id IN ({_placeholders(len(ids))})" if ids else "1 = 0")
+        values.extend(ids)
+
+    if isinstance(order_by, str):
+        order_by = [order_by]
+    order_clauses = []
+    for column in order_by or []:
+        descending = column.startswith('-')
+        order_clauses.append(_song_column(column.lstrip('-')) + (" DESC" if descending else ""))
+
+    if after_id is not None:
+        if order_by and list(order_by) != ['id']:
+            raise ValueError("after_id pagination requires ordering by id")
+        where_clauses.append("m.id > %s")
+        values.append(after_id)
+        order_clauses = ["m.id"]
+
+    referenced = " ".join(expressions + where_clauses + order_clauses)
+    joins = [join for prefix, join in _SONG_JOINS.items() if re.search(rf"\b{prefix}\.", referenced)]
+
+    query = f"SELECT {', '.join(expressions)} FROM songs m " + " ".join(joins)
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+    if order_clauses:
+        query += " ORDER BY " + ", ".join(order_clauses)
+    if limit is not None:
+        query += " LIMIT %s"
+        values.append(int(limit))
+    return query, tuple(values)
+
+def _stream_rows(query, values, batch_size):
+    # Holds a pooled connection until the generator is exhausted or closed
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, values)
+                exhausted = False
+                try:
+                    while rows := cursor.fetchmany(batch_size):
+                        yield from rows
+                    exhausted = True
+                finally:
+                    if not exhausted:
+                        conn.discard_results()
+    except DatabaseError as e:
+        print(f"Error streaming music data: {e}")
+
+def iter_covers(batch_size=STREAM_BATCH_SIZE):
+    # Stream (hash, data) for every stored cover without loading them all at once
+    return _stream_rows("SELECT hash, data FROM covers ORDER BY id", (), batch_size)
+
+def import_covers(covers, batch_size=INSERT_BATCH_SIZE):
+    # Store an iterable of (hash, data) pairs, committing per batch; returns how many were new
+    stored = 0
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                batch = []
+                for hash, data in covers:
+                    batch.append((hash, data))
+                    if len(batch) >= batch_size:
+                        stored += _import_cover_batch(conn, cursor, batch)
+                        batch = []
+                if batch:
+                    stored += _import_cover_batch(conn, cursor, batch)
+    except DatabaseError as e:
+        print(f"Error importing covers: {e}")
+    if stored:
+        _bump_generations('covers')
+    return stored
+
+def _import_cover_batch(conn, cursor, batch):
+    conn.start_transaction()
+    try:
+        cursor.executemany("INSERT IGNORE INTO covers (hash, data) VALUES (%s, %s)", batch)
+        stored = max(cursor.rowcount, 0)
+        conn.commit()
+        return stored
+    except Exception:
+        conn.rollback()
+        raise
+
+# Only the covers that are actually displayed are ever loaded, and only a few are kept around
+_cover_data = IdCache(maxsize=32)
+
+def get_cover(cover_id):
+    if cover_id is None:
+        return None
+    if (data := _cover_data.get(cover_id)) is not None:
+        return data
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT data FROM covers WHERE id = %s", (cover_id,))
+                result = cursor.fetchone()
+    except DatabaseError as e:
+        print(f"Error retrieving album cover: {e}")
+        return None
+    if not result:
+        return None
+    data = bytes(result[0])
+    _cover_data.put(cover_id, data)
+    return data
+
+# Every committed write bumps the generation of the tables it touched. Cached query
+# results are keyed on the generations of the tables they read, so a write makes
+# every affected entry unreachable without having to find it.
+_table_generations = {'songs': 0, 'artists': 0, 'albums': 0, 'genres': 0, 'covers': 0}
+_generations_lock = threading.Lock()
+
+_JOIN_TABLES = {'a': 'artists', 'al': 'albums', 'g': 'genres', 'c': 'covers'}
+
+def _bump_generations(*tables):
+    with _generations_lock:
+        for table in tables:
+            _table_generations[table] += 1
+
+def _generations(tables):
+    with _generations_lock:
+        return tuple(_table_generations[table] for table in tables)
+
+QUERY_CACHE_SIZE = 256        # cached results
+QUERY_CACHE_MAX_ROWS = 5000   # larger results are not worth keeping in memory
+
+class QueryCache:
+    """Bounded LRU of song query results, keyed on (query, values, table generations)."""
+    def __init__(self, maxsize=QUERY_CACHE_SIZE, max_rows=QUERY_CACHE_MAX_ROWS):
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self._entries = IdCache(maxsize)
+
+    def get(self, key):
+        rows = self._entries.get(key)
+        if rows is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return list(rows)
+
+    def put(self, key, rows):
+        if len(rows) <= self.max_rows:
+            self._entries.put(key, tuple(rows))
+
+    def clear(self):
+        self._entries.clear()
+
+query_cache = QueryCache()
+
+def _query_tables(query):
+    return ('songs',) + tuple(table for alias, table in _JOIN_TABLES.items() if _SONG_JOINS[alias] in query)
+
+def _select_songs(columns, conditions, order_by, after_id, limit, stream, batch_size):
+    # Sorted so the same conditions in any order share one cache entry
+    conditions = dict(sorted(conditions.items())) if conditions else None
+    query, values = build_song_query(columns, conditions, order_by, after_id, limit)
+    if stream:
+        return _stream_rows(query, values, batch_size)
+    # Read the generations before querying: a write committing meanwhile bumps them,
+    # so a result that missed it is stored under a key nobody asks for any more
+    key = (query, values, _generations(_query_tables(query)))
+    if (rows := query_cache.get(key)) is not None:
+        return rows
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(query, values)
+            rows = cursor.fetchall()
+    query_cache.put(key, rows)
+    return rows
+
+def retrieve_song(conditions=None, columns=None, order_by=None, after_id=None, limit=None,
+                  stream=False, batch_size=STREAM_BATCH_SIZE):
+    """Fetch songs matching conditions (column -> value).
+
+    columns picks which SONG_COLUMNS to return (default DEFAULT_SONG_COLUMNS).
+    With stream=True a generator is returned that pulls batch_size rows at a
+    time instead of materializing the whole result.
+    """
+    try:
+        return _select_songs(columns or DEFAULT_SONG_COLUMNS, conditions, order_by, after_id, limit,
+                             stream, batch_size)
+    except DatabaseError as e:
         print(f"Error retrieving music data: {e}")
         return []
 
@@ -127,14 +1024,14 @@ def display_song(data, show_album_art=False):
 
     # Print the data rows
     for row in data:
-        # Convert LONGBLOB to a placeholder string for display
+        # Covers are only referenced by id here, the image is fetched when shown
         row = list(row)
-        album_cover_blob = row[6]
-        row[6] = "<BLOB>" if album_cover_blob else "None"
+        cover_id = row[6]
+        row[6] = f"<cover {cover_id}>" if cover_id else "None"
         print(" | ".join(str(item) for item in row))
         
         if show_album_art:
-            display_album_art(album_cover_blob)
+            display_album_art(get_cover(cover_id))
         
 def display_album_art(album_cover_blob):
     if album_cover_blob:
@@ -157,18 +1054,20 @@ def get_song_by_album(album):
 def get_song_by_genre(genre):
     return retrieve_song({'genre': genre}) 
 
-def get_all_song():
+def get_all_song(columns=None, order_by=None, after_id=None, limit=None,
+                 stream=False, batch_size=STREAM_BATCH_SIZE):
+    # Same options as retrieve_song, defaulting to the plain songs table columns
     try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT * FROM songs")
-                songs = cursor.fetchall()
-                if not songs:
-                    print("No songs found in the database.")
-                else:
-                    print(f"Found {len(songs)} songs in the database.")
-                return songs
-    except mysql.connector.Error as e:
+        songs = _select_songs(columns or SONGS_TABLE_COLUMNS, None, order_by, after_id, limit,
+                              stream, batch_size)
+        if stream:
+            return songs
+        if not songs:
+            print("No songs found in the database.")
+        else:
+            print(f"Found {len(songs)} songs in the database.")
+        return songs
+    except DatabaseError as e:
         print(f"Error retrieving songs: {e}")
         return []
 
@@ -203,11 +1102,20 @@ def get_album_songs(album_title, artist_name=None):
                         print(f"{song[2]}. {song[1]}")
                     return songs
                 
-    except mysql.connector.Error as e:
+    except DatabaseError as e:
         print(f"Error retrieving album songs: {e}")
         return []
                 
-def update_song(id, **kwargs):
+# Tables besides songs that an edit to these fields can write to
+_EDIT_TABLES = {'artist': 'artists', 'album': 'albums', 'release_year': 'albums', 'album_type': 'albums',
+                'total_tracks': 'albums', 'genre': 'genres', 'album_cover': 'covers'}
+
+def _edited_tables(edits):
+    # songs plus the tables the given kwargs dicts touch, for _bump_generations
+    return {'songs'} | {_EDIT_TABLES[k] for changes in edits for k in changes if k in _EDIT_TABLES}
+
+def _apply_song_update(cursor, id, kwargs):
+    # Apply one song's edits inside the caller's transaction; raises on failure
     updates = {}
     artist_update = None
     album_update = None
@@ -225,6 +1133,72 @@ def update_song(id, **kwargs):
         else:
             updates[k] = v
 
+    # Handle artist update
+    if artist_update:
+        if (artist_id := get_artist_id(cursor, artist_update)) is None:
+            raise Exception("Failed to get artist ID")
+        updates['artist_id'] = artist_id
+
+    # A moved or replaced file gets a fresh content hash
+    if updates.get('file_path') and 'content_hash' not in updates:
+        cursor.execute("SELECT file_path FROM songs WHERE id = %s", (id,))
+        current = cursor.fetchone()
+        if not current or current[0] != updates['file_path']:
+            updates['content_hash'] = hash_file(updates['file_path'])
+
+    # Covers are stored by content hash, songs only keep the reference
+    if 'album_cover' in updates:
+        updates['cover_id'] = store_cover(cursor, updates.pop('album_cover'))
+
+    # Handle genre update
+    if genre_update:
+        if (genre_id := get_genre_id(cursor, genre_update)) is None:
+            raise Exception("Failed to get genre ID")
+        updates['genre_id'] = genre_id
+
+    # Handle album update
+    if album_update:
+        if 'album' in album_update:
+            if 'artist_id' in updates:
+                artist_id = updates['artist_id']
+            else:
+                cursor.execute("SELECT artist_id FROM songs WHERE id = %s", (id,))
+                artist_result = cursor.fetchone()
+                if not artist_result:
+                    raise Exception("Failed to get artist ID for album")
+                artist_id = artist_result[0]
+
+            album_id = get_album_id(
+                cursor, album_update['album'], artist_id,
+                album_update.get('release_year'),
+                album_update.get('album_type'),
+                album_update.get('total_tracks'))
+            if album_id is None:
+                raise Exception("Failed to get album ID")
+            updates['album_id'] = album_id
+
+        elif 'release_year' in album_update or 'album_type' in album_update:
+            cursor.execute("SELECT album_id FROM songs WHERE id = %s", (id,))
+            album_result = cursor.fetchone()
+            if not album_result:
+                raise Exception("Failed to get album ID for update")
+            album_id = album_result[0]
+
+            set_clause = ', '.join([f"{cursor.dialect.quote(k)} = %s"
+                                    for k in album_update.keys()])
+            values = tuple(album_update.values()) + (album_id,)
+            cursor.execute(f"UPDATE albums SET {set_clause} WHERE id = %s", values)
+
+    # Update song details
+    if updates:
+        set_clause = ', '.join([
+            f"{cursor.dialect.quote(k)} = %s"
+            for k in updates
+        ])
+        values = tuple(updates.values()) + (id,)
+        cursor.execute(f"UPDATE songs SET {set_clause} WHERE id = %s", values)
+
+def update_song(id, **kwargs):
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
@@ -232,130 +1206,307 @@ def update_song(id, **kwargs):
                 conn.start_transaction()
                 
                 try:
-                    # Handle artist update
-                    if artist_update:
-                        cursor.execute("INSERT IGNORE INTO artists (name) VALUES (%s)", (artist_update,))
-                        cursor.execute("SELECT id FROM artists WHERE name = %s", (artist_update,))
-                        artist_result = cursor.fetchone()
-                        if not artist_result:
-                            raise Exception("Failed to get artist ID")
-                        updates['artist_id'] = artist_result[0]
-
-                    # Handle genre update
-                    if genre_update:
-                        cursor.execute("INSERT IGNORE INTO genres (name) VALUES (%s)", (genre_update,))
-                        cursor.execute("SELECT id FROM genres WHERE name = %s", (genre_update,))
-                        genre_result = cursor.fetchone()
-                        if not genre_result:
-                            raise Exception("Failed to get genre ID")
-                        updates['genre_id'] = genre_result[0]
-
-                    # Handle album update
-                    if album_update:
-                        if 'album' in album_update:
-                            cursor.execute("SELECT artist_id FROM songs WHERE id = %s", (id,))
-                            artist_result = cursor.fetchone()
-                            if not artist_result:
-                                raise Exception("Failed to get artist ID for album")
-                            artist_id = artist_result[0]
-                            
-                            cursor.execute("""
-                                INSERT IGNORE INTO albums (title, artist_id, release_year, album_type, total_tracks) 
-                                VALUES (%s, %s, %s, %s, %s)
-                            """, (
-                                album_update['album'], artist_id, 
-                                album_update.get('release_year'), 
-                                album_update.get('album_type'),
-                                album_update.get('total_tracks')))
-                                
-                            cursor.execute("""
-                                SELECT id FROM albums 
-                                WHERE title = %s AND artist_id = %s
-                            """, (album_update['album'], artist_id))
-                            album_result = cursor.fetchone()
-                            if not album_result:
-                                raise Exception("Failed to get album ID")
-                            updates['album_id'] = album_result[0]
-                            
-                        elif 'release_year' in album_update or 'album_type' in album_update:
-                            cursor.execute("SELECT album_id FROM songs WHERE id = %s", (id,))
-                            album_result = cursor.fetchone()
-                            if not album_result:
-                                raise Exception("Failed to get album ID for update")
-                            album_id = album_result[0]
-                            
-                            converter = MySQLConverter()
-                            set_clause = ', '.join([f"{converter.escape(k)} = %s" 
-                                                  for k in album_update.keys()])
-                            values = tuple(album_update.values()) + (album_id,)
-                            cursor.execute(f"UPDATE albums SET {set_clause} WHERE id = %s", values)
+                    _apply_song_update(cursor, id, kwargs)
 
-                    # Update song details
-                    if updates:
-                        set_clause = ', '.join([
-                            f"{conversion.MySQLConverter().escape(k)} = %s"
-                            for k in updates
-                        ])
-                        values = tuple(updates.values()) + (id,)
-                        cursor.execute(f"UPDATE songs SET {set_clause} WHERE id = %s", values)
+                    snapshots = _song_snapshots(cursor, [id])
+                    _index_for_search(cursor, snapshots)
 
                     # Commit all changes
                     conn.commit()
+                    publish_id_caches()
+                    _bump_generations(*_edited_tables([kwargs]))
+                    _notify_song_listeners('update', snapshots)
                     print(f"Music with ID {id} updated successfully")
                     return True
                     
                 except Exception as e:
                     # Rollback on error
                     conn.rollback()
+                    invalidate_id_caches()
                     print(f"Transaction failed, rolling back: {e}")
                     return False
                     
-    except mysql.connector.Error as e:
+    except DatabaseError as e:
         print(f"Error updating songs data: {e}")
-        if e.errno == 1205:  # Lock wait timeout error
+        if getattr(e, 'errno', None) == 1205:  # MySQL lock wait timeout error
             print("Lock timeout occurred, please try again")
         return False
     except Exception as e:
         print(f"Unexpected error: {e}")
         return False
 
-def delete_music(id):
+# Edits queued here are applied in the background: several edits to the same song collapse
+# into one, and everything pending is written in a few batched transactions
+WRITE_BEHIND_DELAY = 0.25     # seconds to wait for more edits before flushing
+WRITE_BEHIND_BATCH_SIZE = 200  # songs per transaction
+
+class WriteBehindQueue:
+    """Coalescing write-behind queue for song edits and play-state writes.
+
+    update() merges the given fields into the pending edit for that song id
+    (later values win) and record_play() adds to a pending play counter, so
+    a burst of edits costs one UPDATE per song. A background thread flushes
+    pending work in batched transactions; flush() blocks until everything
+    queued before the call has been written. Writes that fail are dropped
+    and counted in lost, and the flush() waiting on them returns False.
+    """
+    def __init__(self, delay=WRITE_BEHIND_DELAY, batch_size=WRITE_BEHIND_BATCH_SIZE):
+        self.delay = delay
+        self.batch_size = batch_size
+        self._edits = OrderedDict()  # song id -> {field: value}
+        self._plays = OrderedDict()  # song id -> [play count delta, last played]
+        self._condition = threading.Condition()
+        self._queued = 0    # sequence number of the last queued write
+        self._written = 0   # every write up to this sequence number has been flushed
+        self._flush_waiters = 0
+        self._thread = None
+        self.lost = 0       # songs whose queued edit or plays could not be written
+
+    def __len__(self):
+        with self._condition:
+            return len(self._edits.keys() | self._plays.keys())
+
+    def update(self, id, **kwargs):
+        with self._condition:
+            self._edits.setdefault(id, {}).update(kwargs)
+            self._edits.move_to_end(id)
+            self._queued_write()
+
+    def record_play(self, id, played_at=None):
+        with self._condition:
+            play = self._plays.setdefault(id, [0, None])
+            play[0] += 1
+            play[1] = played_at if played_at is not None else time.time()
+            self._queued_write()
+
+    def _queued_write(self):
+        self._queued += 1
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='db-write-behind', daemon=True)
+            self._thread.start()
+        self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Block until every write queued so far is in the database.
+
+        Returns False on timeout, or if some of those writes failed and were lost.
+        """
+        with self._condition:
+            target = self._queued
+            lost = self.lost
+            self._flush_waiters += 1
+            self._condition.notify_all()  # skip the coalescing delay
+            try:
+                return self._condition.wait_for(lambda: self._written >= target, timeout) and self.lost == lost
+            finally:
+                self._flush_waiters -= 1
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._edits or self._plays)
+                # Give rapid edits a moment to coalesce, unless someone is waiting in flush()
+                self._condition.wait_for(lambda: self._flush_waiters, self.delay)
+                edits, self._edits = self._edits, OrderedDict()
+                plays, self._plays = self._plays, OrderedDict()
+                sequence = self._queued
+            try:
+                lost = self._write(edits, plays)
+            except Exception as e:
+                print(f"Write-behind flush failed: {e}")
+                lost = len(edits.keys() | plays.keys())
+            with self._condition:
+                self._written = sequence
+                self.lost += lost
+                self._condition.notify_all()
+
+    def _write(self, edits, plays):
+        # Returns the number of songs whose writes failed
+        ids = list(edits.keys() | plays.keys())
+        lost = 0
+        for chunk in _chunked(ids, self.batch_size):
+            chunk_edits = {id: edits[id] for id in chunk if id in edits}
+            chunk_plays = {id: plays[id] for id in chunk if id in plays}
+            if self._write_batch(chunk_edits, chunk_plays):
+                continue
+            if len(chunk) == 1:
+                lost += 1
+                continue
+            # One bad edit must not lose the rest of the batch, retry song by song
+            for id in chunk:
+                if not self._write_batch({id: edits[id]} if id in edits else {},
+                                         {id: plays[id]} if id in plays else {}):
+                    lost += 1
+        return lost
+
+    def _write_batch(self, edits, plays):
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cursor:
+                    conn.start_transaction()
+                    try:
+                        for id, changes in edits.items():
+                            _apply_song_update(cursor, id, changes)
+                        if plays:
+                            cursor.executemany(
+                                "UPDATE songs SET play_count = play_count + %s, last_played = %s WHERE id = %s",
+                                [(count, played_at, id) for id, (count, played_at) in plays.items()])
+
+                        snapshots = _song_snapshots(cursor, list(edits))
+                        _index_for_search(cursor, snapshots)
+                        conn.commit()
+                        publish_id_caches()
+                        # Play counts alone only touch songs
+                        _bump_generations(*_edited_tables(edits.values()))
+                        _notify_song_listeners('update', snapshots)
+                        return True
+                    except Exception as e:
+                        conn.rollback()
+                        invalidate_id_caches()
+                        print(f"Write-behind batch failed, rolling back: {e}")
+                        return False
+        except DatabaseError as e:
+            print(f"Error flushing queued song writes: {e}")
+            return False
+
+write_queue = WriteBehindQueue()
+
+def queue_song_update(id, **kwargs):
+    # Same fields as update_song, written in the background
+    write_queue.update(id, **kwargs)
+
+def record_play(id):
+    write_queue.record_play(id)
+
+def flush_writes(timeout=None):
+    return write_queue.flush(timeout)
+
+# Ids per IN (...) list, stays under SQLite's 999 host-parameter limit on older builds
+DELETE_BATCH_SIZE = 900
+
+def _delete_unreferenced(cursor, table, condition, ids):
+    # Delete rows of table that nothing references any more; with ids=None the whole table is swept
+    if ids is None:
+        cursor.execute(f"DELETE FROM {table} WHERE {condition}")
+        return cursor.rowcount
+    deleted = 0
+    for chunk in _chunked([id for id in set(ids) if id is not None], DELETE_BATCH_SIZE):
+        cursor.execute(f"DELETE FROM {table} WHERE id IN ({_placeholders(len(chunk))}) AND {condition}",
+                       tuple(chunk))
+        deleted += cursor.rowcount
+    return deleted
+
+def collect_orphans(cursor, album_ids_to_check=None, artist_ids_to_check=None,
+                    genre_ids_to_check=None, cover_ids_to_check=None):
+    """Delete albums, artists, genres and covers no song (or album) refers to.
+
+    Each argument limits the check to those candidate ids; None sweeps the
+    whole table. Runs inside the caller's transaction, one statement per
+    table and chunk. Returns the number of rows removed per table.
+    """
+    deleted = {}
+    # Albums go first so artists whose last album just went away are caught too
+    deleted['albums'] = _delete_unreferenced(cursor, 'albums',
+        "NOT EXISTS (SELECT 1 FROM songs s WHERE s.album_id = albums.id)", album_ids_to_check)
+    deleted['artists'] = _delete_unreferenced(cursor, 'artists',
+        "NOT EXISTS (SELECT 1 FROM songs s WHERE s.artist_id = artists.id) "
+        "AND NOT EXISTS (SELECT 1 FROM albums al WHERE al.artist_id = artists.id)", artist_ids_to_check)
+    deleted['genres'] = _delete_unreferenced(cursor, 'genres',
+        "NOT EXISTS (SELECT 1 FROM songs s WHERE s.genre_id = genres.id)", genre_ids_to_check)
+    deleted['covers'] = _delete_unreferenced(cursor, 'covers',
+        "NOT EXISTS (SELECT 1 FROM songs s WHERE s.cover_id = covers.id)", cover_ids_to_check)
+
+    # Candidates that survived are simply resolved again on next use
+    for cache, ids in ((album_ids, album_ids_to_check), (artist_ids, artist_ids_to_check),
+                       (genre_ids, genre_ids_to_check), (cover_ids, cover_ids_to_check)):
+        if ids is None:
+            cache.clear()
+        else:
+            cache.discard_ids(ids)
+    if artist_ids_to_check is None:
+        album_ids.clear()
+    elif artist_ids_to_check:
+        gone = set(artist_ids_to_check)
+        album_ids.discard_where(lambda key: key[1] in gone)
+    return deleted
+
+def sweep_orphans():
+    # Full-table GC pass, e.g. once at startup to clean up after older versions
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
                 conn.start_transaction()
-                
                 try:
-                    cursor.execute("""
-                                   SELECT album_id, artist_id
-                                   FROM songs
-                                   where id = %s
-                                   """, (id,))
-                    res = cursor.fetchone()
-                    if not res:
-                        print(f"Song with ID {id} not found in Database")
-                        return
-                    
-                    album_id, artist_id = res
-                    
-                    cursor.execute("DELETE FROM songs WHERE id = %s",  (album_id))
-                    cursor.execute("SELECT COUNT(*) FROM songs WHERE album_id = %s", (album_id))             
-                    
-                    if cursor.fetchone()[0] == 0:
-                        cursor.execute("DELETE FROM albums WHERE id = %d", (album_id))      
-                        
-                    cursor.execute("SELECT COUNT(*) FROM songs WHERE artist_id = %s")
-                    if cursor.fetchone()[0] == 0:
-                        cursor.execute("DELETE FROM artists WHERE id = %s", (artist_id))
-                        
+                    deleted = collect_orphans(cursor)
                     conn.commit()
-                    print(f"Music with ID {id} and related records deleted successfully")
-                except Exception as e:
+                except Exception:
                     conn.rollback()
-                    print(f"Error during deletion song with ID {id}")
+                    invalidate_id_caches()
                     raise
-    except mysql.connector.Error as e:
-        print(f"Error deleting song with ID {id}")
+        _bump_generations(*[table for table, count in deleted.items() if count])
+        total = sum(deleted.values())
+        if total:
+            print(f"Removed {total} orphaned albums, artists, genres and covers")
+        return total
+    except DatabaseError as e:
+        print(f"Error sweeping orphaned records: {e}")
+        return 0
+
+def delete_songs(ids):
+    """Delete many songs in one transaction.
+
+    Songs go in one DELETE per DELETE_BATCH_SIZE ids, followed by a single
+    set-based orphan pass over the albums, artists, genres and covers they
+    used. Returns the list of ids that were actually deleted.
+    """
+    ids = list(dict.fromkeys(id for id in ids if id is not None))
+    if not ids:
+        return []
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                conn.start_transaction()
+                try:
+                    found = []
+                    for chunk in _chunked(ids, DELETE_BATCH_SIZE):
+                        cursor.execute(f"""
+                            SELECT id, album_id, artist_id, genre_id, cover_id FROM songs
+                            WHERE id IN ({_placeholders(len(chunk))})
+                        """, tuple(chunk))
+                        found.extend(cursor.fetchall())
+                    if not found:
+                        conn.rollback()
+                        return []
+
+                    deleted = [row[0] for row in found]
+                    for chunk in _chunked(deleted, DELETE_BATCH_SIZE):
+                        cursor.execute(f"DELETE FROM songs WHERE id IN ({_placeholders(len(chunk))})", tuple(chunk))
+                        _unindex_for_search(cursor, chunk)
+
+                    orphans = collect_orphans(cursor,
+                                              album_ids_to_check=[row[1] for row in found],
+                                              artist_ids_to_check=[row[2] for row in found],
+                                              genre_ids_to_check=[row[3] for row in found],
+                                              cover_ids_to_check=[row[4] for row in found])
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    invalidate_id_caches()
+                    raise
+        _bump_generations('songs', *[table for table, count in orphans.items() if count])
+        _notify_song_listeners('delete', deleted)
+        print(f"Deleted {len(deleted)} songs and their orphaned records")
+        return deleted
+    except DatabaseError as e:
+        print(f"Error deleting {len(ids)} songs: {e}")
+        return []
+
+def delete_music(id):
+    if delete_songs([id]):
+        print(f"Music with ID {id} and related records deleted successfully")
+        return True
+    print(f"Song with ID {id} not found in Database")
+    return False
         
                             
 def reading_parsed_json(json_file_path):
@@ -1,50 +1,593 @@
-import mysql.connector
-from mysql.connector import pooling
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
 
-# Connect to the database
 try:
-    pool = mysql.connector.pooling.MySQLConnectionPool(
-        pool_name='mypool',
-        pool_size=5,
-        host='localhost',
-        user='root',
-        password='Namo!CS3003',
-        database='music_player_db'
-    )
-    print("Database connection pool created successfully")
-except mysql.connector.Error as e:
-    print(f"Error creating connection pool: {e}")
+    import mysql.connector
+except ImportError:
+    mysql = None
+
+# Which storage backend to use: 'mysql' (server) or 'sqlite' (embedded file)
+DB_BACKEND = os.environ.get('MUSIC_PLAYER_DB_BACKEND', 'mysql').lower()
+
+MYSQL_CONFIG = {
+    'host': os.environ.get('MUSIC_PLAYER_DB_HOST', 'localhost'),
+    'user': os.environ.get('MUSIC_PLAYER_DB_USER', 'root'),
+    'password': os.environ.get('MUSIC_PLAYER_DB_PASSWORD', 'Namo!CS3003'),
+    'database': os.environ.get('MUSIC_PLAYER_DB_NAME', 'music_player_db')
+}
+
+# Connection pool sizing (MySQL). The pool opens min_size connections up front, grows
+# up to max_size under load, and only then makes callers wait up to timeout seconds.
+# Connections idle for ping_after seconds are pinged on checkout, the server may have dropped them.
+POOL_CONFIG = {
+    'min_size': int(os.environ.get('MUSIC_PLAYER_DB_POOL_MIN', 5)),
+    'max_size': int(os.environ.get('MUSIC_PLAYER_DB_POOL_MAX', 15)),
+    'timeout': float(os.environ.get('MUSIC_PLAYER_DB_POOL_TIMEOUT', 10)),
+    'idle_timeout': float(os.environ.get('MUSIC_PLAYER_DB_POOL_IDLE_TIMEOUT', 300)),
+    'ping_after': float(os.environ.get('MUSIC_PLAYER_DB_POOL_PING_AFTER', 30)),
+}
+
+SQLITE_PATH = os.environ.get(
+    'MUSIC_PLAYER_DB_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'music_player.db'))
+
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -32000",      # ~32 MB page cache
+    "PRAGMA mmap_size = 268435456",    # 256 MB memory-mapped reads
+    "PRAGMA busy_timeout = 5000",
+)
+
+class BackendUnavailable(RuntimeError):
+    # Raised when the configured backend cannot be created (server down, driver missing, ...)
+    pass
+
+class PoolExhausted(BackendUnavailable):
+    # Raised when no connection became free within the pool timeout
+    pass
+
+# Exceptions callers should catch for any backend
+DatabaseError = (sqlite3.Error, BackendUnavailable) + ((mysql.connector.Error,) if mysql else ())
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+_QUERY_TARGET = re.compile(r'^\s*(\w+)\b(?:.*?\b(?:FROM|INTO|TABLE(?:\s+IF\s+NOT\s+EXISTS)?))?\s+(\w+)', re.IGNORECASE | re.DOTALL)
+
+
+class LatencyHistogram:
+    """Latency histogram with power-of-two millisecond buckets.
+
+    Bucket i counts samples below 2**i / 8 ms (the last one is open ended),
+    which covers 0.125 ms .. ~8 s in 17 buckets at constant cost per sample.
+    """
+    BUCKETS = 17
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        bucket = min(self.BUCKETS - 1, max(0, int(ms * 8).bit_length()))
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    @staticmethod
+    def bucket_limit(bucket):
+        return (2 ** bucket) / 8
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of samples
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.bucket_limit(bucket), self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(0.50),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': self.max,
+            'buckets': {f"<{self.bucket_limit(i):g}ms" if i < self.BUCKETS - 1 else "rest": c
+                        for i, c in enumerate(self.counts) if c},
+        }
+
+
+class PoolStats:
+    """Counters and latency histograms for the connection layer.
+
+    wait: time spent getting a connection, hold: time a connection was
+    checked out, queries: execution time per statement kind and table.
+    """
+    MAX_QUERY_KINDS = 256
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.exhaustions = 0   # checkouts that found no idle connection at the ceiling and had to wait
+            self.timeouts = 0      # checkouts that gave up waiting
+            self.created = 0
+            self.closed = 0
+            self.dead = 0          # idle connections that failed the checkout ping and were replaced
+            self.in_use = 0
+            self.peak_in_use = 0
+            self.wait = LatencyHistogram()
+            self.hold = LatencyHistogram()
+            self.queries = {}
+            self._kinds = {}
+
+    def record_checkout(self, waited):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            self.wait.record(waited)
+
+    def record_release(self, held):
+        with self._lock:
+            self.in_use -= 1
+            self.hold.record(held)
+
+    def record_event(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _kind(self, query):
+        if (kind := self._kinds.get(query)) is not None:
+            return kind
+        match = _QUERY_TARGET.match(query)
+        kind = f"{match.group(1).upper()} {match.group(2)}" if match else query.split(None, 1)[0].upper()
+        if len(self._kinds) < 4096:
+            self._kinds[query] = kind
+        return kind
+
+    def record_query(self, query, seconds):
+        with self._lock:
+            kind = self._kind(query)
+            histogram = self.queries.get(kind)
+            if histogram is None:
+                if len(self.queries) >= self.MAX_QUERY_KINDS:
+                    kind = 'OTHER'
+                    histogram = self.queries.setdefault(kind, LatencyHistogram())
+                else:
+                    histogram = self.queries[kind] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'exhaustions': self.exhaustions,
+                'timeouts': self.timeouts,
+                'created': self.created,
+                'closed': self.closed,
+                'dead': self.dead,
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'wait': self.wait.snapshot(),
+                'hold': self.hold.snapshot(),
+                'queries': {kind: h.snapshot() for kind, h in sorted(self.queries.items())},
+            }
+
+
+pool_stats = PoolStats()
+
+
+class ConnectionPool:
+    """Thread-safe pool of raw DB-API connections.
+
+    Opens min_size connections up front, opens more on demand up to
+    max_size, and only once at the ceiling makes callers block for up to
+    timeout seconds before raising PoolExhausted. Connections above
+    min_size that sit idle for idle_timeout seconds are closed again.
+    A connection idle for more than ping_after seconds is checked with
+    ping(conn) before it is handed out and replaced if that raises.
+    """
+    def __init__(self, factory, min_size=5, max_size=15, timeout=10.0, idle_timeout=300.0,
+                 ping=None, ping_after=30.0, stats=pool_stats):
+        self.factory = factory
+        self.ping = ping
+        self.ping_after = ping_after
+        self.min_size = min_size
+        self.max_size = max(min_size, max_size)
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.stats = stats
+        self._idle = deque()   # (connection, released_at)
+        self._size = 0
+        self._cond = threading.Condition()
+
+    @property
+    def size(self):
+        return self._size
+
+    def fill(self):
+        # Pre-open connections up to min_size
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._create()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def _create(self):
+        conn = self.factory()
+        self.stats.record_event('created')
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception as e:
+            print(f"Error closing pooled connection: {e}")
+        self.stats.record_event('closed')
+
+    def get(self):
+        deadline = None
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, released = self._idle.pop()  # most recently used first, the rest can go idle
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn = None
+                    break
+                if not waited:
+                    waited = True
+                    self.stats.record_event('exhaustions')
+                    deadline = time.monotonic() + self.timeout
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats.record_event('timeouts')
+                    raise PoolExhausted(f"No database connection free after {self.timeout}s "
+                                        f"({self._size} open)")
+                self._cond.wait(remaining)
+
+        if conn is not None and self.ping is not None and time.monotonic() - released > self.ping_after:
+            # Outside the lock, a ping is a round trip. A dead connection keeps its slot for the replacement
+            try:
+                self.ping(conn)
+            except Exception as e:
+                print(f"Replacing dead pooled connection: {e}")
+                self.stats.record_event('dead')
+                self._close(conn)
+                conn = None
+
+        if conn is None:
+            try:
+                conn = self._create()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+        return conn
+
+    def put(self, conn, discard=False):
+        now = time.monotonic()
+        to_close = []
+        with self._cond:
+            if discard:
+                self._size -= 1
+                to_close.append(conn)
+            else:
+                self._idle.append((conn, now))
+            # Shrink back towards min_size: the least recently used connections sit at the left
+            while (self._size > self.min_size and self._idle
+                   and now - self._idle[0][1] > self.idle_timeout):
+                to_close.append(self._idle.popleft()[0])
+                self._size -= 1
+            self._cond.notify()
+        for stale in to_close:
+            self._close(stale)
+
+    def close_all(self):
+        with self._cond:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn in idle:
+            self._close(conn)
+
+
+class Dialect:
+    """SQL differences between backends.
+
+    data_operations writes its queries in MySQL syntax (%s placeholders,
+    INSERT IGNORE); translate() rewrites them for the active backend.
+    """
+    def __init__(self, name, placeholder, insert_ignore, identifier_quote):
+        self.name = name
+        self.placeholder = placeholder
+        self.insert_ignore = insert_ignore
+        self.identifier_quote = identifier_quote
+        self._translated = {}
+
+    def translate(self, query):
+        if self.name == 'mysql':
+            return query
+        if (translated := self._translated.get(query)) is None:
+            translated = query.replace('%s', self.placeholder).replace('INSERT IGNORE', self.insert_ignore)
+            self._translated[query] = translated
+        return translated
+
+    def quote(self, identifier):
+        # Column names come from caller supplied keys, so only plain identifiers are allowed
+        if not _IDENTIFIER.match(identifier):
+            raise ValueError(f"Invalid column name: {identifier!r}")
+        return f"{self.identifier_quote}{identifier}{self.identifier_quote}"
+
+
+MYSQL = Dialect('mysql', '%s', 'INSERT IGNORE', '`')
+SQLITE = Dialect('sqlite', '?', 'INSERT OR IGNORE', '"')
+
+
+class CursorWrapper:
+    # Gives every backend the same cursor API (context manager, %s placeholders)
+    def __init__(self, cursor, dialect):
+        self._cursor = cursor
+        self.dialect = dialect
 
-class DBConnection:
     def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, query, params=()):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(self.dialect.translate(query), params)
+        finally:
+            pool_stats.record_query(query, time.perf_counter() - started)
+
+    def executemany(self, query, seq_params):
+        started = time.perf_counter()
         try:
-            self.conn = pool.get_connection()
-            print("Got connection from pool")
-            return self.conn
+            return self._cursor.executemany(self.dialect.translate(query), seq_params)
+        finally:
+            pool_stats.record_query(query, time.perf_counter() - started)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size) if size else self._cursor.fetchmany()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class ConnectionWrapper:
+    def __init__(self, conn, backend):
+        self._conn = conn
+        self.backend = backend
+        self.dialect = backend.dialect
+
+    def cursor(self, **kwargs):
+        return CursorWrapper(self._conn.cursor(**kwargs), self.dialect)
+
+    def start_transaction(self):
+        self.backend.start_transaction(self._conn)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def discard_results(self):
+        # Drop rows an unbuffered cursor has not read yet, so the cursor can be closed early
+        self.backend.discard_results(self._conn)
+
+    @property
+    def raw(self):
+        return self._conn
+
+
+class MySQLBackend:
+    dialect = MYSQL
+
+    def __init__(self, config, pool_config):
+        if mysql is None:
+            raise RuntimeError("mysql-connector-python is not installed")
+        self.pool = ConnectionPool(lambda: mysql.connector.connect(**config),
+                                   ping=lambda conn: conn.ping(reconnect=True), **pool_config)
+        self.pool.fill()
+
+    def connect(self):
+        return ConnectionWrapper(self.pool.get(), self)
+
+    def release(self, conn):
+        raw = conn.raw
+        try:
+            # Hand the next user a clean connection
+            if raw.unread_result:
+                raw.consume_results()
+            if raw.in_transaction:
+                raw.rollback()
         except mysql.connector.Error as e:
+            print(f"Discarding broken pooled connection: {e}")
+            self.pool.put(raw, discard=True)
+            return
+        self.pool.put(raw)
+
+    def start_transaction(self, raw):
+        raw.start_transaction()
+
+    def discard_results(self, raw):
+        if raw.unread_result:
+            raw.consume_results()
+
+    def list_tables(self, cursor):
+        cursor.execute("SHOW TABLES")
+        return [row[0] for row in cursor.fetchall()]
+
+
+class SQLiteBackend:
+    dialect = SQLITE
+
+    def __init__(self, path):
+        self.path = path
+        # sqlite3 connections are cheap but not shareable across threads, so keep one per thread
+        self._local = threading.local()
+
+    def _open(self):
+        # isolation_level=None: we issue BEGIN ourselves in start_transaction
+        raw = sqlite3.connect(self.path, isolation_level=None)
+        for pragma in SQLITE_PRAGMAS:
+            raw.execute(pragma)
+        return raw
+
+    def connect(self):
+        raw = getattr(self._local, 'conn', None)
+        if raw is None:
+            raw = self._local.conn = self._open()
+        return ConnectionWrapper(raw, self)
+
+    def release(self, conn):
+        # Keep the per-thread connection open, but never leak an open transaction
+        if conn.raw.in_transaction:
+            conn.raw.rollback()
+
+    def start_transaction(self, raw):
+        raw.execute("BEGIN")
+
+    def discard_results(self, raw):
+        # sqlite3 cursors can be closed at any point
+        pass
+
+    def list_tables(self, cursor):
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")
+        return [row[0] for row in cursor.fetchall()]
+
+
+def create_backend(name=DB_BACKEND):
+    if name == 'sqlite':
+        return SQLiteBackend(SQLITE_PATH)
+    if name == 'mysql':
+        return MySQLBackend(MYSQL_CONFIG, POOL_CONFIG)
+    raise ValueError(f"Unknown database backend: {name}")
+
+
+# The backend (and with it the MySQL pool) is created on first use, not at import,
+# so importing this module never waits on the database
+backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    global backend
+    if backend is not None:
+        return backend
+    with _backend_lock:
+        if backend is None:
+            try:
+                backend = create_backend()
+                print(f"Database backend '{DB_BACKEND}' created successfully")
+            except (RuntimeError, ValueError) + DatabaseError as e:
+                raise BackendUnavailable(f"Error creating database backend: {e}") from e
+    return backend
+
+class DBConnection:
+    def __enter__(self):
+        self.backend = get_backend()
+        started = time.perf_counter()
+        try:
+            self.conn = self.backend.connect()
+        except DatabaseError as e:
             print(f"Error getting connection from pool: {e}")
             raise
+        self.checked_out = time.perf_counter()
+        pool_stats.record_checkout(self.checked_out - started)
+        return self.conn
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if hasattr(self, 'conn'):
-            self.conn.close()
-            print("Connection returned to pool")
+            self.backend.release(self.conn)
+            pool_stats.record_release(time.perf_counter() - self.checked_out)
 
 # Usage in the data operations file
 def get_db_connection():
     return DBConnection()
 
-# Test the connection
+# Test the connection, returns True when the database answers
 def test_connection():
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
-                cursor.execute("SHOW TABLES")
-                tables = cursor.fetchall()
+                tables = get_backend().list_tables(cursor)
                 print("Tables in the database:")
-                print("\n".join(table[0] for table in tables))
-    except mysql.connector.Error as e:
+                print("\n".join(tables))
+                return True
+    except DatabaseError as e:
         print(f"Error testing connection: {e}")
+        return False
 
-# Call this function when your application starts
-test_connection()
+# Connection checkout/hold times, pool exhaustion counts and per-query latency histograms
+def get_pool_stats():
+    stats = pool_stats.snapshot()
+    if backend is not None and hasattr(backend, 'pool'):
+        stats['pool_size'] = backend.pool.size
+        stats['pool_max_size'] = backend.pool.max_size
+    return stats
+
+def reset_pool_stats():
+    pool_stats.reset()
+
+# Create the backend (opening the MySQL pool's connections) and check it answers.
+# Blocks on the database, so call it from a background thread once the window is up.
+def warm_up():
+    try:
+        get_backend()
+    except BackendUnavailable as e:
+        print(e)
+        return False
+    return test_connection()
@@ -6,7 +6,7 @@ import time
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QPushButton, QFileDialog, QHBoxLayout, QProgressBar, QLabel
 from PyQt5.QtCore import QSize
 from PyQt5.QtGui import QIcon
-from data_operations import insert_song, reading_parsed_json
+from data_operations import insert_songs
 
 
 
@@ -233,38 +233,38 @@ class DownloadManager:
             pause_butt.clicked.connect(lambda: self.toggle_pause(thread_id, pause_butt))
             stop_butt.clicked.connect(lambda: self.stop_dld(thread_id))
             
-            def download_callback(thread_id, result):
-                if isinstance(result, dict):
-                    audio_file = result.get('audio')
-                    json_file = result.get('json')
-                    thumbnail_file = result.get('thumbnail')
-                    
-                    if audio_file and json_file and download_type in ['Audio', 'Audio Playlist']:
-                        # Parse JSON and insert song data into database
-                        song_data = reading_parsed_json(json_file)
-                        insert_song(
-                            audio_file, 
-                            json_file,
-                            song_data['title'],
-                            song_data['artist'],
-                            song_data['album'],
-                            song_data['genre'],
-                            thumbnail_file,
-                            song_data['track_number'],
-                            song_data['release_year'],
-                            song_data['album_type'],
-                            song_data['duration']
-                        )
-                        
-                        # Update UI
-                        self.app.file_manager.add_file_to_list(audio_file)
-                    elif download_type in ['Video', 'Video Playlist']:
-                        print(f"Video download completed: {audio_file}")
-                    else:
-                        print(f"Unexpected download type: {download_type}")
-                else:
+            def download_callback(finished_id, result):
+                # Every download connects its own callback, only handle ours
+                if finished_id != thread_id:
+                    return
+
+                # Single downloads return a file path, playlists a list of dicts
+                if isinstance(result, str):
+                    base_filename = os.path.splitext(result)[0]
+                    result = [{
+                        'audio': result,
+                        'json': f"{base_filename}.info.json",
+                        'thumbnail': f"{base_filename}.webp"
+                    }]
+                elif isinstance(result, dict):
+                    result = [result]
+
+                if not isinstance(result, list):
                     print(f"Unexpected result format: {result}")
-                    
+                    return
+
+                if download_type in ['Video', 'Video Playlist']:
+                    for item in result:
+                        print(f"Video download completed: {item.get('video')}")
+                    return
+
+                if download_type not in ['Audio', 'Audio Playlist']:
+                    print(f"Unexpected download type: {download_type}")
+                    return
+
+                # Parse JSON and insert all downloaded songs in one batch on a DB worker
+                self.app.db.submit(self.store_downloads, result, callback=self.on_downloads_stored)
+
             self.app.signals.dld_finished.connect(download_callback)
 
             # Start the download thread
@@ -273,6 +273,26 @@ class DownloadManager:
 
             self.app.url_entry.clear()
 
+    def store_downloads(self, items):
+        # Runs on a DB worker, returns (records, outcomes) for on_downloads_stored
+        records = []
+        for item in items:
+            audio_file = item.get('audio')
+            json_file = item.get('json')
+            if audio_file and json_file:
+                records.append(self.app.file_manager.build_song_record(
+                    audio_file, audio_file, json_file, item.get('thumbnail')))
+
+        if not records:
+            return [], []
+        return records, insert_songs(records)
+
+    def on_downloads_stored(self, result):
+        records, outcomes = result
+        for record, outcome in zip(records, outcomes):
+            if outcome == 'inserted':
+                self.app.music_list.addItem(record['title'])
+
     def dld(self, dld_func, url, output_folder, thread_id, pause_event, stop_event):
         try:
             if result := dld_func(
@@ -0,0 +1,424 @@
+from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QPushButton, QLineEdit, QListWidget, QHBoxLayout, QSlider, QTabWidget, QSpacerItem, QSizePolicy, QLabel, QGridLayout, QScrollArea
+from PyQt5.QtCore import Qt, QUrl, QSize, QTimer, QSettings
+from PyQt5.QtGui import QIcon
+from PyQt5.QtWebEngineWidgets import QWebEngineView
+import threading
+import pygame
+
+
+# Component Imports
+from download_manager import DownloadManager
+from music_player import MusicPlayer, SeekBar
+from file_manager import FileManager
+from signals import DownloadSignals
+from async_data import AsyncDataOperations
+from db_connection import warm_up
+from schema import apply_migrations
+from metadata_cache import metadata_cache
+from pcm_cache import pcm_cache
+from search import SearchIndex
+from library_index import LibraryIndex, LIBRARY_COLUMNS
+from data_operations import (add_song_listener, retrieve_song, get_all_song, flush_writes, sweep_orphans,
+                             backfill_content_hashes, backfill_durations, backfill_loudness, stop_backfills)
+from waveform import shutdown as shutdown_waveforms
+
+# from Foundation import NSObject
+# from AppKit import NSApplicationDelegate
+
+# class CustomDelegate(NSObject, NSApplicationDelegate):
+#     def applicationSupportsSecureRestorableState_(self, application):
+#         return objc.YES
+
+class SecureApp(QApplication):
+    def applicationSupportsSecureRestorableState(self):
+        return True
+
+# Main application class
+class DownloaderApp(QWidget):
+    def __init__(self):
+        super().__init__()
+        self.music_list = QListWidget()
+        self.init_mixer()
+
+        self.setWindowTitle("Music Player")
+
+        # Resident copy of the library used for navigation and title lookups, and the
+        # in-memory search index. Both are filled off the GUI thread once the window is shown.
+        self.library = LibraryIndex()
+        self.search_index = SearchIndex()
+        self.library_load_started = False
+
+        # All database work runs on these workers, results come back on the Qt thread
+        self.db = AsyncDataOperations()
+
+        # Initialize manager classes
+        self.music_player = MusicPlayer(self)
+        self.download_manager = DownloadManager(self, self.music_player)
+        self.file_manager = FileManager(self, self.music_player, self.music_list)
+
+         # Connect music list item events
+
+        self.music_list.itemClicked.connect(self.music_player.on_music_selected)
+        self.music_list.itemDoubleClicked.connect(self.music_player.play_selected_track)
+
+        self.file_paths = self.file_manager.load_file_paths()
+        self.paused = False
+        self.tracks = list(self.file_paths.keys())
+
+        # Timer for handling double-click on previous button
+        self.double_click_timer = QTimer()
+        self.double_click_timer.setInterval(300)
+        self.double_click_timer.setSingleShot(True)
+        self.double_click_timer.timeout.connect(self.music_player.single_click_prev)
+
+        self.curr_playing_track = None
+
+        self.bar_progress = 0
+
+        # Timer for updating progress bar
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.download_manager.update_progress_bar)
+
+        # The music list is populated in on_library_loaded
+        self.music_list.currentRowChanged.connect(self.music_player.on_music_selected)
+
+        # Filter the music list shortly after the user stops typing
+        self.search_timer = QTimer()
+        self.search_timer.setInterval(150)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.timeout.connect(self.filter_music_list)
+
+
+        # Music player state variables
+        self.playback_positions = {}
+        self.curr_track_index = -2
+
+        self.initUI()
+
+        # Dictionaries to manage downloads and their states
+        self.download_counter = {}
+        self.progress_bars = {}
+        self.download_progress = {}
+        self.pause_events = {}
+        self.stop_events = {}
+
+        # Initialize signals for download events
+        self.signals = DownloadSignals()
+
+        # Connect signals to slots
+        self.signals.dld_progress.connect(self.update_progress)
+        self.signals.dld_status.connect(self.update_status)
+        self.signals.dld_finished.connect(self.download_manager.stop_dld)
+        self.signals.dld_paused.connect(lambda thread_id: self.download_manager.toggle_pause(thread_id, None))
+        self.signals.dld_resumed.connect(self.resume_dld)
+        self.signals.dld_stopped.connect(self.download_manager.stop_dld)
+        self.signals.dld_error.connect(self.show_download_error)
+
+    def update_progress(self, thread_id, percent):
+        if thread_id in self.progress_bars:
+            progress_bar, _, _, _ = self.progress_bars[thread_id]
+            progress_bar.setValue(percent)
+
+    def update_status(self, thread_id, status):
+        if thread_id in self.progress_bars:
+            _, label, _, _ = self.progress_bars[thread_id]
+            label.setText(f"Status: {status}")
+        print(f"Status updated for thread {thread_id}: {status}")
+
+
+    # def stop_dld(self, thread_id):
+    #     if thread_id in self.stop_events:
+    #         self.stop_events[thread_id].set()
+    #     if thread_id in self.progress_bars:
+    #         progress_bar, label, _, _ = self.progress_bars[thread_id]
+    #         progress_bar.setValue(100)
+    #         label.setText("Status: Download Stopped")
+
+    # def pause_dld(self, thread_id):
+    #     if thread_id in self.pause_events:
+    #         self.pause_events[thread_id].clear()
+
+    def resume_dld(self, thread_id):
+        if thread_id in self.pause_events:
+            self.pause_events[thread_id].set()
+
+    def show_download_error(self, error_message, thread_id):
+        if thread_id in self.progress_bars:
+            _, label, _, _ = self.progress_bars[thread_id]
+            label.setText(f"Error: {error_message}")
+        # Emit the error to update the status
+        self.signals.dld_status.emit(f"Download Error: {error_message}", thread_id)  # Fixed order
+
+    def init_mixer(self):
+        try:
+            pygame.mixer.init()
+            print("Pygame mixer initialized successfully.")
+        except pygame.error as e:
+            print(f"Error initializing Pygame mixer: {e}")
+
+    def initUI(self):
+        # Set up the main layout and tabs
+        main_layout = QVBoxLayout(self)
+        self.setLayout(main_layout)
+
+        self.tabs = QTabWidget()
+        main_layout.addWidget(self.tabs)
+
+        self.music_player_tab = QWidget()
+        self.dld_tab = QWidget()
+        self.browser_tab = QWidget()
+    
+        self.tabs.addTab(self.music_player_tab, "Music Player")
+        self.tabs.addTab(self.dld_tab, "Download")
+        self.tabs.addTab(self.browser_tab, "Browser")
+
+        self.init_music_player_tab()
+        self.init_dld_tab()
+        self.init_browser_tab()
+
+        self.load_window_settings()
+
+    def load_window_settings(self):
+        settings = QSettings('NadaAyman', 'MusicPlayer')
+        geometry = settings.value('geometry')
+        window_state = settings.value('windowState')
+
+        if geometry:
+            self.ui.restoreGeometry(geometry)
+        if window_state:
+            self.ui.restoreState(window_state)
+
+    def save_window_settings(self):
+        settings = QSettings('NadaAyman', 'MusicPlayer')
+        settings.setValue('geometry', self.ui.saveGeometry())
+        settings.setValue('windowState', self.ui.saveState())
+
+    def init_dld_tab(self):
+        # Set up the download tab UI
+        layout = QVBoxLayout(self.dld_tab)
+        self.setLayout(layout)
+
+        self.url_entry = QLineEdit()
+        layout.addWidget(self.url_entry)
+
+        layout.addSpacerItem(QSpacerItem(20, 20, QSizePolicy.Minimum, QSizePolicy.Fixed))
+        
+        self.dld_butt_container = QWidget()
+        self.dld_buttons_layout = QGridLayout(self.dld_butt_container)
+        layout.addWidget(self.dld_butt_container)
+
+        # Create download buttons
+        self.dld_audio_butt = QPushButton("Download Audio")
+        self.dld_audio_butt.clicked.connect(self.download_manager.dld_audio_gui)
+        self.dld_buttons_layout.addWidget(self.dld_audio_butt, 0, 0)
+
+        self.dld_audiolist_butt = QPushButton("Download Audio Playlist")
+        self.dld_audiolist_butt.clicked.connect(self.download_manager.dld_audiolist_gui)
+        self.dld_buttons_layout.addWidget(self.dld_audiolist_butt, 0, 1)
+        
+        self.dld_vid_butt = QPushButton("Download Video")
+        self.dld_vid_butt.clicked.connect(self.download_manager.dld_vid_gui)
+        self.dld_buttons_layout.addWidget(self.dld_vid_butt, 0, 2)
+
+        self.dld_vidlist_butt = QPushButton("Download Video Playlist")
+        self.dld_vidlist_butt.clicked.connect(self.download_manager.dld_vidlist_gui)
+        self.dld_buttons_layout.addWidget(self.dld_vidlist_butt, 0, 3)
+
+        layout.addSpacerItem(QSpacerItem(20, 30, QSizePolicy.Minimum, QSizePolicy.Fixed))
+
+        self.status_label = QLabel("Status: Idle")
+        layout.addWidget(self.status_label)
+
+        # Set up progress scroll area
+        self.progress_scroll_area = QScrollArea(self)
+        self.progress_scroll_area.setWidgetResizable(True)
+        self.progress_widget = QWidget()
+        self.progress_layout = QVBoxLayout(self.progress_widget)
+        self.progress_scroll_area.setWidget(self.progress_widget)
+        layout.addWidget(self.progress_scroll_area)
+
+        self.exit_butt = QPushButton("Exit")
+        self.exit_butt.clicked.connect(self.exit_app)
+        layout.addWidget(self.exit_butt)
+        
+    def exit_app(self):
+        self.close()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not self.library_load_started:
+            self.library_load_started = True
+            # Let the window paint first, then talk to the database in the background
+            QTimer.singleShot(0, self.start_library_load)
+
+    def start_library_load(self):
+        self.db.submit(self.load_library, callback=self.on_library_loaded)
+
+    def load_library(self):
+        # Runs on a DB worker: connect, migrate, then fill the in-memory indexes
+        loaded = warm_up() and apply_migrations() is not None
+        if loaded:
+            sweep_orphans()
+            # Keep all three in sync with every insert/update/delete. Listen before reading the
+            # snapshot, changes committed while it loads are held back and applied on top of it
+            listeners = (self.library.on_song_change, self.search_index.on_song_change,
+                         self.music_player.queue.on_song_change)
+            held = []
+            lock = threading.Lock()
+            def apply(event, songs):
+                for listener in listeners:
+                    try:
+                        listener(event, songs)
+                    except Exception as e:
+                        print(f"Song listener {listener} failed on {event}: {e}")
+            def on_song_change(event, songs):
+                with lock:
+                    if held is not None:
+                        held.append((event, songs))
+                    else:
+                        apply(event, songs)
+            add_song_listener(on_song_change)
+
+            self.library.load(get_all_song(columns=LIBRARY_COLUMNS, order_by='id', stream=True))
+            self.search_index.load(retrieve_song(columns=('id', 'title', 'artist', 'album', 'genre'), stream=True))
+            self.music_player.queue.load(self.library.ids())
+            with lock:
+                # Snapshots in the events are whole rows, applying one the load already saw is harmless
+                for event, songs in held:
+                    apply(event, songs)
+                held = None
+        return loaded
+
+    def on_library_loaded(self, loaded):
+        if not loaded:
+            print("Could not load the music library from the database")
+            return
+        self.file_manager.populate_music_list()
+        self.filter_music_list()
+        # Songs added before content hashing existed get hashed in the background
+        self.db.submit_background(backfill_content_hashes)
+        # and songs without a known length get it from their file headers
+        self.db.submit_background(backfill_durations)
+        # Loudness of new and changed files, measured in worker processes
+        self.db.submit_background(backfill_loudness)
+
+    def filter_music_list(self):
+        query = self.search_entry.text().strip()
+        matches = None
+        if query:
+            matches = {self.search_index.title(song_id) for song_id in self.search_index.search(query, limit=None)}
+
+        for row in range(self.music_list.count()):
+            item = self.music_list.item(row)
+            item.setHidden(matches is not None and item.text() not in matches)
+
+    def init_music_player_tab(self):
+        # Set up the music player tab UI
+        layout = QVBoxLayout()
+        self.music_player_tab.setLayout(layout)
+
+        # Search box filtering the music list as you type
+        self.search_entry = QLineEdit()
+        self.search_entry.setPlaceholderText("Search title, artist, album or genre")
+        self.search_entry.setClearButtonEnabled(True)
+        self.search_entry.textChanged.connect(lambda: self.search_timer.start())
+        layout.addWidget(self.search_entry)
+
+        layout.addWidget(self.music_list)
+
+        player_layout = QHBoxLayout()
+
+        # Create player control buttons
+        self.prev_butt = QPushButton()
+        self.prev_icon = QIcon("../images/prev.svg")
+        self.prev_butt.setIcon(self.prev_icon)
+        self.prev_butt.setIconSize(QSize(50, 50))
+        self.prev_butt.clicked.connect(self.music_player.prev_music)
+        player_layout.addWidget(self.prev_butt)
+
+        self.play_butt = QPushButton()
+        self.play_icon = QIcon("../images/play.svg")
+        self.pause_icon = QIcon("../images/pause.svg")
+        self.play_butt.setIcon(self.play_icon)
+        self.play_butt.setIconSize(QSize(50, 50))
+        self.play_butt.clicked.connect(self.music_player.play_pause_music)
+        player_layout.addWidget(self.play_butt)
+
+        self.next_butt = QPushButton()
+        self.next_icon = QIcon("../images/skip.svg")
+        self.next_butt.setIcon(self.next_icon)
+        self.next_butt.setIconSize(QSize(50, 50))
+        self.next_butt.clicked.connect(lambda: self.music_player.next_music())
+        player_layout.addWidget(self.next_butt)
+
+        self.load_files_butt = QPushButton()
+        self.load_icon = QIcon("../images/load.svg")
+        self.load_files_butt.setIcon(self.load_icon)
+        self.load_files_butt.setIconSize(QSize(50, 50))
+        self.load_files_butt.clicked.connect(self.file_manager.load_files)
+        player_layout.addWidget(self.load_files_butt)
+
+        self.offload_files_butt = QPushButton()
+        self.offload_icon = QIcon("../images/offload.svg")
+        self.offload_files_butt.setIcon(self.offload_icon)
+        self.offload_files_butt.setIconSize(QSize(50, 50))
+        self.offload_files_butt.clicked.connect(self.file_manager.offload_files)
+        player_layout.addWidget(self.offload_files_butt)
+
+        self.shuffle_butt = QPushButton("Shuffle")
+        self.shuffle_butt.setCheckable(True)
+        self.shuffle_butt.toggled.connect(self.music_player.set_shuffle)
+        player_layout.addWidget(self.shuffle_butt)
+
+        self.repeat_butt = QPushButton("Repeat: off")
+        self.repeat_butt.clicked.connect(
+            lambda: self.repeat_butt.setText(f"Repeat: {self.music_player.cycle_repeat()}"))
+        player_layout.addWidget(self.repeat_butt)
+
+        layout.addLayout(player_layout)
+
+        # Create volume slider
+        self.volume_slider = QSlider(Qt.Orientation.Horizontal)
+        self.volume_slider.setMinimum(0)
+        self.volume_slider.setMaximum(100)
+        self.volume_slider.setValue(100)
+        self.volume_slider.setToolTip("Volume")
+        self.volume_slider.valueChanged.connect(self.music_player.set_volume)
+        layout.addWidget(self.volume_slider)
+
+        # Create progress bar, click or drag it to seek
+        self.prog_bar = SeekBar()
+        self.prog_bar.seek_requested.connect(self.music_player.seek_fraction)
+        self.prog_bar.resized.connect(self.music_player.adjust_tick_rate)
+        self.prog_bar.setMinimumHeight(36)  # room for the waveform
+        layout.addWidget(self.prog_bar)
+
+        self.download_manager.update_progress_bar()
+
+        layout.update()
+         # Ensure the layout is set and force an update
+        self.music_player_tab.setLayout(layout)
+        self.music_player_tab.updateGeometry()
+            
+    def init_browser_tab(self):
+        # Set up the browser tab UI
+        layout = QVBoxLayout()
+        self.browser_tab.setLayout(layout)
+
+        self.browser = QWebEngineView()
+        self.browser.setUrl(QUrl("https://www.youtube.com"))
+        layout.addWidget(self.browser)
+
+    def closeEvent(self, event):
+        # Save file paths and accept the close event
+        self.file_manager.save_file_paths()
+        # Write out queued edits and play counts before the process goes away
+        if not flush_writes(timeout=5):
+            print("Could not write all queued song changes, some edits and play counts are lost")
+        stop_backfills()
+        self.music_player.shutdown()
+        shutdown_waveforms()
+        pcm_cache.shutdown()
+        self.db.shutdown(wait=False)
+        metadata_cache.close()
+        event.accept()
@@ -0,0 +1,54 @@
+import hashlib
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Bytes hashed per update() call
+HASH_CHUNK_SIZE = 1024 * 1024
+# Files at least this big are mapped instead of read, saving a copy per chunk
+MMAP_THRESHOLD = 16 * 1024 * 1024
+# hashlib releases the GIL while hashing, so threads hash files in parallel
+HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def hash_file(path):
+    """Return the sha256 hex digest of a file's contents, or None if it cannot be read."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size >= MMAP_THRESHOLD:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    view = memoryview(mapped)
+                    try:
+                        for start in range(0, size, HASH_CHUNK_SIZE):
+                            digest.update(view[start:start + HASH_CHUNK_SIZE])
+                    finally:
+                        view.release()
+            else:
+                buffer = bytearray(HASH_CHUNK_SIZE)
+                view = memoryview(buffer)
+                while count := f.readinto(buffer):
+                    digest.update(view[:count])
+    except (OSError, ValueError) as e:
+        print(f"Error hashing {path}: {e}")
+        return None
+    return digest.hexdigest()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='file-hash')
+        return _executor
+
+def submit_hashes(paths):
+    # Start hashing in the background, returns one Future per path (None for empty paths)
+    executor = _get_executor()
+    return [executor.submit(hash_file, path) if path else None for path in paths]
+
+def hash_files(paths):
+    return [future.result() if future else None for future in submit_hashes(paths)]
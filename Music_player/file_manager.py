@@ -4,7 +4,8 @@ import json
 from PyQt5.QtWidgets import QFileDialog, QMenu, QDialog, QVBoxLayout, QLineEdit, QPushButton, QLabel, QMessageBox
 import PyQt5.QtCore 
 
-from data_operations import insert_song, retrieve_song, get_all_song, delete_music, reading_parsed_json, update_song
+from data_operations import reading_parsed_json, queue_song_update
+from metadata_cache import metadata_cache
 
 # Class to manage file operations
 class FileManager:
@@ -31,9 +32,8 @@ class FileManager:
         
         self.music_list.clear()  # Clear existing items
         
-        songs = get_all_song()
-        for song in songs:
-            self.music_list.addItem(song[2])
+        # Same order as the library index, so list rows and track positions line up
+        self.music_list.addItems(self.app.library.titles())
             
         # Confirm population
         print(f"Number of items in music_list after populating: {self.music_list.count()}")
@@ -55,17 +55,19 @@ class FileManager:
             self.add_files_to_list(file_dialog)
 
     def add_files_to_list(self, file_dialog):
+        # Conversion and metadata parsing can take minutes, so they run on the file thread;
+        # only the insert goes to a DB worker
         selected_files = file_dialog.selectedFiles()
+        self.app.db.submit_files(self.build_import_records, selected_files, callback=self.insert_imported)
+
+    def build_import_records(self, selected_files):
+        # Runs on the file thread, returns the insert_songs records for insert_imported
+        records = []
         for file_path in selected_files:
             file_name_exten = os.path.basename(file_path)
             file_name, file_exten = os.path.splitext(file_name_exten)
-            base_path = os.path.splitext(file_path)[0]
 
             print(f"Loading file: {file_name} ({file_exten})")
-            
-            # Check for metadata JSON file and webp thumbnail
-            json_path = f"{base_path}.info.json"
-            thumbnail_path = f"{base_path}.webp"
 
             # Convert M4A files to WAV if needed
             actual_file_path = file_path
@@ -76,46 +78,54 @@ class FileManager:
                     print(f"Conversion unsuccessful for {file_name}")
                     continue
 
-            # Insert into database
-            success = False
-            if not os.path.exists(json_path):
-                print(f"No JSON metadata found for {file_name}, adding with basic info")
-                success = insert_song(
-                    actual_file_path, 
-                    None,
-                    file_name,
-                    "",
-                    "",
-                    "",
-                    None,
-                    None,
-                    None,
-                    None,
-                    None
-                )
-            else:
-                song_data = reading_parsed_json(json_path)
-                success = insert_song(
-                    actual_file_path,
-                    json_path,
-                    song_data['title'],
-                    song_data['artist'],
-                    song_data['album'],
-                    song_data['genre'],
-                    thumbnail_path if os.path.exists(thumbnail_path) else None,
-                    song_data['track_number'],
-                    song_data['release_year'],
-                    song_data['album_type'],
-                    song_data['duration']
-                )
-
-            if success:
-                # Only update UI and file_paths if database insert was successful
-                self.app.file_paths[file_name] = actual_file_path
-                print(f"Adding {file_name} to music list")
-                self.music_list.addItem(file_name)
+            records.append(self.build_song_record(file_path, actual_file_path))
+        return records
+
+    def insert_imported(self, records):
+        # Insert the whole selection into the database in one batch
+        if records:
+            self.app.db.insert_songs(records, callback=lambda outcomes: self.on_files_imported(records, outcomes))
+
+    def on_files_imported(self, records, outcomes):
+        for record, outcome in zip(records, outcomes):
+            title = record['title']
+            if outcome == 'inserted':
+                # Only update UI and file_paths if database insert was successful.
+                # List items carry the database title so they resolve through the library index.
+                self.app.file_paths[title] = record['file_path']
+                print(f"Adding {title} to music list")
+                self.music_list.addItem(title)
+            elif outcome == 'duplicate':
+                print(f"Song '{title}' already exists in database")
             else:
-                print(f"Failed to add {file_name} to database")
+                print(f"Failed to add {title} to database")
+
+    def build_song_record(self, file_path, actual_file_path, json_path=None, thumbnail_path=None):
+        # Build an insert_songs record from a file and its yt-dlp metadata sidecars
+        base_path = os.path.splitext(file_path)[0]
+        json_path = json_path or f"{base_path}.info.json"
+        thumbnail_path = thumbnail_path or f"{base_path}.webp"
+
+        if not os.path.exists(json_path):
+            file_name = os.path.splitext(os.path.basename(file_path))[0]
+            print(f"No JSON metadata found for {file_name}, adding with basic info")
+            return {'file_path': actual_file_path, 'title': file_name,
+                    'duration': metadata_cache.duration(actual_file_path)}
+
+        song_data = reading_parsed_json(json_path)
+        return {
+            'file_path': actual_file_path,
+            'title': song_data['title'],
+            'artist': song_data['artist'],
+            'album': song_data['album'],
+            'genre': song_data['genre'],
+            'album_cover': thumbnail_path if os.path.exists(thumbnail_path) else None,
+            'track_number': song_data['track_number'],
+            'release_year': song_data['release_year'],
+            'album_type': song_data['album_type'],
+            'duration': song_data['duration'] or metadata_cache.duration(actual_file_path),
+            'total_tracks': song_data.get('total_tracks')
+        }
 
 
     def offload_files(self):
@@ -126,40 +136,35 @@ class FileManager:
             print("No song selected for removal")
             return
 
+        current_title = self.music_player.get_track_name_from_index(self.app.curr_track_index)
+        song_ids = []
         for item in selected_items:
             song_name = item.text()
-            print(f"Attempting to remove: {song_name}")
-
-            # Get song data from database
-            song_data = retrieve_song({'title': song_name})
-            if song_data and len(song_data) > 0:
-                song_id = song_data[0][0]
-                
-                if delete_music(song_id):
-                    row.self.music_list.row(item)
-                    self.music_list.takeItem(row)
-                    
-                    if song_name in self.app.file_paths:
-                        del self.app.file_paths[song_name]
-                        
-                    print(f"Successfully removed: {song_name}")
-                else:
-                    print(f"Failed to remove {song_name}")
-            else:
-                print(f"Song not found in database: {song_name}")
-            
-            # Remove from UI
-            row = self.music_list.row(item)
-            self.music_list.takeItem(row)
-            print(f"Removing {song_name} from music list")
 
             # Stop playback if this was the current song
-            if song_name == self.music_player.get_track_name_from_index(self.app.curr_track_index):
+            if song_name == current_title:
                 self.music_player.stop_music()
                 print(f"Stopped playing {song_name} because it is being offloaded.")
 
+            # Remove from UI right away, the database delete runs on a DB worker
+            self.music_list.takeItem(self.music_list.row(item))
+
+            if song_name in self.app.file_paths:
+                del self.app.file_paths[song_name]
+
+            if track := self.app.library.by_title(song_name):
+                song_ids.append(track.id)
+            else:
+                print(f"Song not found in database: {song_name}")
+
+        print(f"Removing {len(selected_items)} songs from music list")
         self.save_file_paths()
 
+        # One transaction for the whole selection
+        if song_ids:
+            self.app.db.delete_songs(song_ids, callback=lambda deleted: print(
+                f"Removed {len(deleted)} of {len(song_ids)} songs from the database"))
+
     def convert_to_wav(self, file_path):
         # Convert m4a files to wav format
         audio = AudioSegment.from_file(file_path, format='m4a')
@@ -174,17 +179,29 @@ class FileManager:
     def show_context_menu(self, position):
         menu = QMenu()
         edit_action = menu.addAction("Edit Details")
+        play_next_action = menu.addAction("Play Next")
+        enqueue_action = menu.addAction("Add to Queue")
         
         action = menu.exec_(self.music_list.mapToGlobal(position))
         
+        current_item = self.music_list.itemAt(position)
+        if not current_item:
+            return
         if action == edit_action:
-            current_item = self.music_list.itemAt(position)
-            if current_item:
-                self.show_edit_dialog(current_item.text())
+            self.show_edit_dialog(current_item.text())
+        elif action in (play_next_action, enqueue_action):
+            if not (track := self.app.library.by_title(current_item.text())):
+                print(f"Song not found in library: {current_item.text()}")
+            elif action == play_next_action:
+                self.music_player.play_next(track.id)
+            else:
+                self.music_player.enqueue(track.id)
 
     def show_edit_dialog(self, song_title):
-        # Get current song details
-        song_data = retrieve_song({'title': song_title})
+        # Get current song details off the GUI thread, the dialog opens when they arrive
+        self.app.db.retrieve_song({'title': song_title}, limit=1, callback=self.open_edit_dialog)
+
+    def open_edit_dialog(self, song_data):
         if not song_data or len(song_data) == 0:
             QMessageBox.warning(self.music_list, "Error", "Could not find song details") 
             return
@@ -271,8 +288,8 @@ class FileManager:
             if new_values['album_type']:
                 album_updates['album_type'] = new_values['album_type']
 
-            # Update song details in database
-            update_song(
+            # Queue the edit, it is coalesced with any further edits and written in the background
+            queue_song_update(
                 song_id,
                 title=new_values['title'],
                 artist=new_values['artist'],
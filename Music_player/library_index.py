@@ -0,0 +1,142 @@
+import threading
+from array import array
+
+# Columns to load into the index, in TrackRecord field order
+LIBRARY_COLUMNS = ('id', 'title', 'file_path', 'artist_id', 'album_id', 'duration',
+                   'track_gain', 'track_peak', 'album_gain', 'album_peak')
+
+
+class TrackRecord:
+    __slots__ = LIBRARY_COLUMNS
+
+    def __init__(self, id, title, file_path, artist_id=None, album_id=None, duration=None,
+                 track_gain=None, track_peak=None, album_gain=None, album_peak=None):
+        self.id = id
+        self.title = title
+        self.file_path = file_path
+        self.artist_id = artist_id
+        self.album_id = album_id
+        self.duration = duration
+        # Loudness normalisation in dB and dBTP, None until measured
+        self.track_gain = track_gain
+        self.track_peak = track_peak
+        self.album_gain = album_gain
+        self.album_peak = album_peak
+
+    def __repr__(self):
+        return f"TrackRecord({self.id}, {self.title!r})"
+
+
+class LibraryIndex:
+    """Resident read model of the songs table.
+
+    Holds one compact TrackRecord per song plus the library order (an id
+    array matching the music list), so navigation and title -> path
+    resolution never touch the database. Loaded once and then updated
+    write-through from data_operations.add_song_listener.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._tracks = {}          # id -> TrackRecord
+        self._order = array('q')   # ids in library (music list) order
+        self._positions = {}       # id -> index into _order
+        self._by_title = {}        # title -> id of the first song with that title
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, song_id):
+        return song_id in self._tracks
+
+    def load(self, rows):
+        # rows in LIBRARY_COLUMNS order
+        with self._lock:
+            self._tracks.clear()
+            self._order = array('q')
+            self._positions.clear()
+            self._by_title.clear()
+            for row in rows:
+                self._append(TrackRecord(*row))
+
+    def _append(self, track):
+        self._tracks[track.id] = track
+        self._positions[track.id] = len(self._order)
+        self._order.append(track.id)
+        self._by_title.setdefault(track.title, track.id)
+
+    def get(self, song_id):
+        return self._tracks.get(song_id)
+
+    def by_title(self, title):
+        song_id = self._by_title.get(title)
+        return None if song_id is None else self._tracks.get(song_id)
+
+    def position(self, song_id):
+        return self._positions.get(song_id, -1)
+
+    def track_at(self, index):
+        with self._lock:
+            if 0 <= index < len(self._order):
+                return self._tracks[self._order[index]]
+            return None
+
+    def ids(self):
+        with self._lock:
+            return array('q', self._order)
+
+    def titles(self):
+        with self._lock:
+            return [self._tracks[song_id].title for song_id in self._order]
+
+    def add(self, track):
+        with self._lock:
+            if track.id in self._tracks:
+                self.update(track)
+            else:
+                self._append(track)
+
+    def update(self, track):
+        with self._lock:
+            old = self._tracks.get(track.id)
+            if old is None:
+                self._append(track)
+                return
+            self._tracks[track.id] = track
+            if old.title != track.title:
+                self._forget_title(old)
+                self._by_title.setdefault(track.title, track.id)
+
+    def remove(self, song_id):
+        with self._lock:
+            track = self._tracks.pop(song_id, None)
+            if track is None:
+                return
+            index = self._positions.pop(song_id)
+            del self._order[index]
+            for position in range(index, len(self._order)):
+                self._positions[self._order[position]] = position
+            self._forget_title(track)
+
+    def _forget_title(self, track):
+        if self._by_title.get(track.title) != track.id:
+            return
+        del self._by_title[track.title]
+        # Another song may share the title, keep resolving to the earliest one
+        for song_id in self._order:
+            other = self._tracks.get(song_id)
+            if other is not None and other.id != track.id and other.title == track.title:
+                self._by_title[track.title] = song_id
+                break
+
+    def on_song_change(self, event, songs):
+        # Listener for data_operations.add_song_listener
+        if event == 'delete':
+            for song_id in songs:
+                self.remove(song_id)
+            return
+        for song in songs:
+            track = TrackRecord(*(song[column] for column in LIBRARY_COLUMNS))
+            if event == 'insert':
+                self.add(track)
+            else:
+                self.update(track)
@@ -0,0 +1,147 @@
+import base64
+import gzip
+import json
+import os
+
+from data_operations import retrieve_song, iter_covers, import_covers, insert_songs
+
+# Parquet snapshots need pyarrow; without it libraries are exported as JSON lines
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+SNAPSHOT_VERSION = 1
+
+# Song fields written to a snapshot, all of them accepted back by insert_songs
+SNAPSHOT_SONG_COLUMNS = ('file_path', 'title', 'artist', 'album', 'genre', 'track_number',
+                         'release_year', 'album_type', 'total_tracks', 'duration',
+                         'content_hash', 'cover_hash', 'play_count', 'last_played')
+
+# Rows held in memory at once, on export and on import
+SNAPSHOT_BATCH_SIZE = 5000
+
+def _is_parquet(path):
+    return path.endswith('.parquet')
+
+def _covers_path(path):
+    # Parquet snapshots keep covers in a second file next to the songs
+    return path[:-len('.parquet')] + '.covers.parquet'
+
+def _open_text(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+def _song_records():
+    for row in retrieve_song(columns=SNAPSHOT_SONG_COLUMNS, order_by='id', stream=True,
+                             batch_size=SNAPSHOT_BATCH_SIZE):
+        yield dict(zip(SNAPSHOT_SONG_COLUMNS, row))
+
+def _batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def export_library(path):
+    """Write every song, its artist/album/genre and the covers they use to a snapshot.
+
+    A path ending in .parquet writes Parquet (songs plus a .covers.parquet
+    file, requires pyarrow), anything else writes JSON lines, gzipped when
+    the path ends in .gz. Rows are streamed, so memory use does not grow
+    with the library. Returns the number of songs written.
+    """
+    if _is_parquet(path):
+        if pa is None:
+            raise RuntimeError("Parquet export needs pyarrow, use a .jsonl path instead")
+        return _export_parquet(path)
+    return _export_jsonl(path)
+
+def _export_jsonl(path):
+    count = 0
+    with _open_text(path, 'w') as f:
+        f.write(json.dumps({'type': 'header', 'version': SNAPSHOT_VERSION}) + '\n')
+        # Covers come first so importing songs can refer to them by hash
+        for hash, data in iter_covers():
+            f.write(json.dumps({'type': 'cover', 'hash': hash,
+                                'data': base64.b64encode(bytes(data)).decode('ascii')}) + '\n')
+        for song in _song_records():
+            song['type'] = 'song'
+            f.write(json.dumps(song, ensure_ascii=False) + '\n')
+            count += 1
+    print(f"Exported {count} songs to {path}")
+    return count
+
+def _export_parquet(path):
+    cover_schema = pa.schema([('hash', pa.string()), ('data', pa.binary())])
+    with pq.ParquetWriter(_covers_path(path), cover_schema) as writer:
+        for batch in _batched(iter_covers(), SNAPSHOT_BATCH_SIZE):
+            writer.write_table(pa.Table.from_pylist(
+                [{'hash': hash, 'data': bytes(data)} for hash, data in batch], schema=cover_schema))
+
+    song_schema = pa.schema([
+        ('file_path', pa.string()), ('title', pa.string()), ('artist', pa.string()),
+        ('album', pa.string()), ('genre', pa.string()), ('track_number', pa.int64()),
+        ('release_year', pa.int64()), ('album_type', pa.string()), ('total_tracks', pa.int64()),
+        ('duration', pa.float64()), ('content_hash', pa.string()), ('cover_hash', pa.string()),
+        ('play_count', pa.int64()), ('last_played', pa.float64()),
+    ], metadata={'music_player_snapshot_version': str(SNAPSHOT_VERSION)})
+    count = 0
+    with pq.ParquetWriter(path, song_schema) as writer:
+        for batch in _batched(_song_records(), SNAPSHOT_BATCH_SIZE):
+            writer.write_table(pa.Table.from_pylist(batch, schema=song_schema))
+            count += len(batch)
+    print(f"Exported {count} songs to {path}")
+    return count
+
+def _read_jsonl(path, kind):
+    with _open_text(path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get('type') == 'header' and record.get('version', 0) > SNAPSHOT_VERSION:
+                raise ValueError(f"Snapshot {path} is newer than this version of the app")
+            if record.get('type') == kind:
+                yield record
+            elif kind == 'cover' and record.get('type') == 'song':
+                break  # covers are all written before the first song
+
+def _read_parquet(path):
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=SNAPSHOT_BATCH_SIZE):
+        yield from batch.to_pylist()
+
+def import_library(path):
+    """Load a snapshot written by export_library into the database.
+
+    Covers are stored first, then songs go through insert_songs in
+    batches, so songs already in the library are reported as duplicates.
+    Returns a dict counting each insert_songs outcome.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    if _is_parquet(path):
+        if pa is None:
+            raise RuntimeError("Parquet import needs pyarrow")
+        covers = ((c['hash'], c['data']) for c in _read_parquet(_covers_path(path))) \
+            if os.path.exists(_covers_path(path)) else ()
+        songs = _read_parquet(path)
+    else:
+        covers = ((c['hash'], base64.b64decode(c['data'])) for c in _read_jsonl(path, 'cover'))
+        songs = _read_jsonl(path, 'song')
+
+    new_covers = import_covers(covers)
+    totals = {}
+    for batch in _batched(songs, SNAPSHOT_BATCH_SIZE):
+        for outcome in insert_songs(batch):
+            totals[outcome] = totals.get(outcome, 0) + 1
+    print(f"Imported snapshot {path}: {totals.get('inserted', 0)} songs, {new_covers} new covers, "
+          f"{totals.get('duplicate', 0)} duplicates, {totals.get('failed', 0)} failed")
+    return totals
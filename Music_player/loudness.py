@@ -0,0 +1,213 @@
+import math
+import multiprocessing
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from pcm_cache import pcm_cache
+
+# The measurement is vectorised with numpy; without it tracks are simply not analysed
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# ReplayGain 2.0 reference level, track gain brings a track to this loudness
+REFERENCE_LOUDNESS = -18.0
+# Analysis processes, one core is left for playback and the GUI
+LOUDNESS_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+# BS.1770: 400 ms blocks overlapping by 75%, i.e. a new block every 100 ms
+_HOPS_PER_BLOCK = 4
+_ABSOLUTE_GATE = -70.0
+_RELATIVE_GATE = -10.0
+# FFT length per filtering segment, and how much of each segment is history for the filter to settle
+_SEGMENT = 1 << 20
+_TRUE_PEAK_OVERSAMPLING = 4
+
+# loudness in LUFS (None for silence), true_peak in dBTP (None for digital silence)
+LoudnessResult = namedtuple('LoudnessResult', 'loudness true_peak')
+
+_stop = threading.Event()
+
+
+def available():
+    return np is not None
+
+
+def _biquad_response(b, a, size):
+    # Complex response of a biquad on the rfft bins of a size-point FFT
+    z = np.exp(-1j * np.linspace(0, np.pi, size // 2 + 1))
+    return (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+
+
+def _k_weighting(sample_rate, size):
+    # BS.1770 K-weighting: a +4 dB high shelf (head effect) followed by a ~38 Hz high pass
+    w0 = 2 * math.pi * 1500.0 / sample_rate
+    gain = 10 ** (4.0 / 40)
+    alpha = math.sin(w0) / (2 * (1 / math.sqrt(2)))
+    cos, root = math.cos(w0), 2 * math.sqrt(gain) * alpha
+    shelf = _biquad_response(
+        (gain * ((gain + 1) + (gain - 1) * cos + root), -2 * gain * ((gain - 1) + (gain + 1) * cos),
+         gain * ((gain + 1) + (gain - 1) * cos - root)),
+        ((gain + 1) - (gain - 1) * cos + root, 2 * ((gain - 1) - (gain + 1) * cos),
+         (gain + 1) - (gain - 1) * cos - root), size)
+
+    w0 = 2 * math.pi * 38.0 / sample_rate
+    alpha = math.sin(w0) / (2 * 0.5)
+    cos = math.cos(w0)
+    high_pass = _biquad_response(((1 + cos) / 2, -(1 + cos), (1 + cos) / 2),
+                                 (1 + alpha, -2 * cos, 1 - alpha), size)
+    return shelf * high_pass
+
+
+def _filter_block(samples, history, response, hop, segment):
+    """Return (energy per 100 ms hop, true peak) of a block of one int16 channel.
+
+    Filters by overlap-save: the FFT segment starts with the channel's
+    samples before the block, which are only there for the filter to
+    settle and are dropped. The same spectrum, zero-padded, gives the
+    oversampled signal for the true peak.
+    """
+    settle, count = len(history), len(samples)
+    segment[:] = 0.0
+    segment[:settle] = history
+    segment[settle:settle + count] = samples
+    segment *= 1 / 32768
+    spectrum = np.fft.rfft(segment)
+
+    weighted = np.fft.irfft(spectrum * response, _SEGMENT)[settle:settle + count]
+    hops = count // hop
+    energies = np.square(weighted[:hops * hop]).reshape(hops, hop).sum(axis=1)
+
+    oversampled = np.fft.irfft(spectrum, _SEGMENT * _TRUE_PEAK_OVERSAMPLING)
+    oversampled = oversampled[settle * _TRUE_PEAK_OVERSAMPLING:(settle + count) * _TRUE_PEAK_OVERSAMPLING]
+    return energies, float(np.abs(oversampled).max()) * _TRUE_PEAK_OVERSAMPLING if count else 0.0
+
+
+def _integrated_loudness(energies, hop):
+    # Gated loudness of summed per-channel hop energies, None if nothing passes the gates
+    if len(energies) < _HOPS_PER_BLOCK:
+        return None
+    totals = np.concatenate(([0.0], np.cumsum(energies)))
+    blocks = (totals[_HOPS_PER_BLOCK:] - totals[:-_HOPS_PER_BLOCK]) / (_HOPS_PER_BLOCK * hop)
+    with np.errstate(divide='ignore'):
+        levels = -0.691 + 10 * np.log10(blocks)
+    gated = blocks[levels > _ABSOLUTE_GATE]
+    if not len(gated):
+        return None
+    relative = -0.691 + 10 * math.log10(gated.mean()) + _RELATIVE_GATE
+    gated = blocks[(levels > _ABSOLUTE_GATE) & (levels > relative)]
+    return -0.691 + 10 * math.log10(gated.mean())
+
+
+def measure(path):
+    """Measure integrated loudness and true peak of an audio file.
+
+    Reads the decoded copy in the PCM cache when there is one, otherwise
+    streams the file from ffmpeg block by block; the library is not
+    decoded into the cache just to be measured. Returns a LoudnessResult,
+    or None if the file could not be decoded.
+    """
+    if np is None:
+        raise RuntimeError("Loudness analysis needs numpy")
+    audio = pcm_cache.stream(path)
+    if audio is None:
+        return None
+    hop = audio.sample_rate // 10
+    settle = min(audio.sample_rate, _SEGMENT // 4)
+    step = (_SEGMENT - settle) // hop * hop
+    response = _k_weighting(audio.sample_rate, _SEGMENT)
+    segment = np.zeros(_SEGMENT)
+    history = np.zeros((settle, audio.channels), dtype=np.int16)  # silence before the start
+    energies = []
+    peak = 0.0
+    try:
+        with audio:
+            for block in audio.blocks(step):
+                block_energies = 0.0
+                for channel in range(audio.channels):
+                    # Mono and stereo channels all weigh 1.0 in BS.1770
+                    channel_energies, channel_peak = _filter_block(block[:, channel], history[:, channel],
+                                                                   response, hop, segment)
+                    block_energies = block_energies + channel_energies
+                    peak = max(peak, channel_peak)
+                energies.append(block_energies)
+                history = np.concatenate((history, block))[-settle:]
+                del block
+    except OSError as e:
+        print(f"Error decoding {path}: {e}")
+        return None
+    loudness = _integrated_loudness(np.concatenate(energies) if energies else np.zeros(0), hop)
+    return LoudnessResult(loudness, 20 * math.log10(peak) if peak > 0 else None)
+
+
+def track_gain(loudness):
+    return REFERENCE_LOUDNESS - loudness if loudness is not None else None
+
+
+def album_loudness(tracks):
+    """Loudness of an album from its tracks' (loudness, duration) pairs.
+
+    The energy mean of the track loudnesses, weighted by duration. Close to
+    gating the whole album at once, and needs no audio, so an album is
+    updated without measuring its other tracks again.
+    """
+    energy = weight = 0.0
+    for loudness, duration in tracks:
+        if loudness is None:
+            continue
+        duration = duration if duration and duration > 0 else 1.0
+        energy += duration * 10 ** (loudness / 10)
+        weight += duration
+    return 10 * math.log10(energy / weight) if weight else None
+
+
+def gain_factor(gain, peak=None):
+    # Linear volume factor for a gain in dB, held back so the true peak stays below 0 dBTP
+    if gain is None:
+        return 1.0
+    if peak is not None:
+        gain = min(gain, -peak)
+    return 10 ** (gain / 20)
+
+
+def analyze_files(items, workers=LOUDNESS_WORKERS):
+    """Measure (key, path) items in a process pool, yielding (key, LoudnessResult or None).
+
+    Results come in completion order. Only a few files per worker are in
+    flight, so items can be a lazy iterator over the whole library.
+    stop_analysis() ends the run early.
+    """
+    _stop.clear()
+    items = iter(items)
+    # Spawned, not forked: a fork would inherit the metadata cache's SQLite connection and locks
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        pending = {}
+        try:
+            while True:
+                while len(pending) < workers * 2 and not _stop.is_set():
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    key, path = item
+                    pending[pool.submit(measure, path)] = (key, path)
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, path = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"Error measuring loudness of {path}: {e}")
+                        result = None
+                    yield key, result
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def stop_analysis():
+    _stop.set()
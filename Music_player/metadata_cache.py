@@ -0,0 +1,161 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from audio_probe import AudioInfo, probe
+
+METADATA_CACHE_PATH = os.environ.get(
+    'MUSIC_PLAYER_METADATA_CACHE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metadata_cache.db'))
+
+# Files kept in memory
+METADATA_CACHE_SIZE = 2048
+# Files kept on disk; the least recently used are pruned past this
+METADATA_STORE_ROWS = 100000
+
+class MetadataCache:
+    """Per-file audio metadata, keyed on path and validated by mtime and size.
+
+    Lookups go to a bounded in-memory LRU, then to a small SQLite store on
+    disk, and only then to audio_probe. A file that changed since it was
+    cached is probed again. The store survives restarts, so a track that
+    was played before starts without touching its headers.
+    """
+    def __init__(self, path=METADATA_CACHE_PATH, maxsize=METADATA_CACHE_SIZE, max_rows=METADATA_STORE_ROWS):
+        self.path = path
+        self.maxsize = maxsize
+        self.max_rows = max_rows
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # path -> (mtime_ns, size, AudioInfo)
+        self._lock = threading.Lock()
+        self._store = None
+        self._writes = 0
+
+    def _connect(self):
+        # Opened on first use; a cache that cannot be opened just means probing every time
+        if self._store is None:
+            try:
+                self._store = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                self._store.execute("PRAGMA journal_mode = WAL")
+                self._store.execute("PRAGMA synchronous = NORMAL")
+                self._store.execute("""
+                    CREATE TABLE IF NOT EXISTS file_metadata (
+                        path TEXT PRIMARY KEY,
+                        mtime_ns INTEGER NOT NULL,
+                        size INTEGER NOT NULL,
+                        duration REAL,
+                        sample_rate INTEGER,
+                        channels INTEGER,
+                        codec TEXT,
+                        bitrate INTEGER,
+                        accessed REAL NOT NULL
+                    )
+                """)
+                self._store.execute("CREATE INDEX IF NOT EXISTS ix_file_metadata_accessed ON file_metadata (accessed)")
+            except sqlite3.Error as e:
+                print(f"Metadata cache unavailable, probing files directly: {e}")
+                self._store = False
+        return self._store or None
+
+    def info(self, path):
+        """Return the AudioInfo for path, or None if it is missing or unreadable."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        mtime, size = stat.st_mtime_ns, stat.st_size
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[:2] == (mtime, size):
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[2]
+
+            info = self._load(path, mtime, size)
+            if info is not None:
+                self.disk_hits += 1
+                self._remember(path, mtime, size, info)
+                return info
+
+        # Probe outside the lock, it reads the file
+        self.misses += 1
+        info = probe(path)
+        if info is None:
+            return None
+        with self._lock:
+            self._remember(path, mtime, size, info)
+            self._save(path, mtime, size, info)
+        return info
+
+    def duration(self, path):
+        info = self.info(path)
+        return info.duration if info else None
+
+    def _remember(self, path, mtime, size, info):
+        self._entries[path] = (mtime, size, info)
+        self._entries.move_to_end(path)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _load(self, path, mtime, size):
+        if (store := self._connect()) is None:
+            return None
+        try:
+            row = store.execute("""
+                SELECT duration, sample_rate, channels, codec, bitrate FROM file_metadata
+                WHERE path = ? AND mtime_ns = ? AND size = ?
+            """, (path, mtime, size)).fetchone()
+            if row is not None:
+                store.execute("UPDATE file_metadata SET accessed = ? WHERE path = ?", (time.time(), path))
+        except sqlite3.Error as e:
+            print(f"Error reading metadata cache: {e}")
+            return None
+        return AudioInfo(*row) if row else None
+
+    def _save(self, path, mtime, size, info):
+        if (store := self._connect()) is None:
+            return
+        try:
+            store.execute("""
+                INSERT OR REPLACE INTO file_metadata
+                    (path, mtime_ns, size, duration, sample_rate, channels, codec, bitrate, accessed)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (path, mtime, size, *info, time.time()))
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                self._prune(store)
+        except sqlite3.Error as e:
+            print(f"Error writing metadata cache: {e}")
+
+    def _prune(self, store):
+        store.execute("""
+            DELETE FROM file_metadata WHERE path IN (
+                SELECT path FROM file_metadata ORDER BY accessed DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_rows,))
+
+    def discard(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
+            if (store := self._connect()) is not None:
+                try:
+                    store.execute("DELETE FROM file_metadata WHERE path = ?", (path,))
+                except sqlite3.Error as e:
+                    print(f"Error writing metadata cache: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._store:
+                try:
+                    self._prune(self._store)
+                except sqlite3.Error as e:
+                    print(f"Error pruning metadata cache: {e}")
+                self._store.close()
+            self._store = None
+
+metadata_cache = MetadataCache()
@@ -1,31 +1,631 @@
 import os
 import pygame
+import random
+import threading
 import time
-from functools import lru_cache
-from pydub import AudioSegment
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from PyQt5.QtWidgets import QWidget, QListWidgetItem, QProgressBar, QLabel
-from PyQt5.QtCore import QTimer
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal
+from PyQt5.QtGui import QColor, QPainter, QPixmap
 
-from data_operations import insert_song, retrieve_song, update_song, delete_music, get_song_by_artist, get_song_by_album, get_song_by_genre, get_all_song, reading_parsed_json
+from data_operations import record_play
+from metadata_cache import metadata_cache
+from pcm_cache import pcm_cache
+from loudness import gain_factor
+from waveform import cached_waveform, request_waveform
+import audio_engine
+from audio_engine import AudioEngine, NullSink, PygameSink
+from db_connection import LatencyHistogram
+
+# Bytes of the upcoming track read ahead so its first decode never waits on the disk
+PRELOAD_READ_AHEAD = 512 * 1024
+
+# Loudness normalisation: 'track', 'album' (track gain for songs without one) or 'off'
+REPLAY_GAIN_MODE = os.environ.get('MUSIC_PLAYER_REPLAY_GAIN', 'track')
+
+# 'stream' plays through audio_engine (crossfades, gains above 0 dB), 'mixer' through
+# pygame.mixer.music; stream needs numpy and ffmpeg and falls back to mixer without them
+AUDIO_ENGINE = os.environ.get('MUSIC_PLAYER_AUDIO_ENGINE', 'stream')
+# 'pygame' for the sound card, 'null' to run headless
+AUDIO_SINK = os.environ.get('MUSIC_PLAYER_AUDIO_SINK', 'pygame')
+# Crossfade between tracks in seconds (0 is a gapless cut) and its curve, stream engine only
+CROSSFADE_SECONDS = float(os.environ.get('MUSIC_PLAYER_CROSSFADE', 0))
+CROSSFADE_CURVE = os.environ.get('MUSIC_PLAYER_CROSSFADE_CURVE', 'equal_power')
+
+# Steps on the seek bar, enough for a pixel-exact bar on any screen
+SEEK_BAR_STEPS = 1000
+# Progress tick bounds in ms; in between, one tick per pixel the bar moves
+MIN_TICK_MS = 33
+MAX_TICK_MS = 500
+# The mixer disagreeing by more than this is a jump (rewind, track switch), not drift
+MAX_CLOCK_DRIFT = 0.25
+
+
+class PlaybackClock:
+    """Position in the current track, in seconds.
+
+    Counts from a monotonic anchor, the position at the last start, seek
+    or resume, so pauses and seeks are accounted for and reading it is a
+    single clock call. sync() compares the time since the anchor with what
+    the mixer says it has played and moves the anchor halfway towards it,
+    so the clock follows the audio device instead of drifting from it.
+    """
+    def __init__(self):
+        self.duration = 0
+        self.paused = True
+        self._anchor_pos = 0.0
+        self._anchor_time = time.monotonic()
+        self._anchor_mixer = None  # mixer get_pos() in ms at the anchor
+
+    def _anchor(self, position, mixer_ms):
+        self._anchor_pos = position
+        self._anchor_time = time.monotonic()
+        self._anchor_mixer = mixer_ms if mixer_ms is not None and mixer_ms >= 0 else None
+
+    def start(self, position=0.0, duration=None, mixer_ms=None):
+        if duration is not None:
+            self.duration = duration
+        self._anchor(position, mixer_ms)
+        self.paused = False
+
+    def stop(self):
+        self._anchor(0.0, None)
+        self.paused = True
+
+    def pause(self):
+        if not self.paused:
+            self._anchor_pos = self.position
+            self.paused = True
+
+    def resume(self, mixer_ms=None):
+        if self.paused:
+            self._anchor(self._anchor_pos, mixer_ms)
+            self.paused = False
+
+    def seek(self, position, mixer_ms=None):
+        self._anchor(position, mixer_ms)
+
+    def sync(self, mixer_ms):
+        if self.paused or self._anchor_mixer is None or mixer_ms < 0:
+            return
+        drift = (time.monotonic() - self._anchor_time) - (mixer_ms - self._anchor_mixer) / 1000
+        if abs(drift) <= MAX_CLOCK_DRIFT:
+            self._anchor_time += drift / 2
+
+    @property
+    def position(self):
+        position = self._anchor_pos
+        if not self.paused:
+            position += time.monotonic() - self._anchor_time
+        if self.duration:
+            position = min(position, self.duration)
+        return max(position, 0.0)
+
+
+def format_time(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+class SeekBar(QProgressBar):
+    """Progress bar that seeks when clicked or dragged.
+
+    While the button is down the bar follows the mouse and playback
+    updates leave it alone; the seek is requested once, on release, as a
+    fraction of the track. Given a waveform it draws that instead of the
+    plain bar: the overview is rendered once per size into a played and an
+    unplayed pixmap, and each repaint just copies the two halves.
+    """
+    seek_requested = pyqtSignal(float)
+    resized = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setRange(0, SEEK_BAR_STEPS)
+        self.setTextVisible(False)
+        self.dragging = False
+        self.waveform = None
+        self._pixmaps = None  # (played, unplayed) at the current size
+
+    def set_waveform(self, waveform):
+        self.waveform = waveform
+        self._pixmaps = None
+        self.update()
+
+    def _render_waveform(self):
+        width, height = self.width(), self.height()
+        middle = height / 2
+        columns = self.waveform.columns(width)
+        pixmaps = []
+        for color in (self.palette().highlight().color(), self.palette().mid().color()):
+            pixmap = QPixmap(width, height)
+            pixmap.fill(Qt.GlobalColor.transparent)
+            painter = QPainter(pixmap)
+            peak_color = QColor(color)
+            peak_color.setAlpha(110)
+            # Peaks faint, RMS solid on top
+            painter.setPen(peak_color)
+            for x, (low, high, _) in enumerate(columns):
+                painter.drawLine(x, int(middle - high / 128 * middle), x, int(middle - low / 128 * middle))
+            painter.setPen(color)
+            for x, (_, _, rms) in enumerate(columns):
+                extent = int(rms / 255 * middle)
+                painter.drawLine(x, int(middle) - extent, x, int(middle) + extent)
+            painter.end()
+            pixmaps.append(pixmap)
+        self._pixmaps = tuple(pixmaps)
+
+    def paintEvent(self, event):
+        if self.waveform is None:
+            return super().paintEvent(event)
+        if self._pixmaps is None or self._pixmaps[0].size() != self.size():
+            self._render_waveform()
+        played, unplayed = self._pixmaps
+        span = self.maximum() - self.minimum()
+        split = int(self.width() * (self.value() - self.minimum()) / span) if span > 0 else 0
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, played, 0, 0, split, self.height())
+        painter.drawPixmap(split, 0, unplayed, split, 0, self.width() - split, self.height())
+        painter.end()
+
+    def _fraction(self, event):
+        return min(max(event.pos().x() / max(self.width(), 1), 0.0), 1.0)
+
+    def mousePressEvent(self, event):
+        if event.button() != Qt.MouseButton.LeftButton:
+            return super().mousePressEvent(event)
+        self.dragging = True
+        self.setValue(round(self._fraction(event) * self.maximum()))
+
+    def mouseMoveEvent(self, event):
+        if self.dragging:
+            self.setValue(round(self._fraction(event) * self.maximum()))
+
+    def mouseReleaseEvent(self, event):
+        if self.dragging and event.button() == Qt.MouseButton.LeftButton:
+            self.dragging = False
+            self.seek_requested.emit(self._fraction(event))
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.resized.emit(self.width())
+
+
+class TransitionStats:
+    """Track change latencies, as seen from the GUI thread.
+
+    cold: load() + play() of a track that was not queued, i.e. the silence
+    between tracks when nothing was prepared. gapless: how long after the
+    mixer or the streaming engine switched to the queued track the player
+    noticed (the audio itself has no gap). prepare: background time to open
+    and queue the next track.
+    """
+    def __init__(self):
+        self.cold = LatencyHistogram()
+        self.gapless = LatencyHistogram()
+        self.prepare = LatencyHistogram()
+        self.preload_failures = 0
+
+    def snapshot(self):
+        return {
+            'cold': self.cold.snapshot(),
+            'gapless': self.gapless.snapshot(),
+            'prepare': self.prepare.snapshot(),
+            'preload_failures': self.preload_failures,
+        }
+
+transition_stats = TransitionStats()
+
+# Track change latencies and preload failures, see TransitionStats
+def get_transition_stats():
+    return transition_stats.snapshot()
+
+
+class TrackPreloader:
+    """Prepares the upcoming track on a background thread.
+
+    Warms its metadata and the start of the file, then calls
+    ready(generation, track, playable, started) from that thread. The owner
+    passes those back to queue() on the GUI thread, which hands the file to
+    pygame.mixer.music.queue if nothing else was played meanwhile. The mixer
+    then starts it the moment the current track ends. Requests run one at a
+    time in order, so the most recent one always wins.
+    """
+    def __init__(self, ready):
+        self._ready = ready
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='track-preload')
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._queued = None  # (generation, TrackRecord) queued with the mixer
+
+    def prepare(self, track):
+        with self._lock:
+            self._generation += 1
+            self._queued = None
+            generation = self._generation
+        if track is not None:
+            self._executor.submit(self._prepare, generation, track)
+
+    def cancel(self):
+        self.prepare(None)
+
+    def take(self):
+        # The queued track, once the mixer has switched to it
+        with self._lock:
+            queued, self._queued = self._queued, None
+        return queued[1] if queued else None
+
+    @property
+    def pending(self):
+        with self._lock:
+            return self._queued is not None
+
+    def _prepare(self, generation, track):
+        started = time.perf_counter()
+        if generation != self._generation:
+            return
+        try:
+            metadata_cache.info(track.file_path)
+            playable = pcm_cache.playable_path(track.file_path)
+            with open(playable, 'rb') as f:
+                f.read(PRELOAD_READ_AHEAD)
+        except OSError as e:
+            transition_stats.preload_failures += 1
+            print(f"Could not prepare {track.title} for gapless playback: {e}")
+            return
+        if generation == self._generation:
+            self._ready(generation, track, playable, started)
+
+    def queue(self, generation, track, playable, started):
+        # GUI thread only, like load() and play(), so no other track can start between the check and the queue
+        with self._lock:
+            if generation != self._generation or not pygame.mixer.music.get_busy():
+                return
+        try:
+            pygame.mixer.music.queue(playable)
+        except pygame.error as e:
+            transition_stats.preload_failures += 1
+            print(f"Could not prepare {track.title} for gapless playback: {e}")
+            return
+        with self._lock:
+            self._queued = (generation, track)
+        transition_stats.prepare.record(time.perf_counter() - started)
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+REPEAT_OFF = 'off'
+REPEAT_ALL = 'all'
+REPEAT_ONE = 'one'
+
+# Previously played songs remembered for prev()
+HISTORY_SIZE = 200
+
+
+class PlayQueue:
+    """Play order over song ids, with shuffle, repeat, history and an up-next list.
+
+    The order is an id array; next/prev move a cursor through it. Shuffle
+    is a lazy Fisher-Yates: each step swaps a random not-yet-played entry
+    into the next slot, so turning it on or skipping costs O(1) instead of
+    reshuffling the library. Songs queued with enqueue/insert_next play
+    before the order resumes. Library inserts are appended and deletes are
+    tombstoned and skipped, so the queue never has to be rebuilt; it is
+    compacted once tombstones make up half of it.
+    """
+    def __init__(self, history_size=HISTORY_SIZE):
+        self._lock = threading.RLock()
+        self._order = array('q')
+        self._positions = {}         # id -> index into _order
+        self._removed = set()        # tombstoned ids still in _order
+        self._cursor = -1            # index of the current song in _order
+        self._shuffled_until = -1    # slots up to here have had their shuffle pick made
+        self._new_pass = False       # repeat-all wrapped: picks are for the next pass, the cursor is still in this one
+        self._up_next = deque()      # explicitly queued ids, played before the order resumes
+        self._history = deque(maxlen=history_size)
+        self._current = None
+        self.shuffle = False
+        self.repeat = REPEAT_OFF
+
+    def __len__(self):
+        return len(self._order) - len(self._removed)
+
+    @property
+    def current(self):
+        return self._current
+
+    def load(self, ids):
+        # Replace the order (e.g. library order again after shuffling); up next and history are kept
+        with self._lock:
+            self._order = array('q', ids)
+            self._positions = {song_id: index for index, song_id in enumerate(self._order)}
+            self._removed.clear()
+            self._cursor = -1
+            self._shuffled_until = -1
+            self._new_pass = False
+            if self._current is not None:
+                self._cursor = self._positions.get(self._current, -1)
+                self._shuffled_until = self._cursor
+
+    def set_shuffle(self, enabled):
+        with self._lock:
+            self.shuffle = enabled
+            # Only slots not yet decided are affected; what already played stays played
+            self._shuffled_until = self._cursor
+            self._new_pass = False
+
+    def set_repeat(self, mode):
+        if mode not in (REPEAT_OFF, REPEAT_ALL, REPEAT_ONE):
+            raise ValueError(f"Unknown repeat mode: {mode!r}")
+        self.repeat = mode
+
+    def enqueue(self, song_id):
+        with self._lock:
+            self._up_next.append(song_id)
+
+    def insert_next(self, song_id):
+        with self._lock:
+            self._up_next.appendleft(song_id)
+
+    def up_next(self):
+        with self._lock:
+            return [song_id for song_id in self._up_next if self._alive(song_id)]
+
+    def jump_to(self, song_id):
+        # The user picked a song; the order continues from there
+        with self._lock:
+            self._set_current(song_id)
+            position = self._positions.get(song_id)
+            if position is None or song_id in self._removed:
+                return
+            if not self.shuffle:
+                self._end_new_pass()
+                self._cursor = position
+            elif position > self._cursor:
+                self._end_new_pass()
+                # Swap it into the next slot, so the songs not played yet all stay after the cursor
+                self._swap(self._cursor + 1, position)
+                self._cursor += 1
+                self._shuffled_until = max(self._shuffled_until, self._cursor)
+            # A song already played this pass is replayed, the pass continues where it was
+
+    def peek_next(self, auto=True):
+        """The id next() would return, without moving. auto=True means the current song ended by itself."""
+        with self._lock:
+            if auto and self.repeat == REPEAT_ONE and self._current is not None:
+                return self._current
+            for song_id in self._up_next:
+                if self._alive(song_id):
+                    return song_id
+            position = self._next_position()
+            return None if position is None else self._order[position]
+
+    def next(self, auto=False):
+        with self._lock:
+            if auto and self.repeat == REPEAT_ONE and self._current is not None:
+                return self._current
+            while self._up_next:
+                song_id = self._up_next.popleft()
+                if self._alive(song_id):
+                    self._set_current(song_id)
+                    return song_id
+            position = self._next_position()
+            if position is None:
+                return None
+            self._cursor = position
+            self._new_pass = False
+            self._set_current(self._order[position])
+            return self._current
+
+    def prev(self):
+        with self._lock:
+            while self._history:
+                song_id = self._history.pop()
+                if self._alive(song_id):
+                    self._current = song_id
+                    position = self._positions.get(song_id)
+                    if position is not None:
+                        self._end_new_pass()
+                        self._cursor = position
+                    return song_id
+            # No history (e.g. right after start), step back through the order instead
+            position = self._cursor - 1
+            while position >= 0 and self._order[position] in self._removed:
+                position -= 1
+            if position < 0:
+                return None
+            self._end_new_pass()
+            self._cursor = position
+            self._current = self._order[position]
+            return self._current
+
+    def _alive(self, song_id):
+        return song_id in self._positions and song_id not in self._removed
+
+    def _set_current(self, song_id):
+        if self._current is not None and self._current != song_id:
+            self._history.append(self._current)
+        self._current = song_id
+
+    def _next_position(self):
+        # Index of the next live slot after the cursor, wrapping around for repeat-all
+        position = None if self._new_pass else self._after(self._cursor)
+        if position is None and self.repeat == REPEAT_ALL and len(self):
+            if not self._new_pass:
+                # New pass: everything is unplayed again. Once only, a peek and the
+                # next() after it must get the same pick
+                self._shuffled_until = -1
+                self._new_pass = True
+            position = self._after(-1)
+        return position
+
+    def _end_new_pass(self):
+        # The cursor goes back into the pass that just ended, all of whose picks were made
+        if self._new_pass:
+            self._new_pass = False
+            self._shuffled_until = len(self._order) - 1
+
+    def _after(self, index):
+        position = index + 1
+        while position < len(self._order):
+            self._decide(position)
+            if self._order[position] not in self._removed:
+                return position
+            position += 1
+        return None
+
+    def _decide(self, position):
+        # Lazy Fisher-Yates step: pick this slot's song from the slots not played yet
+        if not self.shuffle or position <= self._shuffled_until:
+            return
+        self._swap(position, random.randrange(position, len(self._order)))
+        self._shuffled_until = position
+
+    def _swap(self, first, second):
+        if first != second:
+            order = self._order
+            order[first], order[second] = order[second], order[first]
+            self._positions[order[first]] = first
+            self._positions[order[second]] = second
+
+    def add(self, song_id):
+        with self._lock:
+            if song_id in self._positions:
+                self._removed.discard(song_id)
+                return
+            self._positions[song_id] = len(self._order)
+            self._order.append(song_id)
+
+    def remove(self, song_id):
+        with self._lock:
+            if song_id in self._positions:
+                self._removed.add(song_id)
+                if len(self._removed) * 2 > len(self._order):
+                    self._compact()
+
+    def _compact(self):
+        # Drop tombstones in one pass, keeping order and cursor
+        current = self._order[self._cursor] if 0 <= self._cursor < len(self._order) else None
+        kept = array('q', (song_id for song_id in self._order if song_id not in self._removed))
+        shuffled = sum(1 for song_id in self._order[:self._shuffled_until + 1] if song_id not in self._removed)
+        played = sum(1 for song_id in self._order[:self._cursor + 1] if song_id not in self._removed)
+        for song_id in self._removed:
+            del self._positions[song_id]
+        self._removed.clear()
+        self._order = kept
+        for index, song_id in enumerate(kept):
+            self._positions[song_id] = index
+        self._cursor = self._positions.get(current, played - 1)
+        self._shuffled_until = shuffled - 1
+
+    def on_song_change(self, event, songs):
+        # Listener for data_operations.add_song_listener
+        if event == 'insert':
+            for song in songs:
+                self.add(song['id'])
+        elif event == 'delete':
+            for song_id in songs:
+                self.remove(song_id)
 
 
 # Class to manage music playback operations
 class MusicPlayer(QWidget):
+    # Emitted from the waveform thread, handled on the GUI thread
+    waveform_ready = pyqtSignal(str, object)
+    # Audio engine events, emitted from its sink thread
+    engine_event = pyqtSignal(str, object, int)
+    track_prepared = pyqtSignal(int, object, str, float)
+
     def __init__(self, app):
         super().__init__()
         self.app = app
         self.time_label = QLabel(self)
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.update_prog_bar)
-        self.update_interval = 100
-        self.track_start_time = 0
+        self.update_interval = MAX_TICK_MS
         self.current_track_length = 0
-        self.track_lengths = {}
+        self.current_track = None
+        self.last_pos = 0
+        self.clock = PlaybackClock()
+        self.volume = 100
+        self.gain = 1.0
+        self.replay_gain_mode = REPLAY_GAIN_MODE
+        self.waveform_path = None
+        self._waveform_future = None  # the pending build for waveform_path, if any
+        self.waveform_ready.connect(self.on_waveform_ready)
+        self._shown_second = None
+        self._total_text = format_time(0)
+        self.preloader = TrackPreloader(self.track_prepared.emit)
+        self.track_prepared.connect(self.preloader_ready)
+        self.queue = PlayQueue()
+        self.engine = None
+        self.use_engine = AUDIO_ENGINE == 'stream'
+        self.engine_event.connect(self.on_engine_event)
+
+    def get_engine(self):
+        # Created on first play, the pygame sink needs the mixer that main initialises
+        if self.engine is None and self.use_engine:
+            if not audio_engine.available() or not os.path.isfile(audio_engine.FFMPEG):
+                print("Streaming engine needs numpy and ffmpeg, playing through pygame.mixer.music")
+                self.use_engine = False
+                return None
+            try:
+                sink = NullSink() if AUDIO_SINK == 'null' else PygameSink()
+                self.engine = AudioEngine(sink, CROSSFADE_SECONDS, CROSSFADE_CURVE)
+            except (RuntimeError, ValueError, pygame.error) as e:
+                print(f"Could not start the streaming engine, playing through pygame.mixer.music: {e}")
+                self.use_engine = False
+                return None
+            self.engine.set_volume(self.volume / 100.0)
+            self.engine.add_listener(lambda event, track, generation: self.engine_event.emit(event, track, generation))
+        return self.engine
+
+    def preloader_ready(self, generation, track, playable, started):
+        # Back on the GUI thread: queue the prepared track with the mixer unless it is stale
+        self.preloader.queue(generation, track, playable, started)
+
+    def on_engine_event(self, event, track, generation):
+        # The engine moved on by itself: a queued track became audible, or nothing is left.
+        # Events reach here after a hop through the event loop, drop any from before the last play or stop
+        if self.engine is None or generation != self.engine.generation:
+            return
+        if event == 'start' and track is not None:
+            # How far into the new track the UI caught up, like on_track_advanced in mixer mode
+            transition_stats.gapless.record(self.engine.position)
+            self.advance_to(track)
+        elif event == 'idle' and self.current_track is not None and not self.app.paused:
+            self.next_music(auto=True)
+
+    def is_busy(self):
+        # Playing and not paused, like pygame.mixer.music.get_busy()
+        if self.engine is not None:
+            return self.engine.playing and not self.engine.paused
+        return pygame.mixer.music.get_busy()
+
+    @property
+    def position(self):
+        return self.engine.position if self.engine is not None else self.clock.position
 
     def start_progress_timer(self):
         print("Starting progress timer")
+        self.adjust_tick_rate()
         self.timer.start(self.update_interval)
-        self.last_update_time = time.time()
+
+    def adjust_tick_rate(self, width=None):
+        # Tick about once per pixel the bar moves, a long track on a narrow bar barely needs ticking
+        if width is None:
+            width = self.app.prog_bar.width() if hasattr(self.app, 'prog_bar') else 0
+        if self.current_track_length > 0 and width > 0:
+            interval = int(self.current_track_length * 1000 / width)
+        else:
+            interval = MAX_TICK_MS
+        self.update_interval = min(max(interval, MIN_TICK_MS), MAX_TICK_MS)
+        if self.timer.isActive():
+            self.timer.setInterval(self.update_interval)
 
     def stop_progress_timer(self):
         print("Stopping progress timer")
@@ -34,43 +634,102 @@ class MusicPlayer(QWidget):
     def reset_progress_timer(self):
         if isinstance(self.app.prog_bar, QProgressBar):
             self.app.prog_bar.setValue(0) # resetting the progress bar
+        self._shown_second = None
 
     def update_prog_bar(self):
-        if pygame.mixer.music.get_busy():
-            current_time = pygame.mixer.music.get_pos() / 1000
-            total_length = self.current_track_length  # Assuming total_length is stored when the track starts
+        if self.engine is not None:
+            # Track changes arrive as engine events, ticks only move the bar
+            self.show_position()
+            return
 
-            if total_length is not None and total_length > 0:
-                progress = min(100, (current_time / total_length) * 100)
-            else:
-                progress = 0
+        # The mixer switches to a queued track on its own; get_pos() starting over tells us it did
+        mixer_ms = pygame.mixer.music.get_pos()
+        if self.preloader.pending and 0 <= mixer_ms < self.last_pos:
+            self.on_track_advanced(mixer_ms / 1000)
+        self.last_pos = mixer_ms
 
-            self.app.prog_bar.setValue(int(progress))
-            
-            # Update the time labels
-            current_time_str = time.strftime('%M:%S', time.gmtime(current_time))
-            total_time_str = time.strftime('%M:%S', time.gmtime(total_length))
-            self.time_label.setText(f"{current_time_str} / {total_time_str}")
+        if not pygame.mixer.music.get_busy():
+            if self.current_track is not None and not self.app.paused:
+                # Ended with nothing queued, fall back to starting the next track ourselves
+                self.next_music(auto=True)
+            return
+
+        self.clock.sync(mixer_ms)
+        self.show_position()
+
+    def show_position(self):
+        # Runs every tick: no formatting unless the displayed second changed
+        position = min(self.position, self.current_track_length) if self.current_track_length > 0 else self.position
+        bar = self.app.prog_bar
+        if self.current_track_length > 0 and not getattr(bar, 'dragging', False):
+            bar.setValue(int(position / self.current_track_length * bar.maximum()))
+        second = int(position)
+        if second != self._shown_second:
+            self._shown_second = second
+            self.time_label.setText(f"{format_time(second)} / {self._total_text}")
+
+    def set_track_length(self, length):
+        self.current_track_length = length
+        self.clock.duration = length
+        self._total_text = format_time(length)
+        self._shown_second = None
+        self.adjust_tick_rate()
+
+    def show_waveform(self, file_path):
+        # A stored overview is drawn right away, a missing one is built in the background
+        bar = self.app.prog_bar
+        if not hasattr(bar, 'set_waveform'):
+            return
+        self.waveform_path = file_path
+        # Skipping through tracks must not queue a decode per track ahead of the one playing
+        if self._waveform_future is not None:
+            self._waveform_future.cancel()
+            self._waveform_future = None
+        waveform = cached_waveform(file_path)
+        bar.set_waveform(waveform)
+        if waveform is None:
+            self._waveform_future = request_waveform(file_path)
+            self._waveform_future.add_done_callback(lambda future: self.waveform_ready.emit(
+                file_path, None if future.cancelled() or future.exception() else future.result()))
 
-            # For debugging
-            print(f"Progress: {progress:.2f}% (Current: {current_time:.2f}s, Total: {total_length:.2f}s)")
+    def on_waveform_ready(self, file_path, waveform):
+        if waveform is not None and file_path == self.waveform_path:
+            self.app.prog_bar.set_waveform(waveform)
+
+    def seek(self, seconds):
+        # play(start=) reopens the decoder at the position, for every format pygame plays
+        if self.current_track is None or not (self.is_busy() or self.app.paused):
+            return
+        if self.current_track_length > 0:
+            seconds = min(seconds, self.current_track_length)
+        seconds = max(seconds, 0.0)
+        if self.engine is not None:
+            self.engine.seek(seconds)
+            self.show_position()
+            return
+        try:
+            pygame.mixer.music.play(start=seconds)
+        except pygame.error as e:
+            print(f"Could not seek to {format_time(seconds)}: {e}")
+            return
+        if self.app.paused:
+            pygame.mixer.music.pause()
+        # get_pos() starts over after play(), which must not look like a gapless advance
+        self.last_pos = pygame.mixer.music.get_pos()
+        self.clock.seek(seconds, self.last_pos)
+        self.show_position()
+        self.queue_changed()
+
+    def seek_fraction(self, fraction):
+        self.seek(fraction * self.current_track_length)
 
     def get_track_name_from_index(self, index):
-        return self.app.tracks[index] if 0 <= index < len(self.app.tracks) else None
+        track = self.app.library.track_at(index)
+        return track.title if track else None
 
-    @lru_cache(maxsize=None)
     def get_track_length(self, file_path):
-        if file_path not in self.track_lengths:
-            if os.path.exists(file_path):
-                try:
-                    audio = AudioSegment.from_file(file_path)
-                    self.track_lengths[file_path] = len(audio) / 1000 
-                except Exception as e:
-                    print(f"Error getting track length: {e}")
-                    self.track_lengths[file_path] = 0
-            else:
-                self.track_lengths[file_path] = 0
-            return self.track_lengths[file_path]
+        # Cached per file across sessions; a miss reads only the container headers
+        return metadata_cache.duration(file_path) or 0
 
     # def get_track_name_from_index(self, index):
     #     all_songs = get_all_song()
@@ -83,7 +742,7 @@ class MusicPlayer(QWidget):
         # Ensure the passed item is a QListWidgetItem
         if isinstance(item, QListWidgetItem):
             index = self.app.music_list.row(item)
-            self.curr_track_index = index
+            self.app.curr_track_index = index
             
     def play_selected_track(self, item: QListWidgetItem | None = None):
         if item is None:
@@ -91,29 +750,136 @@ class MusicPlayer(QWidget):
 
         if isinstance(item, QListWidgetItem):
             title = item.text()
-            if song_data := retrieve_song({'title': title}):
-                file_path = song_data[0][1] # Assuming file_path is the second column
-                self.app.curr_playing_track = title
+            if track := self.app.library.by_title(title):
+                self.play_file(title, track.file_path, track.id)
+            else:
+                # Not in the index yet (e.g. added by another process), ask the database off the GUI thread
+                self.app.db.retrieve_song({'title': title}, columns=('id', 'file_path'), limit=1,
+                                          callback=lambda rows: self.play_retrieved(title, rows))
 
-                print(f"Playing: {title}")
+    def play_retrieved(self, title, rows):
+        if rows:
+            self.play_file(title, rows[0][1], rows[0][0])
+        else:
+            print(f"No song data found for {title}")
 
-                if os.path.exists(file_path):
-                    self.start_song(file_path)
-                else:
-                    print(f"File not found: {file_path}")
-            else:
-                print(f"No song data found for {title}")
+    def play_file(self, title, file_path, song_id=None):
+        self.app.curr_playing_track = title
+        print(f"Playing: {title}")
 
-    def start_song(self, file_path):
-        pygame.mixer.music.load(file_path)
-        pygame.mixer.music.play()
-        self.current_track_length = self.get_track_length(file_path)
+        if os.path.exists(file_path):
+            # The library usually knows the length already, probing the file is the fallback
+            track = self.app.library.get(song_id) if song_id is not None else None
+            if track is not None:
+                self.app.curr_track_index = self.app.library.position(track.id)
+                if self.queue.current != track.id:
+                    self.queue.jump_to(track.id)
+            self.current_track = track
+            self.start_song(file_path, track.duration if track and track.duration else None)
+            if song_id is not None:
+                # Play counts go through the write-behind queue, never a commit on the GUI thread
+                record_play(song_id)
+            self.prepare_upcoming()
+        else:
+            print(f"File not found: {file_path}")
+
+    def start_song(self, file_path, duration=None):
+        self.preloader.cancel()
+        self.gain = self.gain_for(self.current_track)
+        started = time.perf_counter()
+        if (engine := self.get_engine()) is not None:
+            try:
+                engine.play(file_path, self.gain, key=self.current_track)
+            except OSError as e:
+                print(f"Could not play {file_path}: {e}")
+                return
+        else:
+            # A decoded copy starts and seeks without running the codec
+            pygame.mixer.music.load(pcm_cache.playable_path(file_path))
+            pygame.mixer.music.play()
+            pygame.mixer.music.set_endevent(pygame.USEREVENT)
+        transition_stats.cold.record(time.perf_counter() - started)
+        self.last_pos = 0
+        self.clock.start(0.0, mixer_ms=pygame.mixer.music.get_pos() if self.engine is None else None)
+        self.set_track_length(duration or self.get_track_length(file_path))
+        self.set_volume(self.volume)
+        self.show_waveform(file_path)
+        pcm_cache.note_play(file_path)
         self.reset_progress_timer()
         self.start_progress_timer()
-        pygame.mixer.music.set_endevent(pygame.USEREVENT)
         self.app.paused = False
         self.app.play_butt.setIcon(self.app.pause_icon)
 
+    def upcoming_track(self):
+        # The track that plays when the current one ends
+        if self.current_track is None:
+            return None
+        song_id = self.queue.peek_next(auto=True)
+        return self.app.library.get(song_id) if song_id is not None else None
+
+    def prepare_upcoming(self):
+        # Hand the upcoming track to the engine, or to the preloader for a gapless mixer queue
+        track = self.upcoming_track()
+        if self.engine is None:
+            self.preloader.prepare(track)
+            return
+        try:
+            self.engine.queue(track.file_path if track else None, self.gain_for(track), key=track)
+        except OSError as e:
+            print(f"Could not prepare {track.title}: {e}")
+
+    def queue_changed(self):
+        # Whatever was prepared may no longer be what plays next
+        if self.current_track is not None:
+            self.prepare_upcoming()
+
+    def enqueue(self, song_id):
+        self.queue.enqueue(song_id)
+        self.queue_changed()
+
+    def play_next(self, song_id):
+        self.queue.insert_next(song_id)
+        self.queue_changed()
+
+    def set_shuffle(self, enabled):
+        if not enabled:
+            # Back to library order, continuing from the current song
+            self.queue.load(self.app.library.ids())
+        self.queue.set_shuffle(enabled)
+        self.queue_changed()
+
+    def cycle_repeat(self):
+        modes = (REPEAT_OFF, REPEAT_ALL, REPEAT_ONE)
+        self.queue.set_repeat(modes[(modes.index(self.queue.repeat) + 1) % len(modes)])
+        self.queue_changed()
+        return self.queue.repeat
+
+    def on_track_advanced(self, position):
+        # The mixer already started the queued track, catch the UI and bookkeeping up with it
+        track = self.preloader.take()
+        if track is None:
+            return
+        transition_stats.gapless.record(position)
+        self.clock.start(position, mixer_ms=position * 1000)
+        self.advance_to(track)
+
+    def advance_to(self, track):
+        # Bookkeeping for a track that started on its own after the previous one
+        if self.queue.next(auto=True) != track.id:
+            self.queue.jump_to(track.id)  # the queue changed after preparing, what plays wins
+        self.current_track = track
+        self.app.curr_track_index = self.app.library.position(track.id)
+        self.app.curr_playing_track = track.title
+        self.app.music_list.setCurrentRow(self.app.curr_track_index)
+        self.set_track_length(track.duration or self.get_track_length(track.file_path))
+        self.apply_gain(track)
+        self.show_waveform(track.file_path)
+        pcm_cache.note_play(track.file_path)
+        self.reset_progress_timer()
+        print(f"Playing: {track.title}")
+        record_play(track.id)
+        self.prepare_upcoming()
+
     # def play_selected_track(self, item: QListWidgetItem = None):
     #     # Play the selected track
     #     if item is None:
@@ -144,11 +910,15 @@ class MusicPlayer(QWidget):
     #             print(f"File path not found for title: {title}")
 
     def play_pause_music(self, from_button_click=False, from_next_prev=False):
-        if pygame.mixer.music.get_busy():
+        if self.is_busy():
             if self.app.paused and not from_button_click:
                 self.resume_music()
             elif not from_button_click and not from_next_prev:
-                pygame.mixer.music.pause()
+                if self.engine is not None:
+                    self.engine.pause()
+                else:
+                    pygame.mixer.music.pause()
+                self.clock.pause()
                 self.stop_progress_timer()  # Stop the timer when pausing
                 self.app.paused = True
                 self.app.play_butt.setIcon(self.app.play_icon)
@@ -160,7 +930,11 @@ class MusicPlayer(QWidget):
             self.start_progress_timer()  # Start the timer when playing
 
     def resume_music(self):
-        pygame.mixer.music.unpause()
+        if self.engine is not None:
+            self.engine.resume()
+        else:
+            pygame.mixer.music.unpause()
+        self.clock.resume(pygame.mixer.music.get_pos() if self.engine is None else None)
         self.start_progress_timer()  # Restart the timer when unpausing
         self.app.paused = False
         self.app.play_butt.setIcon(self.app.pause_icon)
@@ -170,7 +944,13 @@ class MusicPlayer(QWidget):
         self.reset_progress_timer()
 
     def rewind_track(self):
+        if self.engine is not None:
+            self.engine.seek(0.0)
+            return
         pygame.mixer.music.rewind()
+        # Whatever get_pos() does on rewind, restart the clock and the advance check from here
+        self.last_pos = pygame.mixer.music.get_pos()
+        self.clock.seek(0.0, self.last_pos)
 
     def prev_music(self):
         # Play the previous track or restart the current track
@@ -185,25 +965,19 @@ class MusicPlayer(QWidget):
     def double_click_prev(self):
         # Double click detected, play previous song
         self.app.double_click_timer.stop()
-        all_songs = get_all_song()
-        if not all_songs:
-            print("No songs available")
-            return 
-        
-        self.app.curr_track_index -= 1
-        if self.app.curr_track_index < 0:
-            self.app.curr_track_index = len(all_songs) - 1
-
-        self.play_song(all_songs)
-        
-        # if self.app.double_click_timer.isActive():
-        #     self.app.double_click_timer.stop()
-        #     self.play_previous_track()
-        # else:
-        #     self.app.double_click_timer.start()
+        if (song_id := self.queue.prev()) is None:
+            print("No previous song")
+            return
+        self.play_song(song_id)
 
     def stop_music(self):
-        pygame.mixer.music.stop()
+        self.preloader.cancel()
+        self.current_track = None
+        if self.engine is not None:
+            self.engine.stop()
+        else:
+            pygame.mixer.music.stop()
+        self.clock.stop()
         self.app.paused = False
         self.app.play_butt.setIcon(self.app.play_icon)
         self.stop_progress_timer()
@@ -218,33 +992,55 @@ class MusicPlayer(QWidget):
         self.app.music_list.setCurrentRow(self.app.curr_track_index)
         self.play_selected_track()
 
-    def next_music(self):
-        # Play the next track in the playlist
-        all_songs = get_all_song()
-        if not all_songs:
+    def next_music(self, auto=False):
+        # Play the next track in the queue; auto is True when the current one simply ended
+        if not len(self.app.library):
             print("No songs available")
             return
-        
-        self.app.curr_track_index += 1
-        if self.app.curr_track_index >= len(all_songs):
-            self.app.curr_track_index = 0
-
-        self.play_song(all_songs)
+        if (song_id := self.queue.next(auto=auto)) is None:
+            print("End of queue")
+            self.stop_music()
+            return
+        self.play_song(song_id)
 
-    def play_song(self, all_songs):
-        if 0 <= self.app.curr_track_index < len(all_songs):
-            curr_song = all_songs[self.app.curr_track_index]
+    def play_song(self, song_id):
+        if track := self.app.library.get(song_id):
+            self.app.curr_track_index = self.app.library.position(song_id)
             self.app.music_list.setCurrentRow(self.app.curr_track_index)
-            self.play_selected_track(QListWidgetItem(curr_song[2]))
+            self.play_track(track)
         else:
-            print(f"Invalid track index: {self.app.curr_track_index}")
-        # self.app.curr_track_index += 1
-        # if self.app.curr_track_index >= self.app.music_list.count():
-        #     self.app.curr_track_index = 0
+            print(f"Song {song_id} is no longer in the library")
 
-        # self.app.music_list.setCurrentRow(self.app.curr_track_index)
-        # self.play_selected_track()
+    def play_track(self, track):
+        # Play a library TrackRecord directly, no database lookup needed
+        self.play_file(track.title, track.file_path, track.id)
 
     def set_volume(self, value):
-        # Set the volume of the music player
-        pygame.mixer.music.set_volume(value / 100.0)
\ No newline at end of file
+        # Set the volume of the music player, on top of the current track's loudness gain
+        self.volume = value
+        if self.engine is not None:
+            # The engine applies each track's gain itself, so they stay right through a crossfade
+            self.engine.set_volume(value / 100.0)
+        else:
+            pygame.mixer.music.set_volume(min(1.0, value / 100.0 * self.gain))
+
+    def gain_for(self, track):
+        # pygame.mixer.music cannot amplify, so gains above 0 dB only take effect below full volume
+        gain = peak = None
+        if track is not None and self.replay_gain_mode != 'off':
+            if self.replay_gain_mode == 'album' and track.album_gain is not None:
+                gain, peak = track.album_gain, track.album_peak
+            else:
+                gain, peak = track.track_gain, track.track_peak
+        return gain_factor(gain, peak)
+
+    def apply_gain(self, track):
+        self.gain = self.gain_for(track)
+        if self.engine is not None:
+            self.engine.set_gain(self.gain, key=track)
+        self.set_volume(self.volume)
+
+    def shutdown(self):
+        self.preloader.shutdown()
+        if self.engine is not None:
+            self.engine.close()
\ No newline at end of file
@@ -0,0 +1,383 @@
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metadata_cache import metadata_cache
+
+# Analysis code gets numpy arrays when numpy is installed, memoryviews otherwise
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PCM_CACHE_DIR = os.environ.get(
+    'MUSIC_PLAYER_PCM_CACHE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pcm_cache'))
+# Total size of decoded files kept on disk, 0 turns the cache off
+PCM_CACHE_MAX_BYTES = int(os.environ.get('MUSIC_PLAYER_PCM_CACHE_BYTES', 2 * 1024 ** 3))
+# Plays in a session before a track is decoded in the background
+PCM_CACHE_MIN_PLAYS = 2
+# Leftovers of decodes that never finished are removed after this many seconds
+PCM_PARTIAL_MAX_AGE = 3600
+
+FFMPEG = os.environ.get('MUSIC_PLAYER_FFMPEG') or shutil.which('ffmpeg') or '/opt/homebrew/bin/ffmpeg'
+
+# The canonical 44 byte header: RIFF, fmt (PCM) and data chunks
+_WAV_HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
+_SAMPLE_WIDTH = 2  # decoded files are always signed 16-bit
+
+
+def _wav_header(sample_rate, channels, data_size):
+    block_align = channels * _SAMPLE_WIDTH
+    return _WAV_HEADER.pack(b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16, 1, channels,
+                            sample_rate, sample_rate * block_align, block_align,
+                            _SAMPLE_WIDTH * 8, b'data', data_size)
+
+
+def _read_wav_layout(f, size):
+    # (sample_rate, channels, data offset, data size) of a 16-bit PCM WAV, None for anything else
+    head = f.read(12)
+    if len(head) < 12 or head[:4] != b'RIFF' or head[8:12] != b'WAVE':
+        return None
+    fmt = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', f.read(16))
+            f.seek(chunk_size - 16 + (chunk_size & 1), os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if fmt is None or fmt[0] not in (1, 0xFFFE) or fmt[5] != 16:
+                return None
+            offset = f.tell()
+            return fmt[2], fmt[1], offset, min(chunk_size, size - offset)
+        else:
+            f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+
+def _decode_format(path):
+    # Decoded files keep the source's sample rate and are at most stereo
+    info = metadata_cache.info(path)
+    sample_rate = info.sample_rate if info and info.sample_rate else 44100
+    channels = min(info.channels, 2) if info and info.channels else 2
+    return sample_rate, channels
+
+
+class PCMAudio:
+    """Decoded 16-bit audio, memory-mapped from a WAV file.
+
+    samples is a memoryview of interleaved int16 samples straight over the
+    page cache, nothing is copied. Close it (or use it as a context
+    manager) to unmap the file.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            layout = _read_wav_layout(f, size)
+            if layout is None:
+                raise ValueError(f"{path} is not a 16-bit PCM WAV file")
+            self.sample_rate, self.channels, offset, data_size = layout
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data_size -= data_size % (self.channels * _SAMPLE_WIDTH)
+        self._view = memoryview(self._map)[offset:offset + data_size]
+        self.samples = self._view.cast('h')
+
+    @property
+    def frames(self):
+        return len(self.samples) // self.channels
+
+    @property
+    def duration(self):
+        return self.frames / self.sample_rate if self.sample_rate else 0.0
+
+    def array(self):
+        # (frames, channels) int16 array over the mapping, needs numpy
+        if np is None:
+            raise RuntimeError("PCMAudio.array() needs numpy")
+        return np.frombuffer(self._view, dtype='<i2').reshape(-1, self.channels)
+
+    def blocks(self, frames):
+        # Consecutive (frames, channels) arrays over the mapping, like PCMStream.blocks
+        samples = self.array()
+        for start in range(0, self.frames, frames):
+            yield samples[start:start + frames]
+
+    def close(self):
+        if self._map is None:
+            return
+        try:
+            self.samples.release()
+            self._view.release()
+            self._map.close()
+        except BufferError:
+            return  # arrays from array() still use the mapping, it goes away with them
+        self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PCMStream:
+    """Decoded 16-bit audio read once, straight from an ffmpeg pipe.
+
+    For a single pass over a file that is not worth keeping decoded, such
+    as analysing the whole library: nothing is written to disk. frames is
+    an estimate from the file's metadata until the stream has been read
+    to the end.
+    """
+    def __init__(self, path, sample_rate, channels, duration=None):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames = int(duration * sample_rate) if duration else 0
+        self._process = subprocess.Popen(
+            [FFMPEG, '-nostdin', '-v', 'error', '-i', path, '-f', 's16le', '-acodec', 'pcm_s16le',
+             '-ar', str(sample_rate), '-ac', str(channels), '-'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    @property
+    def duration(self):
+        return self.frames / self.sample_rate if self.sample_rate else 0.0
+
+    def blocks(self, frames):
+        """Yield (frames, channels) int16 arrays, all full but the last. Needs numpy.
+
+        Raises OSError at the end if ffmpeg could not decode the file.
+        """
+        if np is None:
+            raise RuntimeError("PCMStream.blocks() needs numpy")
+        frame_size = self.channels * _SAMPLE_WIDTH
+        read = 0
+        while data := self._process.stdout.read(frames * frame_size):
+            data = data[:len(data) - len(data) % frame_size]
+            read += len(data) // frame_size
+            yield np.frombuffer(data, dtype='<i2').reshape(-1, self.channels)
+        if self._process.wait() != 0:
+            raise OSError(f"ffmpeg exited with {self._process.returncode}")
+        self.frames = read
+
+    def close(self):
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.stdout.close()
+        self._process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PCMCache:
+    """Decoded copies of audio files, kept as WAV files in a size-capped directory.
+
+    A file is decoded once with ffmpeg, streamed straight to disk, and then
+    played and analysed from the decoded copy: the mixer loads and seeks a
+    WAV without decoding, and analysis maps it with open(). Entries are
+    keyed on path, mtime and size, so an edited file is decoded again.
+    Concurrent requests for the same file wait on one decode. The least
+    recently used entries are deleted once the total passes max_bytes.
+    """
+    def __init__(self, directory=PCM_CACHE_DIR, max_bytes=PCM_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.decodes = 0
+        self._lock = threading.Lock()
+        self._decoding = {}  # cache key -> Future of the cached path
+        self._plays = {}     # source path -> plays this session
+        self._executor = None
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _key(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        raw = f"{os.path.abspath(path)}\0{stat.st_mtime_ns}\0{stat.st_size}".encode('utf-8', 'surrogateescape')
+        return hashlib.sha1(raw).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key + '.wav')
+
+    def _is_pcm(self, path):
+        info = metadata_cache.info(path)
+        return info is not None and info.codec == 'pcm' and info.bitrate == info.sample_rate * info.channels * 16
+
+    def cached_path(self, path):
+        """Decoded copy of path if there is one (path itself for 16-bit WAVs), else None."""
+        if self._is_pcm(path):
+            return path
+        if not self.enabled or (key := self._key(path)) is None:
+            return None
+        entry = self._entry_path(key)
+        try:
+            os.utime(entry)  # the modification time is the LRU order
+        except OSError:
+            return None
+        self.hits += 1
+        return entry
+
+    def playable_path(self, path):
+        # What to hand the mixer: the decoded copy when cached, starts and seeks without decoding
+        return self.cached_path(path) or path
+
+    def decode(self, path):
+        """Return the path of a decoded copy of path, decoding it now if needed.
+
+        Returns None if the cache is off or the file cannot be decoded.
+        """
+        if (cached := self.cached_path(path)) is not None:
+            return cached
+        if not self.enabled or (key := self._key(path)) is None:
+            return None
+        with self._lock:
+            future = self._decoding.get(key)
+            owner = future is None
+            if owner:
+                future = self._decoding[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            result = self._decode(path, key)
+            future.set_result(result)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._decoding.pop(key, None)
+        return result
+
+    def open(self, path, decode=True):
+        """Map the decoded audio of path as a PCMAudio, or None if there is none."""
+        cached = self.decode(path) if decode else self.cached_path(path)
+        if cached is None:
+            return None
+        try:
+            return PCMAudio(cached)
+        except (OSError, ValueError) as e:
+            print(f"Error opening decoded audio for {path}: {e}")
+            return None
+
+    def stream(self, path):
+        """Decoded audio of path for one pass, without adding it to the cache.
+
+        The cached copy (a PCMAudio) when there is one, otherwise a
+        PCMStream decoding as it is read. Both have blocks(). None if
+        ffmpeg cannot be started.
+        """
+        audio = self.open(path, decode=False)
+        if audio is not None:
+            return audio
+        sample_rate, channels = _decode_format(path)
+        try:
+            return PCMStream(path, sample_rate, channels, metadata_cache.duration(path))
+        except OSError as e:
+            print(f"Error decoding {path}: {e}")
+            return None
+
+    def note_play(self, path):
+        # Tracks played again get decoded in the background, so the next play starts from the cache
+        if not self.enabled:
+            return
+        with self._lock:
+            plays = self._plays[path] = self._plays.get(path, 0) + 1
+        if plays == PCM_CACHE_MIN_PLAYS:
+            self.prefetch(path)
+
+    def prefetch(self, path):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pcm-decode')
+            executor = self._executor
+        return executor.submit(self.decode, path)
+
+    def _decode(self, path, key):
+        sample_rate, channels = _decode_format(path)
+        os.makedirs(self.directory, exist_ok=True)
+        entry = self._entry_path(key)
+        partial = f"{entry}.{os.getpid()}-{threading.get_ident()}.part"
+        started = time.perf_counter()
+        try:
+            with open(partial, 'wb') as out:
+                out.write(_wav_header(sample_rate, channels, 0))
+                out.flush()  # ffmpeg writes to the descriptor, the header must be there first
+                # ffmpeg writes raw samples straight after the header, nothing is held in memory
+                result = subprocess.run(
+                    [FFMPEG, '-nostdin', '-v', 'error', '-i', path, '-f', 's16le', '-acodec', 'pcm_s16le',
+                     '-ar', str(sample_rate), '-ac', str(channels), '-'],
+                    stdout=out, stderr=subprocess.PIPE)
+                if result.returncode != 0:
+                    raise OSError(result.stderr.decode('utf-8', 'replace').strip() or f"ffmpeg exited with {result.returncode}")
+                data_size = out.tell() - _WAV_HEADER.size
+                out.seek(0)
+                out.write(_wav_header(sample_rate, channels, data_size))
+            os.replace(partial, entry)
+        except OSError as e:
+            print(f"Error decoding {path}: {e}")
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+            return None
+        self.decodes += 1
+        print(f"Decoded {os.path.basename(path)} in {time.perf_counter() - started:.2f}s")
+        self._evict(keep=entry)
+        return entry
+
+    def _evict(self, keep=None):
+        entries = []
+        total = 0
+        now = time.time()
+        try:
+            with os.scandir(self.directory) as scan:
+                for item in scan:
+                    stat = item.stat()
+                    if item.name.endswith('.part'):
+                        if now - stat.st_mtime > PCM_PARTIAL_MAX_AGE:
+                            self._remove(item.path)
+                    elif item.name.endswith('.wav'):
+                        entries.append((stat.st_mtime, stat.st_size, item.path))
+                        total += stat.st_size
+        except OSError as e:
+            print(f"Error scanning decoded audio cache: {e}")
+            return
+        entries.sort()
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry != keep and self._remove(entry):
+                total -= size
+
+    def _remove(self, entry):
+        # Fails on Windows while the file is mapped, it is retried on the next eviction
+        try:
+            os.remove(entry)
+            return True
+        except OSError:
+            return False
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+pcm_cache = PCMCache()
@@ -0,0 +1,310 @@
+import sys
+
+from db_connection import get_db_connection, DatabaseError
+
+# MySQL error codes that mean a migration step was already applied by hand
+MYSQL_ALREADY_EXISTS = {
+    1050,  # Table already exists
+    1060,  # Duplicate column name
+    1061,  # Duplicate key name
+}
+
+def _move_album_covers(cursor, dialect):
+    # Copy every inline album_cover BLOB into the covers table and point the song at it
+    from data_operations import read_cover_bytes, store_covers
+
+    last_id = 0
+    while True:
+        cursor.execute("""
+            SELECT id, album_cover FROM songs
+            WHERE id > %s AND album_cover IS NOT NULL
+            ORDER BY id LIMIT 200
+        """, (last_id,))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        cover_ids = store_covers(cursor, [read_cover_bytes(cover) for _, cover in rows])
+        cursor.executemany("UPDATE songs SET cover_id = %s, album_cover = NULL WHERE id = %s",
+                           [(cover_id, id) for cover_id, (id, _) in zip(cover_ids, rows)])
+
+def _settle_id_caches(committed):
+    # Migrations that store covers stage ids in data_operations' caches, only loaded when one ran
+    data_operations = sys.modules.get('data_operations')
+    if data_operations is None:
+        return
+    if committed:
+        data_operations.publish_id_caches()
+    else:
+        data_operations.invalidate_id_caches()
+
+# Numbered schema migrations. Each entry is (version, description, steps) where
+# steps maps a dialect name to a list of SQL statements or callables taking
+# (cursor, dialect). Never edit a migration that has shipped, add a new one.
+MIGRATIONS = [
+    (1, "create core tables", {
+        'mysql': [
+            """
+            CREATE TABLE IF NOT EXISTS artists (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                name VARCHAR(255) NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS genres (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                name VARCHAR(255) NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS albums (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                title VARCHAR(255) NOT NULL,
+                artist_id INT NOT NULL,
+                release_year INT NULL,
+                album_type VARCHAR(50) NULL,
+                total_tracks INT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS songs (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                file_path VARCHAR(760) NOT NULL,
+                title VARCHAR(255) NOT NULL,
+                artist_id INT NOT NULL,
+                album_id INT NOT NULL,
+                genre_id INT NOT NULL,
+                album_cover LONGBLOB NULL,
+                track_number INT NULL,
+                duration DOUBLE NULL
+            )
+            """,
+        ],
+        'sqlite': [
+            """
+            CREATE TABLE IF NOT EXISTS artists (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS genres (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS albums (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                artist_id INTEGER NOT NULL,
+                release_year INTEGER NULL,
+                album_type TEXT NULL,
+                total_tracks INTEGER NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS songs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_path TEXT NOT NULL,
+                title TEXT NOT NULL,
+                artist_id INTEGER NOT NULL,
+                album_id INTEGER NOT NULL,
+                genre_id INTEGER NOT NULL,
+                album_cover BLOB NULL,
+                track_number INTEGER NULL,
+                duration REAL NULL
+            )
+            """,
+        ],
+    }),
+    (2, "indexes for song lookups and orphan checks", {
+        'mysql': [
+            # Older databases may have file_path as TEXT, which cannot be uniquely indexed
+            "ALTER TABLE songs MODIFY file_path VARCHAR(760) NOT NULL",
+            "CREATE UNIQUE INDEX ux_songs_file_path ON songs (file_path)",
+            "CREATE UNIQUE INDEX ux_artists_name ON artists (name)",
+            "CREATE UNIQUE INDEX ux_genres_name ON genres (name)",
+            "CREATE UNIQUE INDEX ux_albums_title_artist ON albums (title, artist_id)",
+            "CREATE INDEX ix_albums_artist_id ON albums (artist_id)",
+            "CREATE INDEX ix_songs_title ON songs (title(191))",
+            "CREATE INDEX ix_songs_album_id ON songs (album_id)",
+            "CREATE INDEX ix_songs_artist_id ON songs (artist_id)",
+            "CREATE INDEX ix_songs_genre_id ON songs (genre_id)",
+        ],
+        'sqlite': [
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_songs_file_path ON songs (file_path)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_artists_name ON artists (name)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_genres_name ON genres (name)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_albums_title_artist ON albums (title, artist_id)",
+            "CREATE INDEX IF NOT EXISTS ix_albums_artist_id ON albums (artist_id)",
+            "CREATE INDEX IF NOT EXISTS ix_songs_title ON songs (title)",
+            "CREATE INDEX IF NOT EXISTS ix_songs_album_id ON songs (album_id)",
+            "CREATE INDEX IF NOT EXISTS ix_songs_artist_id ON songs (artist_id)",
+            "CREATE INDEX IF NOT EXISTS ix_songs_genre_id ON songs (genre_id)",
+        ],
+    }),
+    (3, "content-addressed album covers", {
+        'mysql': [
+            """
+            CREATE TABLE IF NOT EXISTS covers (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                hash CHAR(64) NOT NULL,
+                data LONGBLOB NOT NULL,
+                UNIQUE KEY ux_covers_hash (hash)
+            )
+            """,
+            "ALTER TABLE songs ADD COLUMN cover_id INT NULL",
+            "CREATE INDEX ix_songs_cover_id ON songs (cover_id)",
+            _move_album_covers,
+        ],
+        'sqlite': [
+            """
+            CREATE TABLE IF NOT EXISTS covers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                hash TEXT NOT NULL UNIQUE,
+                data BLOB NOT NULL
+            )
+            """,
+            "ALTER TABLE songs ADD COLUMN cover_id INTEGER NULL",
+            "CREATE INDEX IF NOT EXISTS ix_songs_cover_id ON songs (cover_id)",
+            _move_album_covers,
+        ],
+    }),
+    (4, "full-text search index", {
+        'mysql': [
+            """
+            CREATE TABLE IF NOT EXISTS song_search (
+                song_id INT PRIMARY KEY,
+                title VARCHAR(255) NOT NULL,
+                artist VARCHAR(255) NULL,
+                album VARCHAR(255) NULL,
+                genre VARCHAR(255) NULL,
+                FULLTEXT KEY ft_song_search (title, artist, album, genre)
+            ) ENGINE=InnoDB
+            """,
+            """
+            INSERT IGNORE INTO song_search (song_id, title, artist, album, genre)
+            SELECT m.id, m.title, a.name, al.title, g.name
+            FROM songs m
+            JOIN artists a ON m.artist_id = a.id
+            JOIN albums al ON m.album_id = al.id
+            JOIN genres g ON m.genre_id = g.id
+            """,
+        ],
+        'sqlite': [
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS song_search
+            USING fts5(title, artist, album, genre, tokenize = 'unicode61 remove_diacritics 2')
+            """,
+            """
+            INSERT INTO song_search (rowid, title, artist, album, genre)
+            SELECT m.id, m.title, a.name, al.title, g.name
+            FROM songs m
+            JOIN artists a ON m.artist_id = a.id
+            JOIN albums al ON m.album_id = al.id
+            JOIN genres g ON m.genre_id = g.id
+            """,
+        ],
+    }),
+    (5, "play counts", {
+        'mysql': [
+            "ALTER TABLE songs ADD COLUMN play_count INT NOT NULL DEFAULT 0",
+            "ALTER TABLE songs ADD COLUMN last_played DOUBLE NULL",
+        ],
+        'sqlite': [
+            "ALTER TABLE songs ADD COLUMN play_count INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE songs ADD COLUMN last_played REAL NULL",
+        ],
+    }),
+    # Existing rows are hashed in the background by data_operations.backfill_content_hashes
+    (6, "content hashes for duplicate detection", {
+        'mysql': [
+            "ALTER TABLE songs ADD COLUMN content_hash CHAR(64) NULL",
+            "CREATE INDEX ix_songs_content_hash ON songs (content_hash)",
+        ],
+        'sqlite': [
+            "ALTER TABLE songs ADD COLUMN content_hash TEXT NULL",
+            "CREATE INDEX IF NOT EXISTS ix_songs_content_hash ON songs (content_hash)",
+        ],
+    }),
+    # Filled in the background by data_operations.backfill_loudness; the signature is the
+    # file's mtime and size when it was measured, so edited files are measured again
+    (7, "loudness normalisation", {
+        'mysql': [
+            "ALTER TABLE songs ADD COLUMN loudness DOUBLE NULL",
+            "ALTER TABLE songs ADD COLUMN track_gain DOUBLE NULL",
+            "ALTER TABLE songs ADD COLUMN track_peak DOUBLE NULL",
+            "ALTER TABLE songs ADD COLUMN loudness_signature VARCHAR(64) NULL",
+            "ALTER TABLE albums ADD COLUMN album_gain DOUBLE NULL",
+            "ALTER TABLE albums ADD COLUMN album_peak DOUBLE NULL",
+        ],
+        'sqlite': [
+            "ALTER TABLE songs ADD COLUMN loudness REAL NULL",
+            "ALTER TABLE songs ADD COLUMN track_gain REAL NULL",
+            "ALTER TABLE songs ADD COLUMN track_peak REAL NULL",
+            "ALTER TABLE songs ADD COLUMN loudness_signature TEXT NULL",
+            "ALTER TABLE albums ADD COLUMN album_gain REAL NULL",
+            "ALTER TABLE albums ADD COLUMN album_peak REAL NULL",
+        ],
+    }),
+]
+
+def _ensure_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL
+        )
+    """)
+
+def get_schema_version(cursor):
+    _ensure_migrations_table(cursor)
+    cursor.execute("SELECT MAX(version) FROM schema_migrations")
+    result = cursor.fetchone()
+    return (result[0] or 0) if result else 0
+
+def _run_step(cursor, dialect, step):
+    if callable(step):
+        step(cursor, dialect)
+        return
+    try:
+        cursor.execute(step)
+    except DatabaseError as e:
+        if dialect.name == 'mysql' and getattr(e, 'errno', None) in MYSQL_ALREADY_EXISTS:
+            print(f"Skipping migration step, already applied: {e}")
+        else:
+            raise
+
+# Bring the database up to the latest schema version. Returns the resulting version.
+def apply_migrations():
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                current = get_schema_version(cursor)
+                conn.commit()
+                for version, description, steps in MIGRATIONS:
+                    if version <= current:
+                        continue
+                    print(f"Applying schema migration {version}: {description}")
+                    conn.start_transaction()
+                    try:
+                        for step in steps[conn.dialect.name]:
+                            _run_step(cursor, conn.dialect, step)
+                        cursor.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                                       (version, description))
+                        conn.commit()
+                        _settle_id_caches(committed=True)
+                        current = version
+                    except Exception as e:
+                        # MySQL DDL commits implicitly, so a failed MySQL migration may be partially applied;
+                        # its steps tolerate being re-run
+                        conn.rollback()
+                        _settle_id_caches(committed=False)
+                        print(f"Schema migration {version} failed: {e}")
+                        break
+                print(f"Database schema is at version {current}")
+                return current
+    except DatabaseError as e:
+        print(f"Error applying schema migrations: {e}")
+        return None
@@ -0,0 +1,196 @@
+import bisect
+import heapq
+import threading
+import unicodedata
+from collections import defaultdict
+
+# How much a hit in each field counts towards a song's score
+FIELD_WEIGHTS = (('title', 3.0), ('artist', 2.0), ('album', 1.5), ('genre', 1.0))
+
+# Query terms shorter than this are only prefix-matched, never fuzzy-matched
+MIN_FUZZY_LENGTH = 3
+# Minimum trigram similarity for a vocabulary word to count as a typo of a query term
+FUZZY_THRESHOLD = 0.45
+# Upper bound on fuzzy candidates considered per query term
+MAX_FUZZY_WORDS = 50
+
+def normalize(text):
+    # Lowercase and strip accents so "Beyoncé" matches "beyonce"
+    text = unicodedata.normalize('NFKD', str(text or '')).casefold()
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+def tokenize(text):
+    word = []
+    for c in normalize(text):
+        if c.isalnum():
+            word.append(c)
+        elif word:
+            yield ''.join(word)
+            word = []
+    if word:
+        yield ''.join(word)
+
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _weighted_words(title, artist, album, genre):
+    # word -> weight of the most important field it appears in
+    fields = {'title': title, 'artist': artist, 'album': album, 'genre': genre}
+    words = {}
+    for field, weight in FIELD_WEIGHTS:
+        for word in tokenize(fields[field]):
+            words[word] = max(words.get(word, 0.0), weight)
+    return words
+
+
+class SearchIndex:
+    """In-memory prefix and trigram index over title, artist, album and genre.
+
+    Words of every song are kept in a sorted vocabulary for prefix lookups
+    and in a trigram index for typo-tolerant matching, so a query touches
+    only the vocabulary and the postings of the words it matches. Kept in
+    sync through data_operations.add_song_listener.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._documents = {}                    # song id -> {word: weight}
+        self._titles = {}                       # song id -> title
+        self._postings = defaultdict(dict)      # word -> {song id: weight}
+        self._vocabulary = []                   # sorted words, for prefix search
+        self._word_trigrams = defaultdict(set)  # trigram -> words containing it
+
+    def __len__(self):
+        return len(self._documents)
+
+    def title(self, song_id):
+        return self._titles.get(song_id)
+
+    def add(self, song_id, title=None, artist=None, album=None, genre=None):
+        words = _weighted_words(title, artist, album, genre)
+        with self._lock:
+            for word in self._index(song_id, title, words):
+                bisect.insort(self._vocabulary, word)
+
+    def _index(self, song_id, title, words):
+        # Index one song, returns the words new to the index; the caller puts them in the vocabulary
+        if song_id in self._documents:
+            self._remove(song_id)
+        self._documents[song_id] = words
+        self._titles[song_id] = title
+        new_words = []
+        for word, weight in words.items():
+            postings = self._postings[word]
+            if not postings:
+                new_words.append(word)
+                for trigram in trigrams(word):
+                    self._word_trigrams[trigram].add(word)
+            postings[song_id] = weight
+        return new_words
+
+    def remove(self, song_id):
+        with self._lock:
+            self._remove(song_id)
+
+    def _remove(self, song_id):
+        words = self._documents.pop(song_id, None)
+        self._titles.pop(song_id, None)
+        for word in words or ():
+            postings = self._postings.get(word)
+            if postings is None:
+                continue
+            postings.pop(song_id, None)
+            if not postings:
+                # Last song using this word, drop it from the vocabulary
+                del self._postings[word]
+                index = bisect.bisect_left(self._vocabulary, word)
+                if index < len(self._vocabulary) and self._vocabulary[index] == word:
+                    del self._vocabulary[index]
+                for trigram in trigrams(word):
+                    self._word_trigrams[trigram].discard(word)
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+            self._titles.clear()
+            self._postings.clear()
+            self._vocabulary.clear()
+            self._word_trigrams.clear()
+
+    def load(self, rows):
+        # rows of (id, title, artist, album, genre); new words are sorted into the vocabulary once, at the end
+        new_words = set()
+        for song_id, title, artist, album, genre in rows:
+            words = _weighted_words(title, artist, album, genre)
+            with self._lock:
+                new_words.update(self._index(song_id, title, words))
+        with self._lock:
+            # Skip words whose songs were removed again while loading
+            new_words = {word for word in new_words if word in self._postings}
+            self._vocabulary = sorted(new_words.union(self._vocabulary))
+
+    def on_song_change(self, event, songs):
+        # Listener for data_operations.add_song_listener
+        if event == 'delete':
+            for song_id in songs:
+                self.remove(song_id)
+        else:
+            for song in songs:
+                self.add(song['id'], song['title'], song['artist'], song['album'], song['genre'])
+
+    def _prefix_words(self, term):
+        start = bisect.bisect_left(self._vocabulary, term)
+        end = bisect.bisect_left(self._vocabulary, term + '\uffff')
+        return self._vocabulary[start:end]
+
+    def _fuzzy_words(self, term):
+        term_trigrams = trigrams(term)
+        shared = defaultdict(int)
+        for trigram in term_trigrams:
+            for word in self._word_trigrams.get(trigram, ()):
+                shared[word] += 1
+        scored = []
+        for word, count in shared.items():
+            similarity = count / (len(term_trigrams) + len(trigrams(word)) - count)
+            if similarity >= FUZZY_THRESHOLD:
+                scored.append((similarity, word))
+        return heapq.nlargest(MAX_FUZZY_WORDS, scored)
+
+    def _term_matches(self, term):
+        # word -> how well it matches the query term (1.0 exact, less for prefixes and typos)
+        matches = {}
+        for word in self._prefix_words(term):
+            matches[word] = 1.0 if word == term else 0.6 + 0.3 * len(term) / len(word)
+        if len(term) >= MIN_FUZZY_LENGTH:
+            for similarity, word in self._fuzzy_words(term):
+                matches.setdefault(word, 0.5 * similarity)
+        return matches
+
+    def search(self, query, limit=50):
+        """Return song ids matching every word of query, best match first."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        with self._lock:
+            scores = None
+            # Longest (most selective) terms first so the candidate set shrinks quickly
+            for term in sorted(terms, key=len, reverse=True):
+                term_scores = {}
+                for word, quality in self._term_matches(term).items():
+                    for song_id, weight in self._postings[word].items():
+                        if scores is not None and song_id not in scores:
+                            continue
+                        score = quality * weight
+                        if score > term_scores.get(song_id, 0.0):
+                            term_scores[song_id] = score
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {song_id: scores[song_id] + score for song_id, score in term_scores.items()}
+                if not scores:
+                    return []
+
+            ranked = heapq.nlargest(limit or len(scores), scores.items(),
+                                    key=lambda item: (item[1], -item[0]))
+            return [song_id for song_id, _ in ranked]
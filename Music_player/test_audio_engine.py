@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from audio_engine import BLOCK_FRAMES, RING_SECONDS, AudioEngine, NullSink
+from pcm_cache import _wav_header
+
+SAMPLE_RATE = 44100
+
+
+def write_wav(path, levels, seconds_per_level=1.0):
+    # Stereo 16-bit WAV holding each level for seconds_per_level seconds
+    frames = int(SAMPLE_RATE * seconds_per_level)
+    samples = np.repeat(np.asarray(levels, dtype=np.float32), frames)
+    data = (np.repeat(samples[:, None], 2, axis=1) * 32767).astype('<i2').tobytes()
+    with open(path, 'wb') as f:
+        f.write(_wav_header(SAMPLE_RATE, 2, len(data)) + data)
+    return path
+
+
+class RecordingSink(NullSink):
+    """Null sink that keeps what it was handed, as fast as the engine renders."""
+    def __init__(self):
+        super().__init__(realtime=False)
+        self.blocks = []
+
+    def start(self, pull):
+        def record(frames):
+            block = pull(frames)
+            if block is not None:
+                self.blocks.append(block[:, 0].copy())
+            return block
+        super().start(record)
+
+    def audio(self):
+        return np.concatenate(self.blocks) if self.blocks else np.zeros(0, dtype=np.float32)
+
+
+class AudioEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sink = RecordingSink()
+        self.events = []
+
+    def tearDown(self):
+        if hasattr(self, 'engine'):
+            self.engine.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def track(self, name, levels, seconds_per_level=1.0):
+        return write_wav(os.path.join(self.directory, name + '.wav'), levels, seconds_per_level)
+
+    def start_engine(self, crossfade=0.0, listener=None):
+        self.engine = AudioEngine(self.sink, crossfade=crossfade, curve='linear')
+        self.engine.add_listener(listener or (lambda event, key, generation: self.events.append((event, key))))
+
+    def wait_for(self, event, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while event not in self.events:
+            self.assertLess(time.monotonic(), deadline, f"no {event} event, got {self.events}")
+            time.sleep(0.005)
+
+    def test_gapless_handoff(self):
+        self.start_engine()
+        self.engine.play(self.track('a', [0.5]), key='a')
+        self.engine.queue(self.track('b', [0.25]), key='b')
+        self.wait_for(('idle', None))
+        self.assertEqual(self.events, [('end', 'a'), ('start', 'b'), ('end', 'b'), ('idle', None)])
+        audio = self.sink.audio()
+        self.assertEqual(len(audio), 2 * SAMPLE_RATE)
+        np.testing.assert_allclose(audio[:SAMPLE_RATE], 0.5, atol=1e-4)
+        np.testing.assert_allclose(audio[SAMPLE_RATE:], 0.25, atol=1e-4)
+
+    def test_crossfade_mixes_the_tracks(self):
+        self.start_engine(crossfade=0.5)
+        self.engine.play(self.track('a', [0.5]), key='a')
+        self.engine.queue(self.track('b', [0.25]), key='b')
+        self.wait_for(('idle', None))
+        self.assertEqual(self.events, [('start', 'b'), ('end', 'a'), ('end', 'b'), ('idle', None)])
+        audio = self.sink.audio()
+        # The fade starts on the first block boundary within crossfade seconds of the end
+        fade = 2 * SAMPLE_RATE - len(audio)
+        self.assertLessEqual(SAMPLE_RATE // 2 - fade, BLOCK_FRAMES)
+        start = SAMPLE_RATE - fade
+        np.testing.assert_allclose(audio[:start], 0.5, atol=1e-4)
+        t = np.arange(fade) / fade
+        np.testing.assert_allclose(audio[start:SAMPLE_RATE], 0.5 * (1 - t) + 0.25 * t, atol=1e-3)
+        np.testing.assert_allclose(audio[SAMPLE_RATE:], 0.25, atol=1e-4)
+
+    def test_queue_during_crossfade(self):
+        # The fade is longer than the ring, so the 'start' for b arrives while it is still rendering
+        crossfade = RING_SECONDS * 4
+        paths = {name: self.track(name, [0.25], crossfade * 2) for name in 'abc'}
+
+        def listener(event, key, generation):
+            self.events.append((event, key))
+            if event == 'start' and key == 'b':
+                self.engine.queue(paths['c'], key='c')
+
+        self.start_engine(crossfade, listener)
+        self.engine.play(paths['a'], key='a')
+        self.engine.queue(paths['b'], key='b')
+        self.wait_for(('idle', None))
+        self.assertEqual(self.events, [('start', 'b'), ('end', 'a'), ('start', 'c'),
+                                       ('end', 'b'), ('end', 'c'), ('idle', None)])
+        # Two fades of up to crossfade seconds each, no track cut short or started cold
+        overlap = int(SAMPLE_RATE * crossfade * 2) * 3 - len(self.sink.audio())
+        self.assertLessEqual(int(SAMPLE_RATE * crossfade) * 2 - overlap, 2 * BLOCK_FRAMES)
+
+    def test_seek_and_pause_position(self):
+        self.start_engine()
+        self.engine.play(self.track('a', [i / 20 for i in range(10)]), key='a')
+        self.engine.pause()
+        time.sleep(0.05)  # let a block the sink was already pulling land
+        paused_at = self.engine.position
+        time.sleep(0.1)
+        self.assertEqual(self.engine.position, paused_at)
+        self.engine.seek(5.0)
+        self.assertAlmostEqual(self.engine.position, 5.0)
+        consumed = len(self.sink.audio())
+        self.engine.resume()
+        self.wait_for(('idle', None))
+        # Playback carried on from the seek: the rest of the track, starting with the level at 5 s
+        audio = self.sink.audio()[consumed:]
+        self.assertEqual(len(audio), 5 * SAMPLE_RATE)
+        self.assertAlmostEqual(float(audio[0]), 5 / 20, places=3)
+
+    def test_play_and_stop_bump_the_generation(self):
+        generations = []
+        self.start_engine(listener=lambda event, key, generation: generations.append((event, generation)))
+        self.engine.play(self.track('a', [0.5], 5.0), key='a')
+        self.engine.play(self.track('b', [0.25], 0.1), key='b')
+        playing = self.engine.generation
+        deadline = time.monotonic() + 10
+        while ('idle', playing) not in generations:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.005)
+        # Nothing rendered for a reached the sink after b was played
+        self.assertTrue(all(generation == playing for event, generation in generations))
+        self.engine.stop()
+        self.assertEqual(self.engine.generation, playing + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+from music_player import REPEAT_ALL, PlayQueue
+
+
+class PlayQueueShuffleTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = self.new_queue()
+
+    def new_queue(self):
+        queue = PlayQueue()
+        queue.load(range(1000))
+        queue.set_shuffle(True)
+        return queue
+
+    def play_rest_of_pass(self):
+        played = [self.queue.current]
+        while (song_id := self.queue.next()) is not None:
+            played.append(song_id)
+        return played
+
+    def test_jump_plays_every_song_once(self):
+        for song_id in (900, 3, 999):
+            self.queue = self.new_queue()
+            self.queue.jump_to(song_id)
+            played = self.play_rest_of_pass()
+            self.assertEqual(played[0], song_id)
+            self.assertEqual(sorted(played), list(range(1000)))
+
+    def test_jump_mid_pass_plays_every_song_once(self):
+        played = [self.queue.next() for _ in range(100)]
+        target = next(song_id for song_id in range(1000) if song_id not in played)
+        self.queue.jump_to(target)
+        played += self.play_rest_of_pass()
+        self.assertEqual(sorted(played), list(range(1000)))
+
+    def test_peek_matches_next_across_passes(self):
+        queue = PlayQueue()
+        queue.load(range(10))
+        queue.set_shuffle(True)
+        queue.set_repeat(REPEAT_ALL)
+        for _ in range(200):
+            peeked = queue.peek_next()
+            self.assertEqual(queue.peek_next(), peeked)
+            self.assertEqual(queue.next(auto=True), peeked)
+
+    def test_repeat_all_plays_every_song_once_per_pass(self):
+        self.queue.set_repeat(REPEAT_ALL)
+        self.queue.jump_to(500)
+        self.play_pass_and_check()
+        for _ in range(3):
+            self.queue.peek_next()
+            self.play_pass_and_check(self.queue.next())
+
+    def play_pass_and_check(self, first=None):
+        played = [first if first is not None else self.queue.current]
+        played += [self.queue.next() for _ in range(999)]
+        self.assertEqual(sorted(played), list(range(1000)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+import hashlib
+import os
+import struct
+import threading
+from array import array
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from pcm_cache import pcm_cache
+
+# Building peak files needs numpy; reading and drawing them does not
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+WAVEFORM_CACHE_DIR = os.environ.get(
+    'MUSIC_PLAYER_WAVEFORM_CACHE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'waveforms'))
+# Total size of peak files kept; about 16 KB per track
+WAVEFORM_CACHE_MAX_BYTES = 128 * 1024 * 1024
+
+# Buckets in the finest level, enough for a full-width bar on a 4K screen
+WAVEFORM_BUCKETS = 4096
+# Each coarser level merges this many buckets of the one below
+WAVEFORM_LEVEL_FACTOR = 4
+# Levels stop once they would be smaller than this
+WAVEFORM_MIN_BUCKETS = 256
+# Buckets reduced per numpy pass, bounds memory whatever the track length
+WAVEFORM_BLOCK_BUCKETS = 256
+# Assumed length of a track whose metadata has none, only sets the bucket size
+WAVEFORM_GUESS_SECONDS = 300
+
+_MAGIC = b'MPWF'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHHIQ')  # magic, version, levels, sample rate, frames
+_LEVEL = struct.Struct('<II')       # frames per bucket, buckets
+
+# mins/maxs are int8 (sample >> 8), rms is uint8 (0-255 of full scale)
+WaveformLevel = namedtuple('WaveformLevel', 'bucket_frames mins maxs rms')
+
+
+class Waveform:
+    """Min/max/RMS overview of a track at a few resolutions."""
+    def __init__(self, sample_rate, frames, levels):
+        self.sample_rate = sample_rate
+        self.frames = frames
+        self.levels = levels  # finest first
+
+    @property
+    def duration(self):
+        return self.frames / self.sample_rate if self.sample_rate else 0.0
+
+    def level_for(self, buckets):
+        # The coarsest level that still has a bucket for each of the requested buckets
+        for level in reversed(self.levels):
+            if len(level.mins) >= buckets:
+                return level
+        return self.levels[0]
+
+    def columns(self, width):
+        """(min, max, rms) per pixel column, min/max in -128..127 and rms in 0..255."""
+        level = self.level_for(width)
+        count = len(level.mins)
+        if not count or width <= 0:
+            return []
+        columns = []
+        for x in range(width):
+            low = x * count // width
+            high = max(low + 1, (x + 1) * count // width)
+            columns.append((min(level.mins[low:high]), max(level.maxs[low:high]), max(level.rms[low:high])))
+        return columns
+
+
+def _cache_path(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    raw = f"{os.path.abspath(path)}\0{stat.st_mtime_ns}\0{stat.st_size}".encode('utf-8', 'surrogateescape')
+    return os.path.join(WAVEFORM_CACHE_DIR, hashlib.sha1(raw).hexdigest() + '.peaks')
+
+
+def _read(cache_path):
+    with open(cache_path, 'rb') as f:
+        magic, version, level_count, sample_rate, frames = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != _MAGIC or version != _VERSION:
+            return None
+        table = [_LEVEL.unpack(f.read(_LEVEL.size)) for _ in range(level_count)]
+        levels = []
+        for bucket_frames, count in table:
+            mins, maxs, rms = array('b'), array('b'), array('B')
+            for values in (mins, maxs, rms):
+                values.fromfile(f, count)
+            levels.append(WaveformLevel(bucket_frames, mins, maxs, rms))
+    return Waveform(sample_rate, frames, levels)
+
+
+def cached_waveform(path):
+    """The stored overview of path, or None. Reads a small file, never decodes audio."""
+    cache_path = _cache_path(path)
+    if cache_path is None:
+        return None
+    try:
+        return _read(cache_path)
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, struct.error) as e:
+        print(f"Error reading waveform of {path}: {e}")
+        return None
+
+
+def _reduce_block(samples, bucket_frames):
+    # Per-bucket min, max and mean square of an int16 (frames, channels) block, all channels together
+    full = len(samples) // bucket_frames
+    parts = []
+    if full:
+        buckets = samples[:full * bucket_frames].reshape(full, -1)
+        squares = np.square(buckets, dtype=np.float64).mean(axis=1)
+        parts.append((buckets.min(axis=1), buckets.max(axis=1), squares))
+    if len(samples) % bucket_frames:
+        tail = samples[full * bucket_frames:].reshape(1, -1)
+        parts.append((tail.min(axis=1), tail.max(axis=1), np.square(tail, dtype=np.float64).mean(axis=1)))
+    return [np.concatenate(values) for values in zip(*parts)]
+
+
+def _quantize(bucket_frames, mins, maxs, squares):
+    rms = np.sqrt(squares) * (255 / 32768)
+    return WaveformLevel(bucket_frames,
+                         (mins.astype(np.int32) >> 8).astype(np.int8),
+                         np.minimum((maxs.astype(np.int32) + 255) >> 8, 127).astype(np.int8),
+                         np.minimum(np.rint(rms), 255).astype(np.uint8))
+
+
+def _compute_levels(audio):
+    # audio.frames is only an estimate for a stream, the bucket count comes out close to WAVEFORM_BUCKETS
+    frames = audio.frames or audio.sample_rate * WAVEFORM_GUESS_SECONDS
+    bucket_frames = max(1, -(-frames // WAVEFORM_BUCKETS))
+    # Reduce the finest level a block at a time, memory stays flat whatever the track length
+    blocks = [_reduce_block(block, bucket_frames)
+              for block in audio.blocks(bucket_frames * WAVEFORM_BLOCK_BUCKETS) if len(block)]
+    if not blocks:
+        return None
+    mins, maxs, squares = (np.concatenate(values) for values in zip(*blocks))
+    levels = [_quantize(bucket_frames, mins, maxs, squares)]
+    while len(mins) // WAVEFORM_LEVEL_FACTOR >= WAVEFORM_MIN_BUCKETS:
+        starts = np.arange(0, len(mins), WAVEFORM_LEVEL_FACTOR)
+        mins = np.minimum.reduceat(mins, starts)
+        maxs = np.maximum.reduceat(maxs, starts)
+        squares = np.add.reduceat(squares, starts) / np.diff(np.append(starts, len(squares)))
+        bucket_frames *= WAVEFORM_LEVEL_FACTOR
+        levels.append(_quantize(bucket_frames, mins, maxs, squares))
+    return levels
+
+
+def _write(cache_path, sample_rate, frames, levels):
+    os.makedirs(WAVEFORM_CACHE_DIR, exist_ok=True)
+    partial = f"{cache_path}.{os.getpid()}-{threading.get_ident()}.part"
+    with open(partial, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, len(levels), sample_rate, frames))
+        for level in levels:
+            f.write(_LEVEL.pack(level.bucket_frames, len(level.mins)))
+        for level in levels:
+            for values in (level.mins, level.maxs, level.rms):
+                f.write(values.tobytes())
+    os.replace(partial, cache_path)
+
+
+def _prune(keep):
+    entries = []
+    total = 0
+    try:
+        with os.scandir(WAVEFORM_CACHE_DIR) as scan:
+            for item in scan:
+                if item.name.endswith('.peaks'):
+                    stat = item.stat()
+                    entries.append((stat.st_mtime, stat.st_size, item.path))
+                    total += stat.st_size
+    except OSError:
+        return
+    for _, size, entry in sorted(entries):
+        if total <= WAVEFORM_CACHE_MAX_BYTES:
+            break
+        if entry != keep:
+            try:
+                os.remove(entry)
+                total -= size
+            except OSError:
+                pass
+
+
+def build_waveform(path):
+    """Compute and store the overview of path; returns it, or None if it cannot be built.
+
+    Reads the decoded copy in the PCM cache when there is one, otherwise
+    streams the file from ffmpeg without adding it to the cache, which is
+    left to tracks that are played again. Slow for a track that is not
+    cached; keep it off the GUI thread.
+    """
+    if np is None:
+        return None
+    cache_path = _cache_path(path)
+    if cache_path is None:
+        return None
+    audio = pcm_cache.stream(path)
+    if audio is None:
+        return None
+    try:
+        with audio:
+            levels = _compute_levels(audio)
+            sample_rate, frames = audio.sample_rate, audio.frames
+    except OSError as e:
+        print(f"Error decoding {path}: {e}")
+        return None
+    if levels is None:
+        return None
+    try:
+        _write(cache_path, sample_rate, frames, levels)
+        _prune(cache_path)
+    except OSError as e:
+        print(f"Error storing waveform of {path}: {e}")
+    # Hand back the same arrays the GUI gets when reading the file
+    return Waveform(sample_rate, frames, [
+        WaveformLevel(level.bucket_frames, array('b', level.mins.tobytes()), array('b', level.maxs.tobytes()),
+                      array('B', level.rms.tobytes())) for level in levels])
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def request_waveform(path):
+    # Future of the overview of path, built on a background thread when it is not stored yet
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='waveform')
+        executor = _executor
+    return executor.submit(lambda: cached_waveform(path) or build_waveform(path))
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)